@@ -0,0 +1,135 @@
+import random
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import DEFAULT_DB_ALIAS, transaction
+from django.utils.translation import ugettext as _
+
+from rest_framework import exceptions
+from rest_framework_jwt.authentication import JSONWebTokenAuthentication
+from rest_framework_jwt.utils import (
+    jwt_payload_handler as default_jwt_payload_handler,
+)
+
+from core.models import User
+
+
+# User fields copied into the token and back into the request user.
+CLAIM_FIELDS = ('email', 'first_name', 'last_name')
+
+
+def _version_key(user_id):
+    return 'token_version:{}'.format(user_id)
+
+
+def jwt_payload_handler(user):
+    """
+    Adds what the views need about the user to the default claims: the role,
+    the relevant classes and children, and the version of the claims.
+    """
+    payload = default_jwt_payload_handler(user)
+
+    payload.update({name: getattr(user, name) for name in CLAIM_FIELDS})
+    payload.update({
+        'groups': sorted(user.group_names),
+        'role': user.role,
+        'classes': user.class_ids,
+        'children': user.children_ids,
+        'version': user.token_version,
+    })
+
+    return payload
+
+
+def _revoke(user_ids):
+    cache.delete_many([_version_key(user_id) for user_id in user_ids])
+
+
+def revoke_tokens(user_ids):
+    """
+    Invalidates the tokens issued to `user_ids`, whose claims changed.
+
+    The cached versions are dropped right away, and again after the commit
+    for the ones read by concurrent requests in between.
+    """
+    user_ids = set(user_ids)
+    if not user_ids:
+        return
+
+    # A random version, rather than an increment, is never taken back by
+    # a save of an instance loaded with an older one.
+    User.objects.filter(id__in=user_ids).update(
+        token_version=random.randint(1, 2 ** 31 - 1))
+
+    _revoke(user_ids)
+    transaction.on_commit(lambda: _revoke(user_ids))
+
+
+def token_version(user_id):
+    """
+    Returns the current version of the claims of `user_id`, `None` for
+    missing and inactive users.
+
+    Versions are cached for `SCHOOL_TOKEN_VERSION_CACHE_TIMEOUT` seconds:
+    `revoke_tokens` only drops them from the cache of its own process, so
+    this bounds how long other processes accept revoked claims.
+    """
+    key = _version_key(user_id)
+
+    version = cache.get(key)
+    if version is None:
+        version = User.objects.filter(id=user_id, is_active=True).values_list(
+            'token_version', flat=True).first()
+
+        if version is not None:
+            cache.add(key, version,
+                      settings.SCHOOL_TOKEN_VERSION_CACHE_TIMEOUT)
+
+    return version
+
+
+class ClaimsJSONWebTokenAuthentication(JSONWebTokenAuthentication):
+    """
+    Builds the request user from the claims of the token instead of loading
+    it, with its groups, from the database on every request.
+
+    The user carries the fields of `CLAIM_FIELDS` and the cached properties
+    `group_names`, `class_ids` and `children_ids`; any other field is
+    deferred and loaded on access. Tokens are rejected once the version of
+    their claims is bumped by `revoke_tokens`, and `auth/refresh/` issues
+    one with the current claims. Tokens without claims are authenticated
+    as before.
+    """
+
+    def authenticate_credentials(self, payload):
+        if 'version' not in payload:
+            return super().authenticate_credentials(payload)
+
+        user_id = payload.get('user_id', None)
+
+        version = token_version(user_id)
+        if version is None:
+            raise exceptions.AuthenticationFailed(_('Invalid signature.'))
+
+        if version != payload['version']:
+            raise exceptions.AuthenticationFailed(
+                _('Token has been revoked, refresh it or log in again.'))
+
+        # Inactive users have no version.
+        fields = {name: payload.get(name, '') for name in CLAIM_FIELDS}
+        fields.update({'id': user_id,
+                       'is_active': True,
+                       'token_version': version})
+
+        names = [f.attname for f in User._meta.concrete_fields
+                 if f.attname in fields]
+        user = User.from_db(DEFAULT_DB_ALIAS, names,
+                            [fields[name] for name in names])
+
+        user.__dict__.update({
+            'group_names': frozenset(payload.get('groups', [])),
+            'class_ids': payload.get('classes', []),
+            'children_ids': payload.get('children', []),
+        })
+
+        return user
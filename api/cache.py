@@ -0,0 +1,134 @@
+import hashlib
+import uuid
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+
+from rest_framework.response import Response
+
+
+CACHE_PREFIX = 'notifications'
+
+# Included in every key: invalidated by changes that can show up in any
+# feed, such as the name of a class or a subject.
+GLOBAL_SCOPE = 'global'
+
+
+def _version_key(scope):
+    return '{}:version:{}'.format(CACHE_PREFIX, scope)
+
+
+def scope_versions(scopes):
+    """
+    Returns the current version of each of `scopes`. Missing versions are
+    created at random, so a version evicted from the cache never brings an
+    older entry back.
+    """
+    keys = [_version_key(scope) for scope in scopes]
+    versions = cache.get_many(keys)
+
+    for key in keys:
+        if key not in versions:
+            cache.add(key, uuid.uuid4().hex, None)
+            versions[key] = cache.get(key)
+
+    return [versions[key] for key in keys]
+
+
+def _invalidate(scopes):
+    cache.set_many({_version_key(scope): uuid.uuid4().hex
+                    for scope in scopes}, None)
+
+
+def invalidate(scopes):
+    """
+    Discards the cached lists that depend on any of `scopes`.
+
+    Done right away, and again after the commit for the lists cached by
+    concurrent requests in between with the old rows.
+    """
+    scopes = set(scopes)
+    if not scopes:
+        return
+
+    _invalidate(scopes)
+    transaction.on_commit(lambda: _invalidate(scopes))
+
+
+def notification_scopes(owner_id, target_student_id, target_class_id):
+    """ Scopes whose feeds render a notification with these targets. """
+    scopes = {'all'}
+
+    for scope, id in (('owner', owner_id),
+                      ('student', target_student_id),
+                      ('class', target_class_id)):
+        if id is not None:
+            scopes.add('{}:{}'.format(scope, id))
+
+    return scopes
+
+
+def user_scopes(user_id):
+    """ Scopes whose feeds render the user `user_id`. """
+    return {'all',
+            'owner:{}'.format(user_id),
+            'student:{}'.format(user_id)}
+
+
+def class_scopes(class_ids):
+    """ Scopes whose feeds render the classes `class_ids`. """
+    return {'all'} | {'class:{}'.format(id) for id in class_ids}
+
+
+class ScopedListCacheMixin(object):
+    """
+    Caches the serialized page of `list` by scope instead of by user.
+
+    `get_cache_scopes` names the sets of rows the list is built from, for
+    example the notifications of a class, and the key combines the version
+    of each of them with the query string. Users sharing the same scopes
+    share the entry, and changing a row only discards the entries of its
+    scopes (see `api.signals`).
+
+    Entries expire after `SCHOOL_NOTIFICATION_CACHE_TIMEOUT` seconds, which
+    bounds the staleness of changes made without signals.
+    """
+
+    def get_cache_scopes(self, request):
+        """ Scopes of the list, `None` to skip the cache. """
+        return None
+
+    def get_cache_key(self, request, scopes):
+        scopes = [GLOBAL_SCOPE] + sorted(scopes)
+        key = (self.__class__.__name__,
+               tuple(zip(scopes, scope_versions(scopes))),
+               request.get_full_path())
+
+        return '{}:list:{}'.format(
+            CACHE_PREFIX, hashlib.md5(repr(key).encode('utf-8')).hexdigest())
+
+    def personalize(self, request, data):
+        """ Fills the per user values of a cached list in. """
+        return data
+
+    def list(self, request, *args, **kwargs):
+        scopes = self.get_cache_scopes(request)
+        if scopes is None:
+            return super().list(request, *args, **kwargs)
+
+        key = self.get_cache_key(request, scopes)
+
+        cached = cache.get(key)
+        if cached is None:
+            response = super().list(request, *args, **kwargs)
+            if response.status_code == 200:
+                cache.set(key, (response.data, response.get('Link', None)),
+                          settings.SCHOOL_NOTIFICATION_CACHE_TIMEOUT)
+
+            return response
+
+        data, link = cached
+
+        return Response(self.personalize(request, data),
+                        headers={'Link': link} if link else None)
@@ -0,0 +1,66 @@
+import calendar
+import hashlib
+
+from django.utils.cache import get_conditional_response
+from django.utils.http import http_date, quote_etag
+
+from core.models import Generation
+
+
+class ConditionalListMixin(object):
+    """
+    Answers conditional `GET` requests without running the list queries.
+
+    The `ETag` hashes the requesting user, the query string and the
+    generation counters of `generation_keys`, the tables rendered by the
+    view, and `Last-Modified` is the latest change of those counters. A
+    request whose `If-None-Match` or `If-Modified-Since` still matches gets
+    a `304 Not Modified` without running the list queries.
+    """
+    generation_keys = ()
+
+    def get_etag_scope(self, request):
+        return (self.__class__.__name__,
+                request.user.pk,
+                request.get_full_path())
+
+    def get_validators(self, request):
+        values, modified = Generation.objects.current(self.generation_keys)
+
+        scope = self.get_etag_scope(request) + tuple(values)
+        etag = quote_etag(hashlib.md5(repr(scope).encode('utf-8')).hexdigest())
+
+        last_modified = calendar.timegm(modified.utctimetuple()) \
+            if modified is not None else None
+
+        return etag, last_modified
+
+    def not_modified(self, request):
+        """
+        Returns a `304 Not Modified` response if the client copy is still
+        current, `None` otherwise.
+        """
+        self.etag, self.last_modified = self.get_validators(request)
+
+        return get_conditional_response(request,
+                                        etag=self.etag,
+                                        last_modified=self.last_modified)
+
+    def finalize_response(self, request, response, *args, **kwargs):
+        response = super().finalize_response(request, response,
+                                             *args, **kwargs)
+
+        if response.status_code == 200 and \
+                getattr(self, 'etag', None) is not None:
+            response['ETag'] = self.etag
+            if self.last_modified is not None:
+                response['Last-Modified'] = http_date(self.last_modified)
+
+        return response
+
+    def list(self, request, *args, **kwargs):
+        response = self.not_modified(request)
+        if response is not None:
+            return response
+
+        return super().list(request, *args, **kwargs)
@@ -0,0 +1,178 @@
+import datetime
+import hashlib
+
+from django.conf import settings
+from django.core import signing
+from django.core.cache import cache
+from django.db.models import Q
+from django.utils import timezone
+from django.utils.crypto import constant_time_compare, salted_hmac
+from django.utils.http import quote_etag
+
+from core.ical import CALENDAR_TYPES, notification_events, timetable_events
+from core.models import (Notification,
+                         User,
+                         GROUP_ADMIN_ID,
+                         GROUP_PARENT_ID,
+                         GROUP_STUDENT_ID,
+                         GROUP_TEACHER_ID,
+                         )
+from core.timetable import CLASS, TEACHER, get_timetable
+
+from .authentication import token_version
+from .cache import scope_versions
+
+
+SALT = 'api.ical'
+
+
+def _password_check(user):
+    # Changing the password revokes the feeds of the user.
+    return salted_hmac(SALT, user.password).hexdigest()[::4]
+
+
+def feed_token(user):
+    """ Returns the signed token of the calendar feed of `user`. """
+    return signing.dumps([user.pk, _password_check(user)], salt=SALT)
+
+
+def _build_plan(user_id, check):
+    user = User.objects.filter(id=user_id, is_active=True).first()
+    if user is None or \
+            not constant_time_compare(_password_check(user), check):
+        return None
+
+    plan = {'user_id': user.id,
+            'role': user.role,
+            'class_id': user.attends_id,
+            'timetables': [],
+            'scopes': []}
+
+    # Same scopes as the cached notification lists.
+    if user.role == GROUP_ADMIN_ID:
+        plan['scopes'] = ['all']
+
+    elif user.role == GROUP_TEACHER_ID:
+        plan['timetables'] = [(TEACHER, user.id)]
+        plan['scopes'] = ['owner:{}'.format(user.id)]
+
+    elif user.role == GROUP_PARENT_ID:
+        plan['timetables'] = [(CLASS, id) for id in user.class_ids]
+        plan['scopes'] = sorted(
+            ['student:{}'.format(id) for id in user.children_ids] +
+            ['class:{}'.format(id) for id in user.class_ids])
+
+    elif user.role == GROUP_STUDENT_ID:
+        plan['timetables'] = [(CLASS, id) for id in user.class_ids]
+        plan['scopes'] = ['student:{}'.format(user.id)] + \
+            ['class:{}'.format(id) for id in user.class_ids]
+
+    return plan
+
+
+def load_plan(token):
+    """
+    Returns what the feed of `token` is built from, `None` for bad or
+    revoked tokens.
+
+    Plans are cached by version of the claims of the user, which is bumped
+    as the role, the classes, the children or the password change (see
+    `api.authentication.revoke_tokens`), so that polling a feed does not
+    load the user.
+    """
+    try:
+        user_id, check = signing.loads(token, salt=SALT)
+
+    except (signing.BadSignature, TypeError, ValueError):
+        return None
+
+    version = token_version(user_id)
+    if version is None:
+        return None
+
+    # Tokens issued before and after a password change share the version,
+    # but not the check.
+    key = 'ical:plan:{}:{}:{}'.format(user_id, version, check)
+
+    plan = cache.get(key)
+    if plan is None:
+        # Invalid tokens are cached as well.
+        plan = _build_plan(user_id, check) or False
+        cache.set(key, plan, settings.SCHOOL_CALENDAR_CACHE_TIMEOUT)
+
+    return plan or None
+
+
+def _notifications_key(plan):
+    scopes = plan['scopes']
+    key = (plan['user_id'], tuple(zip(scopes, scope_versions(scopes))))
+
+    return 'ical:notifications:{}'.format(
+        hashlib.md5(repr(key).encode('utf-8')).hexdigest())
+
+
+def _notification_rows(plan):
+    queryset = Notification.objects.filter(type__in=CALENDAR_TYPES,
+                                           date__isnull=False)
+    user_id = plan['user_id']
+
+    if plan['role'] == GROUP_ADMIN_ID:
+        pass
+
+    elif plan['role'] == GROUP_TEACHER_ID:
+        queryset = queryset.filter(owner_id=user_id)
+
+    elif plan['role'] == GROUP_PARENT_ID:
+        queryset = queryset.filter(inbox_entries__recipient_id=user_id)
+
+    elif plan['role'] == GROUP_STUDENT_ID:
+        queryset = queryset.filter(
+            Q(target_student_id=user_id) |
+            Q(target_student__isnull=True, target_class_id=plan['class_id']))
+
+    else:
+        queryset = queryset.none()
+
+    return list(queryset.order_by('date', 'id').values_list(
+        'id', 'type', 'title', 'description', 'date', 'timestamp'))
+
+
+class Feed(object):
+    """
+    Calendar of a `load_plan` plan: the weekly timetables, read from the
+    timetable cache, and the dated exams and tasks, cached until the
+    notifications of the scopes of the plan change.
+
+    `etag` is derived from the cached timetables and the versions of the
+    scopes, so that answering a poll whose copy is still current reads the
+    cache only.
+    """
+
+    def __init__(self, plan):
+        self.plan = plan
+
+        today = timezone.localdate()
+        self.monday = today - datetime.timedelta(days=today.weekday())
+
+        self.timetables = [get_timetable(kind, id)
+                           for kind, id in plan['timetables']]
+        self.notifications_key = _notifications_key(plan)
+
+        self.etag = quote_etag(hashlib.md5(repr(
+            (self.monday, self.timetables, self.notifications_key),
+        ).encode('utf-8')).hexdigest())
+
+    def notification_rows(self):
+        rows = cache.get(self.notifications_key)
+        if rows is None:
+            rows = _notification_rows(self.plan)
+            cache.set(self.notifications_key, rows,
+                      settings.SCHOOL_CALENDAR_CACHE_TIMEOUT)
+
+        return rows
+
+    def events(self):
+        for grid in self.timetables:
+            yield from timetable_events(grid, self.monday)
+
+        yield from notification_events(self.notification_rows())
@@ -0,0 +1,330 @@
+import datetime
+import heapq
+import json
+import operator
+from base64 import urlsafe_b64decode, urlsafe_b64encode
+from collections import OrderedDict, namedtuple
+from functools import cmp_to_key, reduce
+
+from django.core.exceptions import ValidationError as DjangoValidationError
+from django.db.models import F, Q
+from django.utils.translation import ugettext_lazy as _
+
+from rest_framework.exceptions import ValidationError
+from rest_framework.pagination import BasePagination
+from rest_framework.response import Response
+from rest_framework.utils.urls import replace_query_param
+
+
+Cursor = namedtuple('Cursor', ['position', 'reverse'])
+
+
+def _after(name, value, descending, nullable):
+    """
+    Rows strictly after `value` on a single column.
+
+    Postgres sorts NULLs first in descending order and last in ascending
+    order, so a NULL boundary is handled explicitly.
+    """
+    if descending:
+        if value is None:
+            return Q(**{name + '__isnull': False})
+
+        return Q(**{name + '__lt': value})
+
+    if value is None:
+        return None
+
+    after = Q(**{name + '__gt': value})
+    if nullable:
+        after |= Q(**{name + '__isnull': True})
+
+    return after
+
+
+def _equal(name, value):
+    if value is None:
+        return Q(**{name + '__isnull': True})
+
+    return Q(**{name: value})
+
+
+def keyset_filter(columns, position):
+    """
+    Build the `WHERE` clause selecting the rows after `position`.
+
+    `columns` is a sequence of `(name, descending, nullable)` tuples in
+    ordering priority and `position` the values of the boundary row. The
+    result is the expanded form of the row comparison
+    `(c1, c2, ...) < (v1, v2, ...)`, which Postgres serves with an index
+    seek on a matching composite index.
+    """
+    conditions = []
+    prefix = Q()
+
+    for (name, descending, nullable), value in zip(columns, position):
+        after = _after(name, value, descending, nullable)
+        if after is not None:
+            conditions.append(prefix & after)
+
+        prefix &= _equal(name, value)
+
+    if not conditions:
+        return None
+
+    return reduce(operator.or_, conditions)
+
+
+def ordering_key(columns):
+    """
+    Sort key ordering instances by the attributes of `columns`, a sequence
+    of `(name, descending)` pairs, as Postgres orders the rows: NULLs sort
+    after every value.
+    """
+    def compare(a, b):
+        for name, descending in columns:
+            x, y = getattr(a, name), getattr(b, name)
+            if x == y:
+                continue
+
+            if x is None or y is None:
+                result = 1 if x is None else -1
+
+            else:
+                result = 1 if x > y else -1
+
+            return -result if descending else result
+
+        return 0
+
+    return cmp_to_key(compare)
+
+
+def merge_querysets(querysets, ordering):
+    """
+    Merges the rows of `querysets`, each one ordered by the annotations
+    named in `ordering`, into a single iterator in that order.
+    """
+    columns = [(order.lstrip('-'), order.startswith('-'))
+               for order in ordering]
+
+    return heapq.merge(*querysets, key=ordering_key(columns))
+
+
+def encode_position(position):
+    return [value.isoformat() if isinstance(value, datetime.datetime)
+            else value
+            for value in position]
+
+
+def encode_token(position):
+    """ Opaque, URL safe form of a keyset position. """
+    return urlsafe_b64encode(json.dumps(
+        encode_position(position), separators=(',', ':')).encode('utf-8'),
+    ).decode('ascii')
+
+
+def decode_token(token, fields):
+    """
+    Reverse of `encode_token`. `fields` are the model fields used to parse
+    the values of the position back. Raises `ValueError` on a bad token.
+    """
+    try:
+        position = json.loads(
+            urlsafe_b64decode(token.encode('ascii')).decode('utf-8'))
+
+        if not isinstance(position, list) or len(position) != len(fields):
+            raise ValueError()
+
+        return [None if value is None else field.to_python(value)
+                for field, value in zip(fields, position)]
+
+    except (TypeError, AttributeError, DjangoValidationError):
+        raise ValueError('Invalid token')
+
+
+class NotificationCursorPagination(BasePagination):
+    """
+    Keyset pagination over `(date, id)`.
+
+    Unlike `rest_framework.pagination.CursorPagination` the cursor stores
+    the full sort key of the boundary row, so there is never an OFFSET to
+    skip and every page is a seek on the ordering index. Rows inserted
+    while paging do not shift the following pages.
+
+    The response body is the plain list of results, as in the unpaginated
+    case. Next and previous pages are advertised through the `Link` header.
+
+    A list of querysets with the same ordering, such as the live and the
+    archived notifications, is paginated as a single one: each of them is
+    sought to the cursor and their first rows are merged.
+    """
+    cursor_query_param = 'cursor'
+    page_size_query_param = 'size'
+    page_size = 20
+    max_page_size = 100
+    ordering = ('-date', '-id')
+    invalid_cursor_message = _('Invalid cursor')
+
+    def get_ordering(self, view):
+        return tuple(getattr(view, 'cursor_ordering', self.ordering))
+
+    def get_page_size(self, request):
+        size = request.query_params.get(self.page_size_query_param, None)
+
+        if size is None:
+            if self.cursor_query_param in request.query_params:
+                return self.page_size
+
+            return None
+
+        try:
+            size = int(size)
+
+        except ValueError:
+            raise ValidationError(_('Bad page size'))
+
+        return max(0, min(size, self.max_page_size))
+
+    def decode_cursor(self, request):
+        encoded = request.query_params.get(self.cursor_query_param, None)
+        if encoded is None:
+            return None
+
+        try:
+            tokens = json.loads(
+                urlsafe_b64decode(encoded.encode('ascii')).decode('utf-8'))
+            position = tokens['p']
+            reverse = bool(tokens.get('r', 0))
+
+            if len(position) != len(self.columns):
+                raise ValueError()
+
+            position = [
+                None if value is None else field.to_python(value)
+                for (name, field), value in zip(self.fields, position)
+            ]
+
+        except (TypeError, ValueError, KeyError, AttributeError,
+                DjangoValidationError):
+            raise ValidationError(self.invalid_cursor_message)
+
+        return Cursor(position=position, reverse=reverse)
+
+    def encode_cursor(self, cursor):
+        tokens = {'p': encode_position(cursor.position)}
+        if cursor.reverse:
+            tokens['r'] = 1
+
+        encoded = urlsafe_b64encode(
+            json.dumps(tokens, separators=(',', ':')).encode('utf-8'))
+
+        return replace_query_param(self.base_url,
+                                   self.cursor_query_param,
+                                   encoded.decode('ascii'))
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.page_size = self.get_page_size(request)
+        if self.page_size is None:
+            return None
+
+        self.base_url = request.build_absolute_uri()
+
+        querysets = queryset if isinstance(queryset, (list, tuple)) \
+            else [queryset]
+
+        # The sort key is exposed through annotations so that it can be read
+        # back from the instances and so that filtering and ordering reuse
+        # the joins of the role queryset.
+        ordering = self.get_ordering(view)
+        annotations = OrderedDict(
+            ('cursor_{}'.format(i), F(order.lstrip('-')))
+            for i, order in enumerate(ordering)
+        )
+        querysets = [queryset.annotate(**annotations)
+                     for queryset in querysets]
+
+        self.fields = [
+            (name, querysets[0].query.annotations[name].output_field)
+            for name in annotations
+        ]
+        self.columns = [
+            (name, order.startswith('-'), getattr(field, 'null', False))
+            for (name, field), order in zip(self.fields, ordering)
+        ]
+
+        self.cursor = self.decode_cursor(request)
+        reverse = self.cursor is not None and self.cursor.reverse
+
+        columns = [(name, descending != reverse, nullable)
+                   for name, descending, nullable in self.columns]
+
+        condition = None
+        if self.cursor is not None:
+            condition = keyset_filter(columns, self.cursor.position)
+
+        pages = []
+        for queryset in querysets:
+            queryset = queryset.order_by(*[
+                F(name).desc() if descending else F(name).asc()
+                for name, descending, nullable in columns
+            ])
+
+            if self.cursor is not None:
+                queryset = queryset.none() if condition is None \
+                    else queryset.filter(condition)
+
+            pages.append(queryset[:self.page_size + 1]
+                         if self.page_size else [])
+
+        results = list(heapq.merge(*pages, key=ordering_key([
+            (name, descending) for name, descending, nullable in columns
+        ])))[:self.page_size + 1]
+
+        has_more = len(results) > self.page_size
+        results = results[:self.page_size]
+
+        if reverse:
+            results.reverse()
+            self.has_previous = has_more
+            self.has_next = True
+
+        else:
+            self.has_previous = self.cursor is not None
+            self.has_next = has_more
+
+        self.page = results
+
+        return self.page
+
+    def _position(self, instance):
+        return [getattr(instance, name) for name, field in self.fields]
+
+    def get_next_link(self):
+        if not self.has_next or not self.page:
+            return None
+
+        return self.encode_cursor(Cursor(
+            position=self._position(self.page[-1]), reverse=False))
+
+    def get_previous_link(self):
+        if not self.has_previous or not self.page:
+            return None
+
+        return self.encode_cursor(Cursor(
+            position=self._position(self.page[0]), reverse=True))
+
+    def get_paginated_response(self, data):
+        links = []
+
+        next_link = self.get_next_link()
+        if next_link is not None:
+            links.append('<{}>; rel="next"'.format(next_link))
+
+        previous_link = self.get_previous_link()
+        if previous_link is not None:
+            links.append('<{}>; rel="prev"'.format(previous_link))
+
+        headers = {'Link': ', '.join(links)} if links else None
+
+        return Response(data, headers=headers)
@@ -12,16 +12,18 @@ class IsOwnerOrTargetReadOnly(permissions.BasePermission):
         # if request.method in permissions.SAFE_METHODS:
         #     return True
 
-        if obj.owner == request.user:
+        user = request.user
+
+        if obj.owner_id == user.id:
             return True
 
         # Write permissions are only allowed to the owner of the snippet.
+        # Compared by id, the targets are not loaded.
         if request.method in permissions.SAFE_METHODS:
-            if obj.target_student is not None:
-                return obj.target_student == request.user
+            if obj.target_student_id is not None:
+                return obj.target_student_id == user.id
 
-            elif obj.target_class is not None:
-                return obj.target_class.students.filter(id=request.user.id).\
-                        exists()
+            elif obj.target_class_id is not None:
+                return obj.target_class_id == getattr(user, 'attends_id', None)
 
         return False
@@ -0,0 +1,130 @@
+from django.core.exceptions import FieldDoesNotExist
+from django.db.models import Prefetch
+
+from rest_framework import serializers
+
+
+def _relations(serializer, model, prefix='', in_prefetch=False):
+    """
+    Yields `(lookup, prefetch)` for every relation rendered by `serializer`.
+
+    Forward foreign keys reached without crossing a to-many relation can be
+    joined with `select_related`; everything below a to-many relation has
+    to go through `prefetch_related`. To-many relations rendered as primary
+    keys only fetch the keys.
+    """
+    for field in serializer.fields.values():
+        if field.write_only or field.source == '*' or '.' in field.source:
+            continue
+
+        pk_only = False
+
+        if isinstance(field, serializers.ListSerializer):
+            nested = field.child
+
+        elif isinstance(field, serializers.BaseSerializer):
+            nested = field
+
+        elif isinstance(field, serializers.ManyRelatedField):
+            pk_only = isinstance(field.child_relation,
+                                 serializers.PrimaryKeyRelatedField)
+            nested = None
+
+        elif isinstance(field, serializers.RelatedField):
+            # Primary keys are read from the `<name>_id` column.
+            if isinstance(field, serializers.PrimaryKeyRelatedField):
+                continue
+
+            nested = None
+
+        else:
+            continue
+
+        try:
+            model_field = model._meta.get_field(field.source)
+
+        except FieldDoesNotExist:
+            continue
+
+        if not model_field.is_relation:
+            continue
+
+        lookup = prefix + field.source
+        to_many = model_field.many_to_many or model_field.one_to_many
+        prefetch = in_prefetch or to_many
+
+        if pk_only and to_many:
+            related = model_field.related_model
+            # Reverse foreign keys match the rows back through their column.
+            only = ['pk'] if model_field.many_to_many \
+                else ['pk', model_field.field.name]
+
+            yield Prefetch(lookup, queryset=related._default_manager.only(
+                *only)), True
+            continue
+
+        yield lookup, prefetch
+
+        if nested is not None:
+            yield from _relations(nested,
+                                  model_field.related_model,
+                                  prefix=lookup + '__',
+                                  in_prefetch=prefetch)
+
+
+def get_prefetch_plan(serializer, model):
+    """
+    Returns the `select_related` and `prefetch_related` lookups needed to
+    render instances of `model` with `serializer` (a serializer class or
+    instance) in a number of queries that does not depend on their count.
+    """
+    if isinstance(serializer, type):
+        serializer = serializer()
+
+    if isinstance(serializer, serializers.ListSerializer):
+        serializer = serializer.child
+
+    select_related = []
+    prefetch_related = []
+
+    for lookup, prefetch in _relations(serializer, model):
+        if prefetch:
+            prefetch_related.append(lookup)
+
+        else:
+            select_related.append(lookup)
+
+    # Prefetching a reverse foreign key points the children back at the
+    # parent instances, so the same instance can be reached again further
+    # down. Django decides whether a level is already fetched from its first
+    # instance only, so shallower lookups must run first to leave every
+    # instance of a level in the same state.
+    prefetch_related.sort(
+        key=lambda lookup: getattr(lookup, 'prefetch_to', lookup).count('__'))
+
+    return select_related, prefetch_related
+
+
+def prefetch_for_serializer(queryset, serializer):
+    select_related, prefetch_related = get_prefetch_plan(serializer,
+                                                         queryset.model)
+
+    if select_related:
+        queryset = queryset.select_related(*select_related)
+
+    if prefetch_related:
+        queryset = queryset.prefetch_related(*prefetch_related)
+
+    return queryset
+
+
+class SerializerPrefetchMixin:
+    """
+    Applies the prefetch plan of the view serializer to the queryset of
+    `list` and `retrieve`.
+    """
+
+    def filter_queryset(self, queryset):
+        queryset = super().filter_queryset(queryset)
+
+        return prefetch_for_serializer(queryset, self.get_serializer())
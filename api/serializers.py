@@ -8,19 +8,102 @@ from rest_framework import serializers
 from core.models import User, Notification, Class, Subject, Schedule
 
 
-class GroupSerializer(serializers.ModelSerializer):
+def parse_field_paths(value):
+    """
+    Parses a comma separated list of dotted field paths into a tree, e.g.
+    `'id,target_class.id,target_class.name'` into
+    `{'id': {}, 'target_class': {'id': {}, 'name': {}}}`.
+    """
+    if not value:
+        return None
+
+    tree = {}
+    for path in value.split(','):
+        node = tree
+        for name in path.strip().split('.'):
+            if name:
+                node = node.setdefault(name, {})
+
+    return tree
+
+
+class DynamicFieldsMixin(object):
+    """
+    Sparse fieldsets through the `fields` and `expand` query parameters.
+
+    `fields` lists the fields to render and `expand` the nested relations
+    to render as objects. Dotted paths reach into nested serializers, and
+    a relation selected through a dotted path in `fields` is expanded, e.g.
+    `?fields=id,title,target_class.id,target_class.name&expand=owner`.
+
+    When any of them is given, relations that were not expanded render as
+    primary keys, read from the foreign key column or from a prefetch of
+    the related keys. Without them the serializer renders in full.
+    """
+
+    def _get_field_spec(self):
+        parent = self.parent
+        if isinstance(parent, serializers.ListSerializer):
+            parent = parent.parent
+
+        # Nested serializers get their part of the spec from the parent.
+        if parent is not None:
+            return getattr(self, '_field_spec', (None, None))
+
+        request = self.context.get('request', None)
+        if request is None:
+            return None, None
+
+        return (parse_field_paths(request.query_params.get('fields', None)),
+                parse_field_paths(request.query_params.get('expand', None)))
+
+    def get_fields(self):
+        fields = super().get_fields()
+
+        only, expand = self._get_field_spec()
+        if only is None and expand is None:
+            return fields
+
+        for name, field in list(fields.items()):
+            if only is not None and name not in only:
+                del fields[name]
+                continue
+
+            many = isinstance(field, serializers.ListSerializer)
+            nested = field.child if many else field
+            if not isinstance(nested, serializers.BaseSerializer):
+                continue
+
+            nested_only = only.get(name) if only is not None else None
+            nested_expand = expand.get(name) if expand is not None else None
+
+            if not nested_only and nested_expand is None:
+                kwargs = {'read_only': True, 'many': many}
+                if field.source is not None:
+                    kwargs['source'] = field.source
+
+                fields[name] = serializers.PrimaryKeyRelatedField(**kwargs)
+
+            else:
+                nested._field_spec = (nested_only or None, nested_expand or {})
+
+        return fields
+
+
+class GroupSerializer(DynamicFieldsMixin, serializers.ModelSerializer):
     class Meta:
         model = Group
         fields = ('name',)
 
 
-class SubjectSerializer(serializers.ModelSerializer):
+class SubjectSerializer(DynamicFieldsMixin, serializers.ModelSerializer):
     class Meta:
         model = Subject
         fields = ('id', 'name',)
 
 
-class TeacherSerializer(serializers.HyperlinkedModelSerializer):
+class TeacherSerializer(DynamicFieldsMixin,
+                        serializers.HyperlinkedModelSerializer):
     groups = GroupSerializer(many=True)
 
     class Meta:
@@ -32,7 +115,8 @@ class TeacherSerializer(serializers.HyperlinkedModelSerializer):
                   )
 
 
-class ClassTeacherSubjectSerializer(serializers.HyperlinkedModelSerializer):
+class ClassTeacherSubjectSerializer(DynamicFieldsMixin,
+                                    serializers.HyperlinkedModelSerializer):
     # TODO Different serializers for students and teachers.
     teacher = TeacherSerializer()
     subject = SubjectSerializer()
@@ -46,7 +130,8 @@ class ClassTeacherSubjectSerializer(serializers.HyperlinkedModelSerializer):
                   )
 
 
-class ClassStudentSerializer(serializers.HyperlinkedModelSerializer):
+class ClassStudentSerializer(DynamicFieldsMixin,
+                             serializers.HyperlinkedModelSerializer):
     teachers_subjects = ClassTeacherSubjectSerializer(many=True, read_only=True)
 
     class Meta:
@@ -57,7 +142,8 @@ class ClassStudentSerializer(serializers.HyperlinkedModelSerializer):
                   )
 
 
-class StudentSerializer(serializers.HyperlinkedModelSerializer):
+class StudentSerializer(DynamicFieldsMixin,
+                        serializers.HyperlinkedModelSerializer):
     subjects = SubjectSerializer(many=True)
     attends = ClassStudentSerializer()
 
@@ -71,7 +157,8 @@ class StudentSerializer(serializers.HyperlinkedModelSerializer):
                   )
 
 
-class ClassSerializer(serializers.HyperlinkedModelSerializer):
+class ClassSerializer(DynamicFieldsMixin,
+                      serializers.HyperlinkedModelSerializer):
     students = StudentSerializer(many=True, read_only=True)
     teachers_subjects = ClassTeacherSubjectSerializer(many=True, read_only=True)
 
@@ -84,7 +171,39 @@ class ClassSerializer(serializers.HyperlinkedModelSerializer):
                   )
 
 
-class UserSerializer(serializers.HyperlinkedModelSerializer):
+class RosterStudentSerializer(DynamicFieldsMixin,
+                              serializers.HyperlinkedModelSerializer):
+    subjects = SubjectSerializer(many=True)
+
+    class Meta:
+        model = User
+        fields = ('id',
+                  'first_name',
+                  'last_name',
+                  'subjects',
+                  )
+
+
+class ClassRosterSerializer(DynamicFieldsMixin,
+                            serializers.HyperlinkedModelSerializer):
+    """
+    Compact `ClassSerializer`: the teachers and subjects of the class are
+    rendered once, at class level, instead of again under every student.
+    """
+    students = RosterStudentSerializer(many=True, read_only=True)
+    teachers_subjects = ClassTeacherSubjectSerializer(many=True, read_only=True)
+
+    class Meta:
+        model = Class
+        fields = ('id',
+                  'name',
+                  'students',
+                  'teachers_subjects',
+                  )
+
+
+class UserSerializer(DynamicFieldsMixin,
+                     serializers.HyperlinkedModelSerializer):
     groups = GroupSerializer(many=True)
     subjects = SubjectSerializer(many=True)
     attends = ClassSerializer()
@@ -102,12 +221,14 @@ class UserSerializer(serializers.HyperlinkedModelSerializer):
                   )
 
 
-class NotificationSerializer(serializers.HyperlinkedModelSerializer):
+class NotificationSerializer(DynamicFieldsMixin,
+                             serializers.HyperlinkedModelSerializer):
     owner = TeacherSerializer(read_only=True)
     target_student = StudentSerializer(read_only=True)
     target_class = ClassSerializer(read_only=True)
     subject = SubjectSerializer(read_only=True)
     timestamp = serializers.DateTimeField(read_only=True)
+    read_at = serializers.SerializerMethodField()
 
     class Meta:
         model = Notification
@@ -124,17 +245,28 @@ class NotificationSerializer(serializers.HyperlinkedModelSerializer):
             'custom_fields',
             'subject',
             'icon',
+            'deliver_at',
+            'read_at',
         )
 
+    def get_read_at(self, notification):
+        # Annotated from the inbox on the feeds of parents.
+        read_at = getattr(notification, 'read_at', None)
+        if read_at is None:
+            return None
+
+        return serializers.DateTimeField().to_representation(read_at)
+
 
-class ScheduleClassSerializer(serializers.ModelSerializer):
+class ScheduleClassSerializer(DynamicFieldsMixin, serializers.ModelSerializer):
     class Meta:
         model = Class
         fields = ('id',
                   'name')
 
 
-class ScheduleClassTeacherSubjectSerializer(serializers.HyperlinkedModelSerializer):
+class ScheduleClassTeacherSubjectSerializer(DynamicFieldsMixin,
+                                            serializers.HyperlinkedModelSerializer):
     teacher = TeacherSerializer(read_only=True)
     subject = SubjectSerializer(read_only=True)
     teaches_in = ClassSerializer(read_only=True)
@@ -147,7 +279,8 @@ class ScheduleClassTeacherSubjectSerializer(serializers.HyperlinkedModelSerializ
                   )
 
 
-class ScheduleSerializer(serializers.HyperlinkedModelSerializer):
+class ScheduleSerializer(DynamicFieldsMixin,
+                         serializers.HyperlinkedModelSerializer):
     class_teacher_subject = ScheduleClassTeacherSubjectSerializer(read_only=True)
 
     class Meta:
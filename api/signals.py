@@ -0,0 +1,268 @@
+from django.db.models import Q
+from django.db.models.signals import (m2m_changed,
+                                      post_delete,
+                                      post_init,
+                                      post_save,
+                                      pre_delete,
+                                      )
+from django.dispatch import receiver
+
+from core.models import (ArchivedNotification,
+                         Class,
+                         ClassTeacherSubject,
+                         Notification,
+                         Subject,
+                         User,
+                         )
+
+from .authentication import revoke_tokens
+from .cache import (GLOBAL_SCOPE,
+                    class_scopes,
+                    invalidate,
+                    notification_scopes,
+                    user_scopes,
+                    )
+
+
+TARGETS = ('owner_id', 'target_student_id', 'target_class_id')
+
+
+@receiver(post_init, sender=Notification)
+def notification_loaded(sender, instance, **kwargs):
+    # Remember the loaded targets, whose feeds also change when the
+    # notification is moved to other ones. Deferred fields are not loaded.
+    instance._loaded_targets = [instance.__dict__.get(name, None)
+                                for name in TARGETS]
+
+
+@receiver(post_save, sender=Notification)
+@receiver(post_delete, sender=Notification)
+def notification_changed(sender, instance, raw=False, **kwargs):
+    if raw:
+        return
+
+    targets = [getattr(instance, name) for name in TARGETS]
+    invalidate(notification_scopes(*targets) |
+               notification_scopes(*instance._loaded_targets))
+    instance._loaded_targets = targets
+
+
+def _owner_feed_scopes(student_ids, class_ids):
+    """
+    Scopes of the teachers listing notifications, live or archived, to the
+    students `student_ids` or the classes `class_ids`, which their feeds
+    render.
+    """
+    targets = Q(target_student__in=student_ids) | \
+        Q(target_class__in=class_ids)
+
+    owner_ids = set()
+    for model in (Notification, ArchivedNotification):
+        owner_ids.update(model.objects.filter(targets).values_list(
+            'owner_id', flat=True).distinct())
+
+    return {'owner:{}'.format(id) for id in owner_ids - {None}}
+
+
+def _class_feed_scopes(class_ids):
+    """
+    Scopes whose feeds render the classes `class_ids`: their own, those of
+    their students, rendered with the class they attend, and those of the
+    teachers of notifications to either.
+    """
+    class_ids = set(class_ids) - {None}
+    if not class_ids:
+        return set()
+
+    student_ids = list(User.objects.filter(
+        attends_id__in=class_ids).values_list('id', flat=True))
+
+    return class_scopes(class_ids).union(
+        _owner_feed_scopes(student_ids, class_ids),
+        *[user_scopes(id) for id in student_ids])
+
+
+def _user_feed_scopes(user_ids, class_ids):
+    """
+    Scopes whose feeds render the users `user_ids`: their own, those of
+    `class_ids`, the classes they attend, rendered with their students,
+    those of the teachers of notifications to the users or to `class_ids`,
+    and those rendering the assignments of the teachers among them.
+    """
+    user_ids = list(user_ids)
+    class_ids = set(class_ids)
+
+    scopes = class_scopes(class_ids).union(
+        _owner_feed_scopes(user_ids, class_ids),
+        *[user_scopes(id) for id in user_ids])
+
+    return scopes | _class_feed_scopes(ClassTeacherSubject.objects.filter(
+        teacher_id__in=user_ids).values_list('teaches_in_id', flat=True))
+
+
+@receiver(post_init, sender=User)
+def user_feed_loaded(sender, instance, **kwargs):
+    # `core.signals` moves its own copy of the loaded class forward before
+    # these receivers run.
+    instance._feed_attends_id = instance.__dict__.get('attends_id', None)
+
+
+@receiver(post_save, sender=User)
+@receiver(post_delete, sender=User)
+def user_changed(sender, instance, raw=False, update_fields=None,
+                 **kwargs):
+    if raw:
+        return
+
+    # Logins only write `last_login`, which no feed renders.
+    if update_fields is not None and set(update_fields) <= {'last_login'}:
+        return
+
+    # Covers `attends`, rendered with the students of the old and the new
+    # class and used by the `student` filter.
+    class_ids = {instance.attends_id, instance._feed_attends_id} - {None}
+    invalidate(_user_feed_scopes([instance.pk], class_ids))
+    instance._feed_attends_id = instance.attends_id
+
+
+@receiver(m2m_changed, sender=User.subjects.through)
+@receiver(m2m_changed, sender=User.groups.through)
+def user_relations_changed(sender, instance, action, reverse, pk_set,
+                           **kwargs):
+    if action not in ('post_add', 'post_remove', 'post_clear'):
+        return
+
+    if not reverse:
+        invalidate(_user_feed_scopes([instance.pk], {instance.attends_id} -
+                                     {None}))
+
+    elif pk_set:
+        invalidate(_user_feed_scopes(pk_set, User.objects.filter(
+            id__in=pk_set, attends__isnull=False,
+        ).values_list('attends_id', flat=True)))
+
+    else:
+        # Reverse clears do not tell which users were affected.
+        invalidate([GLOBAL_SCOPE])
+
+
+@receiver(post_save, sender=Class)
+@receiver(post_delete, sender=Class)
+@receiver(post_save, sender=Subject)
+@receiver(post_delete, sender=Subject)
+def feed_relation_changed(sender, raw=False, **kwargs):
+    if not raw:
+        invalidate([GLOBAL_SCOPE])
+
+
+@receiver(post_init, sender=ClassTeacherSubject)
+def assignment_feed_loaded(sender, instance, **kwargs):
+    instance._feed_class_id = instance.__dict__.get('teaches_in_id', None)
+
+
+@receiver(post_save, sender=ClassTeacherSubject)
+@receiver(post_delete, sender=ClassTeacherSubject)
+def assignment_feed_changed(sender, instance, raw=False, **kwargs):
+    if raw:
+        return
+
+    # Rendered in `teachers_subjects` of the old and the new class.
+    invalidate(_class_feed_scopes([instance.teaches_in_id,
+                                   instance._feed_class_id]))
+    instance._feed_class_id = instance.teaches_in_id
+
+
+# Changes to `parents` need no invalidation: the scopes of a parent are the
+# current children and their classes, so the parent reads other entries.
+
+
+# Token claims, see `api.authentication`.
+
+def _parent_ids(student_ids):
+    return User.parents.through.objects.filter(
+        from_user_id__in=student_ids,
+    ).values_list('to_user_id', flat=True)
+
+
+@receiver(post_save, sender=User)
+def user_claims_changed(sender, instance, created, raw=False,
+                        update_fields=None, **kwargs):
+    if raw or created:
+        return
+
+    if update_fields is not None and set(update_fields) <= {'last_login'}:
+        return
+
+    # The classes of the parents follow `attends`.
+    revoke_tokens([instance.pk] + list(_parent_ids([instance.pk])))
+
+
+@receiver(pre_delete, sender=User)
+def user_claims_deleting(sender, instance, **kwargs):
+    revoke_tokens([instance.pk] + list(_parent_ids([instance.pk])))
+
+
+def _claims_user_ids(sender, instance, reverse, pk_set):
+    if sender is User.groups.through:
+        # `user.groups` or `group.user_set`.
+        if not reverse:
+            return {instance.pk}
+
+        elif pk_set is not None:
+            return set(pk_set)
+
+        return set(instance.user_set.values_list('id', flat=True))
+
+    # `child.parents` or `parent.children`, both sides change.
+    user_ids = {instance.pk}
+    if pk_set is not None:
+        user_ids.update(pk_set)
+
+    elif reverse:
+        user_ids.update(instance.children.values_list('id', flat=True))
+
+    else:
+        user_ids.update(instance.parents.values_list('id', flat=True))
+
+    return user_ids
+
+
+@receiver(m2m_changed, sender=User.parents.through)
+@receiver(m2m_changed, sender=User.groups.through)
+def user_claims_relations_changed(sender, instance, action, reverse, pk_set,
+                                  **kwargs):
+    if action == 'pre_clear':
+        instance._claims_user_ids = _claims_user_ids(sender, instance,
+                                                     reverse, None)
+
+    elif action == 'post_clear':
+        revoke_tokens(getattr(instance, '_claims_user_ids', []))
+
+    elif action in ('post_add', 'post_remove'):
+        revoke_tokens(_claims_user_ids(sender, instance, reverse, pk_set))
+
+
+@receiver(post_init, sender=ClassTeacherSubject)
+def assignment_claims_loaded(sender, instance, **kwargs):
+    instance._loaded_teacher_id = instance.__dict__.get('teacher_id', None)
+
+
+@receiver(post_save, sender=ClassTeacherSubject)
+@receiver(post_delete, sender=ClassTeacherSubject)
+def assignment_claims_changed(sender, instance, raw=False, **kwargs):
+    if raw:
+        return
+
+    revoke_tokens(set([instance.teacher_id, instance._loaded_teacher_id]) -
+                  {None})
+    instance._loaded_teacher_id = instance.teacher_id
+
+
+@receiver(pre_delete, sender=Class)
+def class_claims_deleting(sender, instance, **kwargs):
+    student_ids = list(instance.students.values_list('id', flat=True))
+    teacher_ids = instance.teachers_subjects.values_list('teacher_id',
+                                                         flat=True)
+
+    revoke_tokens(set(student_ids) | set(_parent_ids(student_ids)) |
+                  set(teacher_ids))
@@ -1,39 +1,61 @@
+import csv
 import datetime
+import io
+import json
 import pytz
+import tracemalloc
 import unittest.mock as mock
+from base64 import urlsafe_b64encode
+from urllib.parse import urlparse
 
+from django.core.cache import cache
+from django.db import connection
 from django.test import TestCase, Client
-from django.test.utils import override_settings
+from django.test.utils import override_settings, CaptureQueriesContext
+from django.utils.http import http_date
 from django.core.urlresolvers import resolve
 from django.contrib.auth.models import Group
 
 from rest_framework.test import APIRequestFactory, force_authenticate
 
+from rest_framework_jwt.settings import api_settings
 from rest_framework_jwt.views import (
     obtain_jwt_token, refresh_jwt_token, verify_jwt_token
 )
 
 from core.models import (User,
+                         ArchivedNotification,
                          Notification,
+                         NotificationInbox,
+                         Generation,
                          Class,
+                         ClassTeacherSubject,
                          Subject,
+                         Schedule,
                          create_default_groups,
+                         GROUP_ADMIN_ID,
                          GROUP_TEACHER_ID,
                          GROUP_STUDENT_ID,
                          GROUP_PARENT_ID,
                          )
 from chat.database import client
 
+from .pagination import encode_token
 from .views import (NotificationsService,
                     AuthUser,
+                    CalendarView,
                     ClassesService,
                     UsersService,
+                    ScheduleService,
+                    SubjectsView,
                     # ChatsService,
                     )
 
 
 ISO_DATE_FORMAT = '%Y-%m-%dT%H:%M:%SZ'
 
+jwt_decode_handler = api_settings.JWT_DECODE_HANDLER
+
 
 class AuthTest(TestCase):
 
@@ -145,6 +167,118 @@ class AuthTest(TestCase):
         self.assertEqual(len(result['children']), 2)
         self.assertTrue('attends' in result['children'][0])
 
+    def test_get_current_user_fields(self):
+        c = Client()
+        r1 = c.post(
+            '/api/auth/',
+            {
+                'email': 'alexis.padre@school.com',
+                'password': 'password123',
+            }
+        )
+
+        response = c.get(
+            '/api/auth/user/',
+            {'fields': 'id,first_name,children'},
+            HTTP_AUTHORIZATION='JWT {}'.format(r1.json()['token'])
+        )
+        self.assertEqual(response.status_code, 200)
+
+        result = response.json()
+        self.assertEqual(set(result.keys()), {'id', 'first_name', 'children'})
+        self.assertEqual(sorted(result['children']),
+                         sorted(self.user.children.values_list(
+                             'id', flat=True)))
+
+    def _token(self, email='alexis.padre@school.com'):
+        response = Client().post('/api/auth/', {'email': email,
+                                                'password': 'password123'})
+        self.assertEqual(response.status_code, 200)
+
+        return response.json()['token']
+
+    def test_token_claims(self):
+        payload = jwt_decode_handler(self._token())
+
+        self.assertEqual(payload['role'], GROUP_PARENT_ID)
+        self.assertEqual(payload['groups'], [GROUP_PARENT_ID])
+        self.assertEqual(payload['children'], sorted(
+            self.user.children.values_list('id', flat=True)))
+        self.assertEqual(payload['classes'], sorted(set(
+            self.user.children.values_list('attends', flat=True))))
+        self.assertEqual(payload['version'],
+                         User.objects.get(id=self.user.id).token_version)
+
+        payload = jwt_decode_handler(self._token('mates@school.com'))
+
+        self.assertEqual(payload['role'], GROUP_TEACHER_ID)
+        self.assertEqual(payload['children'], [])
+        self.assertEqual(len(payload['classes']), 3)
+
+    def test_token_claims_no_user_queries(self):
+        token = self._token()
+        c = Client()
+
+        # The first request caches the version of the claims.
+        c.get('/api/notifications/', HTTP_AUTHORIZATION='JWT ' + token)
+
+        with CaptureQueriesContext(connection) as queries:
+            response = c.get('/api/notifications/',
+                             HTTP_AUTHORIZATION='JWT ' + token)
+
+        self.assertEqual(response.status_code, 200)
+
+        for query in queries:
+            self.assertNotIn('"core_user_groups"."user_id" =', query['sql'])
+            self.assertNotIn('"core_user_parents"."to_user_id" =',
+                             query['sql'])
+            self.assertNotIn('WHERE "core_user"."id" =', query['sql'])
+            self.assertNotIn('WHERE "core_user"."email" =', query['sql'])
+
+    def test_token_revoked(self):
+        token = self._token()
+        c = Client()
+
+        response = c.get('/api/auth/user/', HTTP_AUTHORIZATION='JWT ' + token)
+        self.assertEqual(response.status_code, 200)
+
+        child = self.user.children.first()
+        self.user.children.remove(child)
+
+        response = c.get('/api/auth/user/', HTTP_AUTHORIZATION='JWT ' + token)
+        self.assertEqual(response.status_code, 401)
+
+        response = c.post('/api/auth/refresh/', {'token': token})
+        self.assertEqual(response.status_code, 200)
+
+        token = response.json()['token']
+        self.assertNotIn(child.id, jwt_decode_handler(token)['children'])
+
+        response = c.get('/api/auth/user/', HTTP_AUTHORIZATION='JWT ' + token)
+        self.assertEqual(response.status_code, 200)
+
+    @override_settings(SCHOOL_TOKEN_VERSION_CACHE_TIMEOUT=0)
+    def test_token_revoked_elsewhere(self):
+        # Changes made by other processes, or without signals, are seen
+        # once the cached version expires, here right away.
+        token = self._token()
+        c = Client()
+
+        response = c.get('/api/auth/user/', HTTP_AUTHORIZATION='JWT ' + token)
+        self.assertEqual(response.status_code, 200)
+
+        User.objects.filter(id=self.user.id).update(is_active=False)
+
+        response = c.get('/api/auth/user/', HTTP_AUTHORIZATION='JWT ' + token)
+        self.assertEqual(response.status_code, 401)
+
+        version = User.objects.get(id=self.user.id).token_version
+        User.objects.filter(id=self.user.id).update(is_active=True,
+                                                    token_version=version + 1)
+
+        response = c.get('/api/auth/user/', HTTP_AUTHORIZATION='JWT ' + token)
+        self.assertEqual(response.status_code, 401)
+
 
 class NotificationTest(TestCase):
 
@@ -758,6 +892,193 @@ class NotificationTest(TestCase):
 
         self.assertEqual(len(result), 6)
 
+    def _get_links(self, response):
+        links = {}
+
+        for link in response.get('Link', '').split(','):
+            if link:
+                url, rel = link.split(';')
+                links[rel.strip()[5:-1]] = url.strip()[1:-1]
+
+        return links
+
+    def test_notification_get_list_cursor(self):
+        for i in range(5):
+            Notification.objects.create(
+                title='New test task {}'.format(i),
+                owner=self.user_owner,
+                description='A difficult test task',
+                # Repeated dates to exercise the id tie-breaker.
+                date=datetime.datetime(2017, 8, 1 + i // 2, 0, 0, 0, 0,
+                                       pytz.UTC),
+                target_class=self.target_class,
+                target_student=None,
+                subject=self.mates if i % 2 else self.lengua,
+            )
+        Notification.objects.create(
+            title='Undated task',
+            owner=self.user_owner,
+            description='A difficult test task',
+            date=None,
+            target_class=self.target_class,
+            target_student=None,
+            subject=self.mates,
+        )
+
+        factory = APIRequestFactory()
+        view = NotificationsService.as_view({'get': 'list'})
+
+        request = factory.get('/api/notifications/')
+        force_authenticate(request, user=self.parent_target_student)
+        expected = [n['id'] for n in view(request).data]
+
+        self.assertEqual(len(expected), 6)
+
+        #######################################################################
+        ids = []
+        pages = []
+        url = '/api/notifications/?size=2'
+
+        while url:
+            request = factory.get(url)
+            force_authenticate(request, user=self.parent_target_student)
+            response = view(request)
+
+            self.assertEqual(response.status_code, 200)
+            self.assertTrue(len(response.data) <= 2)
+
+            if not ids:
+                # Inserted after the first page: must not shift the rest.
+                Notification.objects.create(
+                    title='Late task',
+                    owner=self.user_owner,
+                    description='A difficult test task',
+                    date=datetime.datetime(2017, 9, 1, 0, 0, 0, 0, pytz.UTC),
+                    target_class=self.target_class,
+                    target_student=None,
+                )
+
+            ids.extend(n['id'] for n in response.data)
+            pages.append(self._get_links(response))
+            url = pages[-1].get('next', None)
+
+        self.assertEqual(ids, expected)
+        self.assertEqual(len(pages), 3)
+        self.assertFalse('prev' in pages[0])
+
+        #######################################################################
+        request = factory.get(pages[-1]['prev'])
+        force_authenticate(request, user=self.parent_target_student)
+        response = view(request)
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([n['id'] for n in response.data], expected[2:4])
+
+        #######################################################################
+        request = factory.get('/api/notifications/',
+                              {'size': 2, 'subject': self.mates.id})
+        force_authenticate(request, user=self.parent_target_student)
+        response = view(request)
+        links = self._get_links(response)
+
+        request = factory.get(links['next'])
+        force_authenticate(request, user=self.parent_target_student)
+        response = view(request)
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.data), 1)
+        self.assertFalse('next' in self._get_links(response))
+
+    def test_notification_get_list_bad_cursor(self):
+        factory = APIRequestFactory()
+        view = NotificationsService.as_view({'get': 'list'})
+
+        bad_value = urlsafe_b64encode(
+            b'{"p":["garbage",1]}').decode('ascii')
+
+        for cursor in ('bad', bad_value):
+            request = factory.get('/api/notifications/', {'cursor': cursor})
+            force_authenticate(request, user=self.parent_target_student)
+            response = view(request)
+
+            self.assertEqual(response.status_code, 400)
+
+    def test_notification_get_list_bad_size(self):
+        factory = APIRequestFactory()
+        request = factory.get('/api/notifications/', {'size': 'bad'})
+        force_authenticate(request, user=self.parent_target_student)
+        view = NotificationsService.as_view({'get': 'list'})
+        response = view(request)
+
+        self.assertEqual(response.status_code, 400)
+
+    def test_notification_get_list_sparse_fields(self):
+        Notification.objects.create(
+            title='New test task 1',
+            owner=self.user_owner,
+            description='A difficult test task 1',
+            date=datetime.datetime(2017, 8, 1, 0, 0, 0, 0, pytz.UTC),
+            target_class=self.target_class,
+            target_student=None,
+        )
+
+        factory = APIRequestFactory()
+        request = factory.get('/api/notifications/', {
+            'fields': 'id,title,owner,target_class.id,target_class.name',
+        })
+        force_authenticate(request, user=self.user_owner)
+        view = NotificationsService.as_view({'get': 'list'})
+        response = view(request)
+
+        self.assertEqual(response.status_code, 200)
+
+        result = response.data
+
+        self.assertEqual(len(result), 1)
+        self.assertEqual(set(result[0].keys()),
+                         {'id', 'title', 'owner', 'target_class'})
+        self.assertEqual(result[0]['owner'], self.user_owner.id)
+        self.assertEqual(dict(result[0]['target_class']),
+                         {'id': self.target_class.id,
+                          'name': self.target_class.name})
+
+    def test_notification_get_list_expand(self):
+        Notification.objects.create(
+            title='New test task 1',
+            owner=self.user_owner,
+            description='A difficult test task 1',
+            date=datetime.datetime(2017, 8, 1, 0, 0, 0, 0, pytz.UTC),
+            target_class=self.target_class,
+            target_student=None,
+        )
+
+        factory = APIRequestFactory()
+        request = factory.get('/api/notifications/', {
+            'expand': 'owner,target_class.teachers_subjects',
+        })
+        force_authenticate(request, user=self.user_owner)
+        view = NotificationsService.as_view({'get': 'list'})
+        response = view(request)
+
+        self.assertEqual(response.status_code, 200)
+
+        result = response.data
+
+        self.assertEqual(result[0]['title'], 'New test task 1')
+        self.assertEqual(result[0]['owner']['id'], self.user_owner.id)
+        self.assertEqual(result[0]['owner']['groups'],
+                         [Group.objects.get(name=GROUP_TEACHER_ID).id])
+        self.assertEqual(result[0]['target_student'], None)
+        self.assertEqual(result[0]['subject'], None)
+        self.assertEqual(result[0]['target_class']['id'],
+                         self.target_class.id)
+        self.assertEqual(sorted(result[0]['target_class']['students']),
+                         sorted(self.target_class.students.values_list(
+                             'id', flat=True)))
+        teachers_subjects = result[0]['target_class']['teachers_subjects']
+        self.assertEqual(len(teachers_subjects), 3)
+        self.assertTrue(isinstance(teachers_subjects[0]['teacher'], int))
+
     def test_notification_post_unauthorized(self):
         factory = APIRequestFactory()
         request = factory.post('/api/notifications/', {})
@@ -928,243 +1249,1982 @@ class NotificationTest(TestCase):
 
         self.assertEqual(notification.custom_fields, {'test': 'test value'})
 
-    def test_notification_get_by_owner(self):
-        notification = Notification.objects.create(
-            title='New test task',
-            owner=self.user_owner,
-            description='A difficult test task',
-            date=datetime.datetime(2017, 8, 1, 0, 0, 0, 0, pytz.UTC),
-            target_class=None,
-            target_student=self.target_student,
-            icon='test',
-        )
+    def test_notification_bulk_route(self):
+        found = resolve('/api/notifications/bulk/')
+
+        self.assertEqual(found.url_name, 'notification-bulk')
 
+    def _post_bulk(self, items):
         factory = APIRequestFactory()
-        request = factory.get('/api/notifications/')
+        request = factory.post('/api/notifications/bulk/', items,
+                               format='json')
         force_authenticate(request, user=self.user_owner)
-        view = NotificationsService.as_view({'get': 'retrieve'})
-        response = view(request, pk=notification.id)
-
-        self.assertEqual(response.status_code, 200)
 
-    def test_notification_get_by_target_student_parent(self):
-        notification = Notification.objects.create(
-            title='New test task',
-            owner=self.user_owner,
-            description='A difficult test task',
-            date=datetime.datetime(2017, 8, 1, 0, 0, 0, 0, pytz.UTC),
-            target_class=None,
-            target_student=self.target_student,
-            icon='test',
-        )
+        view = NotificationsService.as_view({'post': 'bulk'})
 
-        factory = APIRequestFactory()
-        request = factory.get('/api/notifications/')
-        force_authenticate(request, user=self.parent_target_student)
-        view = NotificationsService.as_view({'get': 'retrieve'})
-        response = view(request, pk=notification.id)
+        with mock.patch('api.views.push_notifications.delay') \
+                as push_notifications:
+            response = view(request)
 
-        self.assertEqual(response.status_code, 200)
+        return response, push_notifications
 
-        result = response.data
+    def test_notification_post_bulk(self):
+        items = [
+            {
+                'title': 'Exam',
+                'description': 'Exam on Monday',
+                'date': '2017-07-27T00:00:00Z',
+                'type': Notification.TYPE_EXAM,
+                'subject_id': self.mates.id,
+                'target_class_id': target_class.id,
+            }
+            for target_class in (self.target_class, self.other_class)
+        ]
+        items.append({
+            'title': 'Task',
+            'description': 'A difficult task',
+            'date': '2017-07-27T00:00:00Z',
+            'target_student_id': self.target_student.id,
+            'custom_fields': {'test': 'test value'},
+        })
 
-        self.assertEqual(result['title'], 'New test task')
-        self.assertEqual(result['owner']['id'], self.user_owner.id)
-        self.assertEqual(result['description'], 'A difficult test task')
-        self.assertEqual(result['date'], '2017-08-01T00:00:00Z')
-        self.assertEqual(result['target_class'], None)
-        self.assertEqual(result['target_student']['id'], self.target_student.id)
-        self.assertEqual(result['icon'], 'test')
+        with CaptureQueriesContext(connection) as queries:
+            response, push_notifications = self._post_bulk(items)
 
-    def test_notification_get_by_target_class(self):
-        notification = Notification.objects.create(
-            title='New test task',
-            owner=self.user_owner,
-            description='A difficult test task',
-            date=datetime.datetime(2017, 8, 1, 0, 0, 0, 0, pytz.UTC),
-            target_class=self.target_class,
-            target_student=None,
-            icon='test',
-        )
+        self.assertEqual(response.status_code, 201)
 
+        notifications = list(Notification.objects.filter(
+            owner=self.user_owner).order_by('id'))
+        ids = [notification.id for notification in notifications]
+
+        self.assertEqual(len(notifications), 3)
+        self.assertEqual([n['id'] for n in response.data], ids)
+        self.assertEqual(notifications[0].target_class, self.target_class)
+        self.assertEqual(notifications[0].subject, self.mates)
+        self.assertEqual(notifications[0].type, Notification.TYPE_EXAM)
+        self.assertEqual(notifications[1].target_class, self.other_class)
+        self.assertEqual(notifications[2].target_student, self.target_student)
+        self.assertEqual(notifications[2].custom_fields,
+                         {'test': 'test value'})
+
+        push_notifications.assert_called_once_with(ids)
+
+        self.assertTrue(NotificationInbox.objects.filter(
+            recipient=self.parent_target_student_class,
+            notification=notifications[0]).exists())
+        self.assertTrue(NotificationInbox.objects.filter(
+            recipient=self.other_user,
+            notification=notifications[1]).exists())
+        self.assertTrue(NotificationInbox.objects.filter(
+            recipient=self.parent_target_student,
+            notification=notifications[2]).exists())
+
+        # Lookups and inserts do not grow with the number of items.
+        inserts = [query for query in queries.captured_queries
+                   if query['sql'].startswith(
+                       'INSERT INTO "core_notification"')]
+        self.assertEqual(len(inserts), 1)
+
+    def test_notification_post_deliver_at(self):
         factory = APIRequestFactory()
-        request = factory.get('/api/notifications/')
-        force_authenticate(request, user=self.parent_target_student_class)
-        view = NotificationsService.as_view({'get': 'retrieve'})
-        response = view(request, pk=notification.id)
-
-        self.assertEqual(response.status_code, 200)
+        view = NotificationsService.as_view({'post': 'create'})
 
-        result = response.data
+        request = factory.post('/api/notifications/', {
+            'title': 'Exam reminder',
+            'description': 'Exam on Monday',
+            'date': '2017-07-31T08:00:00Z',
+            'deliver_at': '2017-07-30T18:00:00Z',
+            'target_student_id': self.target_student.id,
+        })
+        force_authenticate(request, user=self.user_owner)
 
-        self.assertEqual(result['title'], 'New test task')
-        self.assertEqual(result['owner']['id'], self.user_owner.id)
-        self.assertEqual(result['description'], 'A difficult test task')
-        self.assertEqual(result['date'], '2017-08-01T00:00:00Z')
-        self.assertEqual(result['target_class']['id'], self.target_class.id)
-        self.assertEqual(result['target_student'], None)
-        self.assertEqual(result['icon'], 'test')
+        with mock.patch('api.views.push_notification.delay') \
+                as push_notification:
+            response = view(request)
 
-    def test_notification_get_by_target_student_unauthorized(self):
-        notification = Notification.objects.create(
-            title='New test task',
-            owner=self.user_owner,
-            description='A difficult test task',
-            date=datetime.datetime(2017, 8, 1, 0, 0, 0, 0, pytz.UTC),
-            target_class=None,
-            target_student=self.target_student,
-            icon='test',
-        )
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(response.data['deliver_at'], '2017-07-30T18:00:00Z')
+        self.assertFalse(push_notification.called)
 
-        factory = APIRequestFactory()
-        request = factory.get('/api/notifications/')
-        force_authenticate(request, user=self.other_user)
-        view = NotificationsService.as_view({'get': 'retrieve'})
-        response = view(request, pk=notification.id)
+        notification = Notification.objects.get(id=response.data['id'])
+        self.assertEqual(notification.deliver_at,
+                         datetime.datetime(2017, 7, 30, 18, 0, 0, 0,
+                                           pytz.UTC))
+        self.assertIsNone(notification.delivered_at)
 
-        self.assertEqual(response.status_code, 404)
+        response, push_notifications = self._post_bulk([
+            {
+                'title': title,
+                'description': 'Exam on Monday',
+                'deliver_at': deliver_at,
+                'target_class_id': self.target_class.id,
+            }
+            for title, deliver_at in (('Now', None),
+                                      ('Later', '2017-07-30T18:00:00Z'))
+        ])
 
-    def test_notification_get_by_target_class_unauthorized(self):
-        notification = Notification.objects.create(
-            title='New test task',
-            owner=self.user_owner,
-            description='A difficult test task',
-            date=datetime.datetime(2017, 8, 1, 0, 0, 0, 0, pytz.UTC),
-            target_class=self.target_class,
-            target_student=None,
-            icon='test',
-        )
+        self.assertEqual(response.status_code, 201)
+        push_notifications.assert_called_once_with([response.data[0]['id']])
 
-        factory = APIRequestFactory()
-        request = factory.get('/api/notifications/')
-        force_authenticate(request, user=self.other_user)
-        view = NotificationsService.as_view({'get': 'retrieve'})
-        response = view(request, pk=notification.id)
+    def test_notification_post_bulk_not_found(self):
+        response, push_notifications = self._post_bulk([
+            {
+                'title': 'Exam',
+                'description': 'Exam on Monday',
+                'target_class_id': self.target_class.id,
+            },
+            {
+                'title': 'Exam',
+                'description': 'Exam on Monday',
+                'target_class_id': 0,
+            },
+        ])
 
         self.assertEqual(response.status_code, 404)
+        self.assertFalse(Notification.objects.exists())
+        self.assertFalse(push_notifications.called)
 
-    def test_notification_get_list_owner(self):
-        n1 = Notification.objects.create(
-            title='New test task',
+    def test_notification_post_bulk_no_target(self):
+        response, push_notifications = self._post_bulk([
+            {
+                'title': 'Exam',
+                'description': 'Exam on Monday',
+            },
+        ])
+
+        self.assertEqual(response.status_code, 400)
+        self.assertFalse(Notification.objects.exists())
+
+    def test_notification_post_bulk_invalid(self):
+        response, push_notifications = self._post_bulk([
+            {
+                'description': 'Exam on Monday',
+                'target_class_id': self.target_class.id,
+            },
+        ])
+
+        self.assertEqual(response.status_code, 400)
+
+        response, push_notifications = self._post_bulk({
+            'title': 'Exam',
+            'description': 'Exam on Monday',
+            'target_class_id': self.target_class.id,
+        })
+
+        self.assertEqual(response.status_code, 400)
+        self.assertFalse(Notification.objects.exists())
+
+    def _get_changes(self, user, params=None):
+        factory = APIRequestFactory()
+        request = factory.get('/api/notifications/changes/', params or {})
+        force_authenticate(request, user=user)
+        view = NotificationsService.as_view({'get': 'changes'})
+
+        return view(request)
+
+    def test_notification_changes_route(self):
+        found = resolve('/api/notifications/changes/')
+
+        self.assertEqual(found.url_name, 'notification-changes')
+
+    def test_notification_changes(self):
+        def create(title, target_student=None, target_class=None):
+            return Notification.objects.create(
+                title=title,
+                owner=self.user_owner,
+                description='A difficult test task',
+                date=datetime.datetime(2017, 8, 1, 0, 0, 0, 0, pytz.UTC),
+                target_student=target_student,
+                target_class=target_class,
+            )
+
+        notification1 = create('New test task 1',
+                               target_student=self.target_student)
+        notification2 = create('New test task 2',
+                               target_class=self.other_class)
+
+        response = self._get_changes(self.user_owner)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([n['id'] for n in response.data['results']],
+                         [notification1.id, notification2.id])
+        self.assertFalse(response.data['more'])
+
+        since = response.data['since']
+
+        response = self._get_changes(self.user_owner, {'since': since})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['results'], [])
+        self.assertEqual(response.data['since'], since)
+
+        notification3 = create('New test task 3',
+                               target_class=self.target_class)
+
+        response = self._get_changes(self.user_owner, {'since': since})
+        self.assertEqual([n['id'] for n in response.data['results']],
+                         [notification3.id])
+        self.assertNotEqual(response.data['since'], since)
+
+        # Parents only see the notifications to their children and their
+        # children's classes.
+        response = self._get_changes(self.parent_target_student)
+        self.assertEqual([n['id'] for n in response.data['results']],
+                         [notification1.id, notification3.id])
+
+        response = self._get_changes(self.parent_target_student,
+                                     {'since': response.data['since']})
+        self.assertEqual(response.data['results'], [])
+
+        response = self._get_changes(self.other_user)
+        self.assertEqual([n['id'] for n in response.data['results']],
+                         [notification2.id])
+
+    def test_notification_changes_new_child(self):
+        notification1 = Notification.objects.create(
+            title='New test task 1',
+            owner=self.user_owner,
+            description='A difficult test task',
+            target_student=self.other_student,
+        )
+        notification2 = Notification.objects.create(
+            title='New test task 2',
             owner=self.user_owner,
             description='A difficult test task',
+            target_student=self.target_student,
+        )
+
+        response = self._get_changes(self.parent_target_student)
+        self.assertEqual([n['id'] for n in response.data['results']],
+                         [notification2.id])
+
+        # Older than the last synced notification, but new to the inbox.
+        self.other_student.parents.add(self.parent_target_student)
+
+        response = self._get_changes(self.parent_target_student,
+                                     {'since': response.data['since']})
+        self.assertEqual([n['id'] for n in response.data['results']],
+                         [notification1.id])
+
+    def test_notification_changes_size(self):
+        for i in range(3):
+            Notification.objects.create(
+                title='New test task {}'.format(i),
+                owner=self.user_owner,
+                description='A difficult test task',
+                target_student=self.target_student,
+            )
+
+        response = self._get_changes(self.user_owner, {'size': 2})
+        self.assertEqual(len(response.data['results']), 2)
+        self.assertTrue(response.data['more'])
+
+        response = self._get_changes(self.user_owner, {
+            'size': 2,
+            'since': response.data['since'],
+        })
+        self.assertEqual(len(response.data['results']), 1)
+        self.assertFalse(response.data['more'])
+
+    def test_notification_changes_bad_token(self):
+        for since in ('bad', encode_token(['bad']), encode_token([1, 2])):
+            response = self._get_changes(self.user_owner, {'since': since})
+
+            self.assertEqual(response.status_code, 400)
+
+    def test_notification_unread(self):
+        notification1 = Notification.objects.create(
+            title='New test task 1',
+            owner=self.user_owner,
+            description='A difficult test task 1',
             date=datetime.datetime(2017, 8, 1, 0, 0, 0, 0, pytz.UTC),
-            target_class=None,
-            target_student=self.target_student_class,
-            type=Notification.TYPE_EXAM,
-            custom_fields={ 'score': 9.5 },
-            icon='test1',
+            target_student=self.target_student,
         )
-        n2 = Notification.objects.create(
+        notification2 = Notification.objects.create(
             title='New test task 2',
             owner=self.user_owner,
             description='A difficult test task 2',
             date=datetime.datetime(2017, 8, 2, 0, 0, 0, 0, pytz.UTC),
             target_class=self.target_class,
+        )
+
+        factory = APIRequestFactory()
+        unread = NotificationsService.as_view({'get': 'unread'})
+        read = NotificationsService.as_view({'post': 'read'})
+        feed = NotificationsService.as_view({'get': 'list'})
+
+        def get_unread(user):
+            request = factory.get('/api/notifications/unread/')
+            force_authenticate(request, user=user)
+
+            with self.assertNumQueries(1):
+                response = unread(request)
+
+            self.assertEqual(response.status_code, 200)
+
+            return response.data['unread']
+
+        self.assertEqual(get_unread(self.parent_target_student), 2)
+        self.assertEqual(get_unread(self.parent_target_student_class), 1)
+
+        request = factory.get('/api/notifications/')
+        force_authenticate(request, user=self.parent_target_student)
+        response = feed(request)
+        self.assertEqual([n['read_at'] for n in response.data], [None, None])
+        etag = response['ETag']
+
+        request = factory.post('/api/notifications/read/',
+                               {'ids': [notification1.id]})
+        force_authenticate(request, user=self.parent_target_student)
+        response = read(request)
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data, {'read': 1, 'unread': 1})
+
+        # Marking again does not count twice.
+        request = factory.post('/api/notifications/read/',
+                               {'ids': [notification1.id]})
+        force_authenticate(request, user=self.parent_target_student)
+        self.assertEqual(read(request).data, {'read': 0, 'unread': 1})
+
+        request = factory.get('/api/notifications/',
+                              HTTP_IF_NONE_MATCH=etag)
+        force_authenticate(request, user=self.parent_target_student)
+        response = feed(request)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data[0]['id'], notification2.id)
+        self.assertIsNone(response.data[0]['read_at'])
+        self.assertIsNotNone(response.data[1]['read_at'])
+
+        # Other parents keep their own read state.
+        self.assertEqual(get_unread(self.parent_target_student_class), 1)
+
+        request = factory.post('/api/notifications/read/', {})
+        force_authenticate(request, user=self.parent_target_student)
+        self.assertEqual(read(request).data, {'read': 1, 'unread': 0})
+
+        self.assertEqual(get_unread(self.parent_target_student), 0)
+
+    def test_notification_read_bad_ids(self):
+        factory = APIRequestFactory()
+        request = factory.post('/api/notifications/read/', {'ids': ['x']})
+        force_authenticate(request, user=self.parent_target_student)
+        response = NotificationsService.as_view({'post': 'read'})(request)
+
+        self.assertEqual(response.status_code, 400)
+
+    def test_notification_get_list_search(self):
+        def create(title, description, target_student=None,
+                   target_class=None, day=1):
+            return Notification.objects.create(
+                title=title,
+                owner=self.user_owner,
+                description=description,
+                date=datetime.datetime(2017, 8, day, 0, 0, 0, 0, pytz.UTC),
+                target_student=target_student,
+                target_class=target_class,
+            )
+
+        in_description = create('Reunion', 'Traer el examen firmado',
+                                target_student=self.target_student, day=3)
+        in_title = create('Examen de matematicas', 'Temas 1 a 3',
+                          target_class=self.target_class, day=1)
+        create('Excursion', 'Salida al museo',
+               target_class=self.target_class, day=2)
+        other_class = create('Examen de lengua', 'Tema 4',
+                             target_class=self.other_class, day=4)
+
+        factory = APIRequestFactory()
+        view = NotificationsService.as_view({'get': 'list'})
+
+        def search(user, params):
+            request = factory.get('/api/notifications/', params)
+            force_authenticate(request, user=user)
+            response = view(request)
+
+            self.assertEqual(response.status_code, 200)
+
+            return [n['id'] for n in response.data]
+
+        # Title matches rank above description matches.
+        self.assertEqual(search(self.user_owner, {'q': 'examen'}),
+                         [other_class.id, in_title.id, in_description.id])
+        self.assertEqual(search(self.user_owner, {'q': 'firmados'}),
+                         [in_description.id])
+        self.assertEqual(search(self.parent_target_student, {'q': 'examen'}),
+                         [in_title.id, in_description.id])
+        self.assertEqual(search(self.parent_target_student,
+                                {'q': 'examen matematicas'}),
+                         [in_title.id])
+        self.assertEqual(search(self.parent_target_student,
+                                {'q': 'examen',
+                                 'from_date': '2017-08-02T00:00:00Z'}),
+                         [in_description.id])
+        self.assertEqual(search(self.other_user, {'q': 'examen'}),
+                         [other_class.id])
+
+        # The cursor walks the ranked order.
+        request = factory.get('/api/notifications/', {'q': 'examen',
+                                                      'size': 2})
+        force_authenticate(request, user=self.user_owner)
+        response = view(request)
+        self.assertEqual([n['id'] for n in response.data],
+                         [other_class.id, in_title.id])
+
+        next_link = self._get_links(response)['next']
+        request = factory.get(next_link)
+        force_authenticate(request, user=self.user_owner)
+        response = view(request)
+        self.assertEqual([n['id'] for n in response.data],
+                         [in_description.id])
+
+        # The stored vector follows updates.
+        in_description.description = 'Traer la autorización firmada'
+        in_description.save()
+        self.assertEqual(search(self.parent_target_student, {'q': 'examen'}),
+                         [in_title.id])
+
+    def test_notification_get_list_custom_fields(self):
+        def create(custom_fields, type=Notification.TYPE_ATTENDANCE,
+                   target_class=None):
+            return Notification.objects.create(
+                title='Attendance',
+                owner=self.user_owner,
+                description='Attendance',
+                date=datetime.datetime(2017, 8, 1, 0, 0, 0, 0, pytz.UTC),
+                target_class=target_class or self.target_class,
+                type=type,
+                custom_fields=custom_fields,
+            )
+
+        absent = create({'code': 'absent', 'hours': 2})
+        absent_other = create({'code': 'absent', 'hours': 1},
+                              target_class=self.other_class)
+        late = create({'code': 'late', 'justified': True})
+        exam = create({'grade': 7, 'exam': {'unit': 3}},
+                      type=Notification.TYPE_EXAM)
+
+        factory = APIRequestFactory()
+        view = NotificationsService.as_view({'get': 'list'})
+
+        def filter(params):
+            request = factory.get('/api/notifications/', params)
+            force_authenticate(request, user=self.user_owner)
+            response = view(request)
+
+            self.assertEqual(response.status_code, 200)
+
+            return set(n['id'] for n in response.data)
+
+        self.assertEqual(filter({'custom_fields.code': 'absent'}),
+                         {absent.id, absent_other.id})
+        self.assertEqual(filter({'custom_fields.code': 'absent',
+                                 'type': Notification.TYPE_ATTENDANCE,
+                                 'class': self.target_class.id}),
+                         {absent.id})
+        self.assertEqual(filter({'custom_fields.code': 'absent',
+                                 'custom_fields.hours': '1'}),
+                         {absent_other.id})
+        self.assertEqual(filter({'custom_fields.hours': '"1"'}), set())
+        self.assertEqual(filter({'custom_fields.justified': 'true'}),
+                         {late.id})
+        self.assertEqual(filter({'custom_fields.exam.unit': '3'}),
+                         {exam.id})
+        self.assertEqual(filter({'has_custom_fields': 'grade'}), {exam.id})
+        self.assertEqual(filter({'has_custom_fields': 'code,hours'}),
+                         {absent.id, absent_other.id})
+
+        for params in ({'custom_fields..code': 'absent'}, {'class': '1B'}):
+            request = factory.get('/api/notifications/', params)
+            force_authenticate(request, user=self.user_owner)
+            self.assertEqual(view(request).status_code, 400)
+
+    def test_notification_get_list_archive(self):
+        notifications = [
+            Notification.objects.create(
+                title='New test task {}'.format(i),
+                owner=self.user_owner,
+                description='A difficult test task',
+                date=datetime.datetime(2017, 8, 1 + i, 0, 0, 0, 0, pytz.UTC),
+                target_class=self.target_class,
+            )
+            for i in range(5)
+        ]
+        ArchivedNotification.objects.archive(
+            datetime.datetime(2017, 8, 3, 0, 0, 0, 0, pytz.UTC))
+
+        expected = [n.id for n in reversed(notifications)]
+
+        factory = APIRequestFactory()
+        view = NotificationsService.as_view({'get': 'list'})
+
+        def get(user, url, params=None):
+            request = factory.get(url, params)
+            force_authenticate(request, user=user)
+            response = view(request)
+
+            self.assertEqual(response.status_code, 200)
+
+            return response
+
+        for user in (self.user_owner, self.parent_target_student_class):
+            response = get(user, '/api/notifications/')
+            self.assertEqual([n['id'] for n in response.data], expected[:3])
+
+            response = get(user, '/api/notifications/', {'archive': 1})
+            self.assertEqual([n['id'] for n in response.data], expected)
+            self.assertEqual(response.data[-1]['title'], 'New test task 0')
+
+            ids = []
+            url = '/api/notifications/?archive=1&size=2'
+            while url:
+                response = get(user, url)
+                ids.extend(n['id'] for n in response.data)
+                url = self._get_links(response).get('next', None)
+
+            self.assertEqual(ids, expected)
+
+        response = get(self.other_user, '/api/notifications/', {'archive': 1})
+        self.assertEqual(response.data, [])
+
+    def test_notification_stats(self):
+        def create(month, type, subject, target_class=None):
+            return Notification.objects.create(
+                title='New test task',
+                owner=self.user_owner,
+                description='A difficult test task',
+                date=datetime.datetime(2017, month, 1, 0, 0, 0, 0, pytz.UTC),
+                target_class=target_class or self.target_class,
+                type=type,
+                subject=subject,
+            )
+
+        create(8, Notification.TYPE_EXAM, self.mates)
+        create(8, Notification.TYPE_EXAM, self.mates)
+        create(8, Notification.TYPE_TASK, self.lengua)
+        create(9, Notification.TYPE_EXAM, self.lengua)
+        create(9, Notification.TYPE_TASK, None, target_class=self.other_class)
+
+        factory = APIRequestFactory()
+        view = NotificationsService.as_view({'get': 'stats'})
+
+        def stats(user, params=None):
+            request = factory.get('/api/notifications/stats/', params)
+            force_authenticate(request, user=user)
+
+            with CaptureQueriesContext(connection) as queries:
+                response = view(request)
+
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(len([q for q in queries
+                                  if 'GROUP BY' in q['sql']]), 1)
+
+            return response.data
+
+        data = stats(self.user_owner, {'class': self.target_class.id})
+
+        self.assertEqual(data['total'], 4)
+        self.assertEqual(data['types'], [
+            {'type': Notification.TYPE_EXAM, 'count': 3},
+            {'type': Notification.TYPE_TASK, 'count': 1},
+        ])
+        self.assertEqual(data['months'], [
+            {'month': '2017-08', 'count': 3},
+            {'month': '2017-09', 'count': 1},
+        ])
+        self.assertEqual(
+            sorted((s['subject'], s['count']) for s in data['subjects']),
+            sorted([(self.mates.id, 2), (self.lengua.id, 2)]))
+        self.assertEqual(data['groups'][0], {
+            'type': Notification.TYPE_EXAM,
+            'subject': self.mates.id,
+            'month': '2017-08',
+            'count': 2,
+        })
+
+        data = stats(self.user_owner)
+        self.assertEqual(data['total'], 5)
+
+        data = stats(self.parent_target_student_class)
+        self.assertEqual(data['total'], 4)
+
+        data = stats(self.user_owner, {'from_date': '2017-09-01'})
+        self.assertEqual(data['total'], 2)
+
+        data = stats(self.user_owner, {'type': Notification.TYPE_TASK})
+        self.assertEqual(data['total'], 2)
+        self.assertEqual(data['types'], [
+            {'type': Notification.TYPE_TASK, 'count': 2},
+        ])
+
+    def test_notification_export(self):
+        to_student = Notification.objects.create(
+            title='New test task',
+            owner=self.user_owner,
+            description='A difficult test task',
+            date=datetime.datetime(2017, 8, 2, 0, 0, 0, 0, pytz.UTC),
+            target_student=self.target_student,
+            subject=self.mates,
+            custom_fields={'unit': 3},
+        )
+        to_class = Notification.objects.create(
+            title='New test exam, "final"',
+            owner=self.user_owner,
+            description='A difficult\ntest exam',
+            date=datetime.datetime(2017, 8, 1, 0, 0, 0, 0, pytz.UTC),
+            target_class=self.target_class,
+            type=Notification.TYPE_EXAM,
+        )
+
+        factory = APIRequestFactory()
+        view = NotificationsService.as_view({'get': 'export'})
+
+        def export(user, params=None):
+            request = factory.get('/api/notifications/export/', params)
+            force_authenticate(request, user=user)
+            response = view(request)
+
+            self.assertEqual(response.status_code, 200)
+
+            return b''.join(response.streaming_content).decode('utf-8')
+
+        rows = [json.loads(line)
+                for line in export(self.user_owner).splitlines()]
+
+        self.assertEqual([row['id'] for row in rows],
+                         [to_class.id, to_student.id])
+        self.assertEqual(rows[1]['date'], '2017-08-02T00:00:00Z')
+        self.assertEqual(rows[1]['target_student_first_name'],
+                         self.target_student.first_name)
+        self.assertEqual(rows[1]['subject_name'], 'Mates')
+        self.assertEqual(rows[1]['custom_fields'], {'unit': 3})
+        self.assertEqual(rows[0]['target_class_name'], '1B')
+
+        rows = list(csv.DictReader(io.StringIO(
+            export(self.user_owner, {'output': 'csv'}))))
+
+        self.assertEqual([int(row['id']) for row in rows],
+                         [to_class.id, to_student.id])
+        self.assertEqual(rows[0]['title'], 'New test exam, "final"')
+        self.assertEqual(rows[0]['description'], 'A difficult\ntest exam')
+        self.assertEqual(rows[0]['target_student_id'], '')
+        self.assertEqual(rows[1]['custom_fields'], '{"unit": 3}')
+
+        rows = export(self.parent_target_student_class,
+                      {'type': Notification.TYPE_EXAM}).splitlines()
+        self.assertEqual([json.loads(row)['id'] for row in rows],
+                         [to_class.id])
+
+        request = factory.get('/api/notifications/export/', {'output': 'xml'})
+        force_authenticate(request, user=self.user_owner)
+        self.assertEqual(view(request).status_code, 400)
+
+    def test_notification_get_by_owner(self):
+        notification = Notification.objects.create(
+            title='New test task',
+            owner=self.user_owner,
+            description='A difficult test task',
+            date=datetime.datetime(2017, 8, 1, 0, 0, 0, 0, pytz.UTC),
+            target_class=None,
+            target_student=self.target_student,
+            icon='test',
+        )
+
+        factory = APIRequestFactory()
+        request = factory.get('/api/notifications/')
+        force_authenticate(request, user=self.user_owner)
+        view = NotificationsService.as_view({'get': 'retrieve'})
+        response = view(request, pk=notification.id)
+
+        self.assertEqual(response.status_code, 200)
+
+    def test_notification_get_by_target_student_parent(self):
+        notification = Notification.objects.create(
+            title='New test task',
+            owner=self.user_owner,
+            description='A difficult test task',
+            date=datetime.datetime(2017, 8, 1, 0, 0, 0, 0, pytz.UTC),
+            target_class=None,
+            target_student=self.target_student,
+            icon='test',
+        )
+
+        factory = APIRequestFactory()
+        request = factory.get('/api/notifications/')
+        force_authenticate(request, user=self.parent_target_student)
+        view = NotificationsService.as_view({'get': 'retrieve'})
+        response = view(request, pk=notification.id)
+
+        self.assertEqual(response.status_code, 200)
+
+        result = response.data
+
+        self.assertEqual(result['title'], 'New test task')
+        self.assertEqual(result['owner']['id'], self.user_owner.id)
+        self.assertEqual(result['description'], 'A difficult test task')
+        self.assertEqual(result['date'], '2017-08-01T00:00:00Z')
+        self.assertEqual(result['target_class'], None)
+        self.assertEqual(result['target_student']['id'], self.target_student.id)
+        self.assertEqual(result['icon'], 'test')
+
+    def test_notification_get_by_target_class(self):
+        notification = Notification.objects.create(
+            title='New test task',
+            owner=self.user_owner,
+            description='A difficult test task',
+            date=datetime.datetime(2017, 8, 1, 0, 0, 0, 0, pytz.UTC),
+            target_class=self.target_class,
             target_student=None,
-            icon='test2',
+            icon='test',
         )
-        n3 = Notification.objects.create(
-            title='New test task 3',
-            owner=self.other_user,
-            description='A difficult test task 3',
-            date=datetime.datetime(2017, 8, 3, 0, 0, 0, 0, pytz.UTC),
+
+        factory = APIRequestFactory()
+        request = factory.get('/api/notifications/')
+        force_authenticate(request, user=self.parent_target_student_class)
+        view = NotificationsService.as_view({'get': 'retrieve'})
+        response = view(request, pk=notification.id)
+
+        self.assertEqual(response.status_code, 200)
+
+        result = response.data
+
+        self.assertEqual(result['title'], 'New test task')
+        self.assertEqual(result['owner']['id'], self.user_owner.id)
+        self.assertEqual(result['description'], 'A difficult test task')
+        self.assertEqual(result['date'], '2017-08-01T00:00:00Z')
+        self.assertEqual(result['target_class']['id'], self.target_class.id)
+        self.assertEqual(result['target_student'], None)
+        self.assertEqual(result['icon'], 'test')
+
+    def test_notification_get_by_target_student_unauthorized(self):
+        notification = Notification.objects.create(
+            title='New test task',
+            owner=self.user_owner,
+            description='A difficult test task',
+            date=datetime.datetime(2017, 8, 1, 0, 0, 0, 0, pytz.UTC),
             target_class=None,
             target_student=self.target_student,
-            icon='test3',
+            icon='test',
+        )
+
+        factory = APIRequestFactory()
+        request = factory.get('/api/notifications/')
+        force_authenticate(request, user=self.other_user)
+        view = NotificationsService.as_view({'get': 'retrieve'})
+        response = view(request, pk=notification.id)
+
+        self.assertEqual(response.status_code, 404)
+
+    def test_notification_get_by_target_class_unauthorized(self):
+        notification = Notification.objects.create(
+            title='New test task',
+            owner=self.user_owner,
+            description='A difficult test task',
+            date=datetime.datetime(2017, 8, 1, 0, 0, 0, 0, pytz.UTC),
+            target_class=self.target_class,
+            target_student=None,
+            icon='test',
+        )
+
+        factory = APIRequestFactory()
+        request = factory.get('/api/notifications/')
+        force_authenticate(request, user=self.other_user)
+        view = NotificationsService.as_view({'get': 'retrieve'})
+        response = view(request, pk=notification.id)
+
+        self.assertEqual(response.status_code, 404)
+
+    def test_notification_get_list_owner(self):
+        n1 = Notification.objects.create(
+            title='New test task',
+            owner=self.user_owner,
+            description='A difficult test task',
+            date=datetime.datetime(2017, 8, 1, 0, 0, 0, 0, pytz.UTC),
+            target_class=None,
+            target_student=self.target_student_class,
+            type=Notification.TYPE_EXAM,
+            custom_fields={ 'score': 9.5 },
+            icon='test1',
+        )
+        n2 = Notification.objects.create(
+            title='New test task 2',
+            owner=self.user_owner,
+            description='A difficult test task 2',
+            date=datetime.datetime(2017, 8, 2, 0, 0, 0, 0, pytz.UTC),
+            target_class=self.target_class,
+            target_student=None,
+            icon='test2',
+        )
+        n3 = Notification.objects.create(
+            title='New test task 3',
+            owner=self.other_user,
+            description='A difficult test task 3',
+            date=datetime.datetime(2017, 8, 3, 0, 0, 0, 0, pytz.UTC),
+            target_class=None,
+            target_student=self.target_student,
+            icon='test3',
+        )
+
+        factory = APIRequestFactory()
+        request = factory.get('/api/notifications_received/')
+        force_authenticate(request, user=self.parent_target_student_class)
+        view = NotificationsService.as_view({'get': 'list'})
+        response = view(request)
+
+        self.assertEqual(response.status_code, 200)
+
+        result = response.data
+
+        self.assertEqual(len(result), 2)
+
+        self.assertEqual(result[0]['id'], n2.id)
+        self.assertEqual(result[0]['title'], 'New test task 2')
+        self.assertEqual(result[0]['owner']['id'], self.user_owner.id)
+        self.assertEqual(result[0]['description'], 'A difficult test task 2')
+        self.assertEqual(result[0]['date'], '2017-08-02T00:00:00Z')
+        self.assertEqual(result[0]['target_class']['id'], self.target_class.id)
+        self.assertEqual(result[0]['target_student'], None)
+        self.assertEqual(result[0]['icon'], 'test2')
+        self.assertEqual(result[1]['id'], n1.id)
+        self.assertEqual(result[1]['title'], 'New test task')
+        self.assertEqual(result[1]['owner']['id'], self.user_owner.id)
+        self.assertEqual(result[1]['description'], 'A difficult test task')
+        self.assertEqual(result[1]['date'], '2017-08-01T00:00:00Z')
+        self.assertEqual(result[1]['target_class'], None)
+        self.assertEqual(result[1]['target_student']['id'],
+                         self.target_student_class.id)
+        self.assertEqual(result[1]['type'], Notification.TYPE_EXAM)
+        self.assertEqual(result[1]['custom_fields'], {'score': 9.5})
+        self.assertEqual(result[1]['icon'], 'test1')
+
+    def test_notification_post_bad_subject(self):
+        factory = APIRequestFactory()
+        request = factory.post('/api/notifications/',
+                               {
+                                   'title': 'New task',
+                                   'owner': 1,
+                                   'description': 'A difficult task',
+                                   'date': datetime.datetime(2017, 7, 27),
+                                   'target_class': self.target_class.id,
+                                   # 'target_student': None,
+                                   'icon': 'test',
+                                   'subject_id': 'bad',
+                                })
+        force_authenticate(request, user=self.user_owner)
+
+        view = NotificationsService.as_view({'post': 'create'})
+
+        response = view(request)
+
+        self.assertEqual(response.status_code, 400)
+
+    def test_notification_post_with_subject(self):
+        factory = APIRequestFactory()
+        request = factory.post('/api/notifications/',
+                               {
+                                   'title': 'New task',
+                                   'owner': self.user_owner.id,
+                                   'description': 'A difficult task',
+                                   'date': datetime.datetime(2017, 7, 27),
+                                   'target_class_id': self.target_class.id,
+                                   'target_student_id': None,
+                                   'icon': 'test',
+                                   'subject_id': self.lengua.id,
+                                })
+        force_authenticate(request, user=self.user_owner)
+
+        view = NotificationsService.as_view({'post': 'create'})
+
+        response = view(request)
+
+        response.render()
+        # print(response.content)
+
+        self.assertEqual(response.status_code, 201)
+
+        notification = Notification.objects.filter(title='New task').first()
+
+        self.assertIsNotNone(notification)
+
+        self.assertEqual(notification.owner.email, 'mates@school.com')
+        self.assertIsNone(notification.target_student)
+        self.assertEqual(notification.target_class.name, '1B')
+        self.assertEqual(notification.title, 'New task')
+        self.assertEqual(notification.description, 'A difficult task')
+        self.assertEqual(notification.date.year, 2017)
+        self.assertEqual(notification.date.month, 7)
+        self.assertEqual(notification.date.day, 27)
+        self.assertEqual(notification.icon, 'test')
+        self.assertEqual(notification.subject, self.lengua)
+
+
+class NotificationQueryPlanTest(TestCase):
+    """
+    Every query shape of NotificationsService must be served by an index
+    delivering the feed order: no sequential scan and no explicit sort.
+    """
+
+    def setUp(self):
+        from core.management.commands.initadmin import (insert_data_for_tests,
+                                                        init_database)
+        init_database()
+        insert_data_for_tests()
+
+        self.admin = User.objects.get(email='team@cathedralsw.com')
+        self.admin.groups.add(Group.objects.get_or_create(
+            name=GROUP_ADMIN_ID)[0])
+        self.teacher = User.objects.get(email='mates@school.com')
+        self.parent = User.objects.get(email='cristobal.padre@school.com')
+        self.student = User.objects.get(email='cristobal@school.com')
+        self.subject = Subject.objects.get(name='Mates')
+
+        teachers = list(User.objects.filter(groups__name=GROUP_TEACHER_ID))
+        students = list(User.objects.filter(groups__name=GROUP_STUDENT_ID))
+        classes = list(Class.objects.all())
+        subjects = list(Subject.objects.all())
+        types = [t for t, _ in Notification.TYPES_CHOICES]
+
+        start = datetime.datetime(2017, 1, 1, 0, 0, 0, 0, pytz.UTC)
+        Notification.objects.bulk_create([
+            Notification(
+                title='Synthetic {}'.format(i),
+                owner=teachers[i % len(teachers)],
+                description='Synthetic notification',
+                date=start + datetime.timedelta(hours=i),
+                target_student=students[i % len(students)]
+                if i % 2 else None,
+                target_class=classes[i % len(classes)]
+                if not i % 2 else None,
+                subject=subjects[i % len(subjects)],
+                type=types[i % len(types)],
+                custom_fields={'seq': i, 'code': 'absent'}
+                if i % 2 else {'seq': i},
+            )
+            for i in range(5000)
+        ])
+        NotificationInbox.objects.rebuild()
+
+        with connection.cursor() as cursor:
+            cursor.execute('ANALYZE core_notification')
+            cursor.execute('ANALYZE core_notificationinbox')
+
+    def _plans(self, user, params, action='list', marker='LIMIT'):
+        factory = APIRequestFactory()
+        request = factory.get('/api/notifications/', dict(params, size=20))
+        force_authenticate(request, user=user)
+        view = NotificationsService.as_view({'get': action})
+
+        with CaptureQueriesContext(connection) as queries:
+            response = view(request)
+
+        self.assertEqual(response.status_code, 200)
+
+        statements = [q['sql'] for q in queries.captured_queries
+                      if 'FROM "core_notification"' in q['sql'] and
+                      marker in q['sql']]
+        self.assertEqual(len(statements), 1)
+
+        with connection.cursor() as cursor:
+            # Make a missing index visible even on a small table.
+            cursor.execute('SET enable_seqscan = off')
+            cursor.execute('EXPLAIN ' + statements[0])
+            plan = '\n'.join(row[0] for row in cursor.fetchall())
+            cursor.execute('RESET enable_seqscan')
+
+        return plan
+
+    def _assert_indexed(self, user, variants, action='list'):
+        for params in variants:
+            plan = self._plans(user, params, action=action)
+
+            self.assertNotIn('Seq Scan', plan, msg=(params, plan))
+            self.assertNotRegex(plan, r'\bSort\b', msg=(params, plan))
+
+    def _variants(self):
+        return [
+            {},
+            {'subject': self.subject.id},
+            {'student': self.student.id},
+            {'from_date': '2017-02-01T00:00:00Z',
+             'to_date': '2017-03-01T00:00:00Z'},
+        ]
+
+    def test_notification_plan_admin(self):
+        self._assert_indexed(self.admin, [
+            {},
+            {'subject': self.subject.id},
+            {'from_date': '2017-02-01T00:00:00Z',
+             'to_date': '2017-03-01T00:00:00Z'},
+        ])
+
+    def test_notification_plan_teacher(self):
+        self._assert_indexed(self.teacher, self._variants() + [
+            {'type': Notification.TYPE_EXAM},
+        ])
+
+    def test_notification_plan_parent(self):
+        self._assert_indexed(self.parent, self._variants())
+
+    def _changes_variants(self):
+        return [
+            {},
+            {'since': encode_token([2500])},
+        ]
+
+    def test_notification_search_plan(self):
+        for user in (self.admin, self.teacher, self.parent):
+            for params in ({'q': '2501'},
+                           {'q': '2501', 'from_date': '2017-02-01T00:00:00Z'}):
+                plan = self._plans(user, params)
+
+                self.assertNotIn('Seq Scan', plan, msg=(params, plan))
+                self.assertIn('core_notif_search_idx', plan,
+                              msg=(params, plan))
+
+    def test_notification_custom_fields_plan(self):
+        for user in (self.admin, self.teacher, self.parent):
+            for params in ({'custom_fields.seq': '2501'},
+                           {'custom_fields.seq': '2501',
+                            'custom_fields.code': 'absent',
+                            'type': Notification.TYPE_ATTENDANCE}):
+                plan = self._plans(user, params)
+
+                self.assertNotIn('Seq Scan', plan, msg=(params, plan))
+                self.assertIn('core_notif_custom_fields_idx', plan,
+                              msg=(params, plan))
+
+    def test_notification_changes_plan(self):
+        for user in (self.admin, self.teacher, self.parent):
+            self._assert_indexed(user, self._changes_variants(),
+                                 action='changes')
+
+    def test_notification_stats_plan(self):
+        # Grouping sorts or hashes, but the rows still come from the scope
+        # indexes.
+        for user in (self.teacher, self.parent):
+            for params in self._variants():
+                plan = self._plans(user, params, action='stats',
+                                   marker='GROUP BY')
+
+                self.assertNotIn('Seq Scan', plan, msg=(params, plan))
+
+
+class ExportMemoryTest(TestCase):
+    """
+    The export must stream: its peak memory does not grow with the number
+    of exported rows.
+    """
+
+    def setUp(self):
+        from core.management.commands.initadmin import (insert_data_for_tests,
+                                                        init_database)
+        init_database()
+        insert_data_for_tests()
+
+        self.teacher = User.objects.get(email='mates@school.com')
+        self.target_class = Class.objects.get(name='1B')
+        self.created = 0
+
+    def _grow(self, count):
+        start = datetime.datetime(2017, 1, 1, 0, 0, 0, 0, pytz.UTC)
+
+        Notification.objects.bulk_create([
+            Notification(
+                title='Notification {}'.format(self.created + i),
+                owner=self.teacher,
+                description='Description ' * 50,
+                date=start + datetime.timedelta(minutes=self.created + i),
+                target_class=self.target_class,
+                custom_fields={'seq': self.created + i},
+            )
+            for i in range(count)
+        ])
+        self.created += count
+
+    def _peak(self, output):
+        factory = APIRequestFactory()
+        request = factory.get('/api/notifications/export/',
+                              {'output': output})
+        force_authenticate(request, user=self.teacher)
+        response = NotificationsService.as_view({'get': 'export'})(request)
+
+        lines = 0
+        tracemalloc.start()
+        try:
+            for line in response.streaming_content:
+                lines += 1
+
+            current, peak = tracemalloc.get_traced_memory()
+
+        finally:
+            tracemalloc.stop()
+
+        return lines, peak
+
+    def test_export_memory(self):
+        outputs = (('ndjson', 0), ('csv', 1))
+
+        self._grow(500)
+        small = [self._peak(output) for output, header in outputs]
+
+        self._grow(4500)
+        large = [self._peak(output) for output, header in outputs]
+
+        for (output, header), (small_lines, small_peak), \
+                (large_lines, large_peak) in zip(outputs, small, large):
+            self.assertEqual(small_lines, 500 + header)
+            self.assertEqual(large_lines, 5000 + header)
+
+            # Ten times the rows, some 4 MB of output: the peak is a cursor
+            # chunk, not the whole export.
+            self.assertLess(large_peak, small_peak * 2,
+                            msg=(output, small_peak, large_peak))
+            self.assertLess(large_peak, 1024 * 1024,
+                            msg=(output, large_peak))
+
+
+class QueryCountTest(TestCase):
+    """
+    List endpoints must render in a number of queries that does not grow
+    with the number of rows.
+    """
+
+    def setUp(self):
+        from core.management.commands.initadmin import (insert_data_for_tests,
+                                                        init_database)
+        init_database()
+        insert_data_for_tests()
+
+        self.teacher = User.objects.get(email='mates@school.com')
+        self.parent = User.objects.get(email='cristobal.padre@school.com')
+        self.target_class = Class.objects.get(name='1B')
+        self.group_students = Group.objects.get(name=GROUP_STUDENT_ID)
+        self.group_parents = Group.objects.get(name=GROUP_PARENT_ID)
+        self.created = 0
+
+    def _grow(self, count):
+        """ Adds students, parents, notifications and schedule rows. """
+        subject = Subject.objects.get(name='Mates')
+        cts = ClassTeacherSubject.objects.get(teacher=self.teacher,
+                                              subject=subject,
+                                              teaches_in=self.target_class)
+
+        for i in range(count):
+            self.created += 1
+            n = self.created
+
+            parent = User.objects.create(email='p{}@school.com'.format(n),
+                                         username='p{}'.format(n))
+            parent.groups.add(self.group_parents)
+
+            student = User.objects.create(email='s{}@school.com'.format(n),
+                                          username='s{}'.format(n),
+                                          attends=self.target_class)
+            student.groups.add(self.group_students)
+            student.parents.add(parent, self.parent)
+            student.subjects.add(subject)
+
+            Notification.objects.create(
+                title='Notification {}'.format(n),
+                owner=self.teacher,
+                description='Description',
+                date=datetime.datetime(2017, 8, 1, 0, 0, 0, 0, pytz.UTC),
+                target_student=student if n % 2 else None,
+                target_class=None if n % 2 else self.target_class,
+                subject=subject,
+            )
+
+            Schedule.objects.create(class_teacher_subject=cts,
+                                    day=Schedule.DAY_CHOICES[1][0],
+                                    time=datetime.time(8, n),
+                                    order=Schedule.ORDER[n % 10][0])
+
+    def _count(self, view, user, path='/', params=None):
+        factory = APIRequestFactory()
+        request = factory.get(path, params or {})
+        # Loaded for each request, as the authentication does.
+        force_authenticate(request, user=User.objects.get(id=user.id))
+
+        with CaptureQueriesContext(connection) as queries:
+            response = view(request)
+
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(len(response.data) > 0)
+
+        return len(queries)
+
+    def _assert_constant(self, view, user, params=None):
+        self._grow(2)
+        small = self._count(view, user, params=params)
+
+        self._grow(4)
+        large = self._count(view, user, params=params)
+
+        self.assertEqual(small, large)
+
+    def test_query_count_notifications(self):
+        view = NotificationsService.as_view({'get': 'list'})
+
+        self._assert_constant(view, self.teacher)
+
+    def test_query_count_notifications_parent(self):
+        view = NotificationsService.as_view({'get': 'list'})
+
+        self._assert_constant(view, self.parent, params={'size': 100})
+
+    def test_query_count_notifications_sparse(self):
+        view = NotificationsService.as_view({'get': 'list'})
+        params = {'fields': 'id,title,target_class.name'}
+
+        self._grow(2)
+        full = self._count(view, self.teacher)
+        sparse = self._count(view, self.teacher, params=params)
+
+        self.assertTrue(sparse < full)
+
+        self._grow(4)
+        self.assertEqual(self._count(view, self.teacher, params=params),
+                         sparse)
+
+    def test_query_count_classes(self):
+        view = ClassesService.as_view({'get': 'list'})
+
+        self._assert_constant(view, self.teacher)
+
+    def test_query_count_classes_roster(self):
+        view = ClassesService.as_view({'get': 'list'})
+
+        self._assert_constant(view, self.teacher, params={'roster': '1'})
+
+        # Same queries as the full list, without the teacher assignments
+        # repeated under every student.
+        sizes = []
+        for params in ({'roster': '1'}, {}):
+            request = APIRequestFactory().get('/', params)
+            force_authenticate(request, user=self.teacher)
+            sizes.append(len(view(request).render().content))
+
+        self.assertTrue(sizes[0] * 2 < sizes[1])
+
+    def test_query_count_users(self):
+        view = UsersService.as_view({'get': 'list'})
+
+        self._assert_constant(view, self.teacher)
+
+    def test_query_count_schedule(self):
+        view = ScheduleService.as_view({'get': 'list'})
+
+        self._assert_constant(view, self.teacher)
+
+    def test_query_count_roles(self):
+        # The groups of the user are loaded at most once per request,
+        # whatever the view checks.
+        views = (NotificationsService.as_view({'get': 'list'}),
+                 UsersService.as_view({'get': 'list'}),
+                 ScheduleService.as_view({'get': 'list'}),
+                 SubjectsView.as_view())
+
+        for view in views:
+            for user in (self.teacher, self.parent):
+                request = APIRequestFactory().get('/')
+                force_authenticate(request,
+                                   user=User.objects.get(id=user.id))
+
+                with CaptureQueriesContext(connection) as queries:
+                    response = view(request)
+
+                self.assertEqual(response.status_code, 200)
+
+                lookup = '"core_user_groups"."user_id" = {}'.format(user.id)
+                self.assertLessEqual(len([q for q in queries
+                                          if lookup in q['sql']]), 1)
+
+
+class ConditionalGetTest(TestCase):
+
+    def setUp(self):
+        from core.management.commands.initadmin import (insert_data_for_tests,
+                                                        init_database)
+        init_database()
+        insert_data_for_tests()
+
+        self.teacher = User.objects.get(email='mates@school.com')
+        self.other_teacher = User.objects.get(email='lengua@school.com')
+        self.student = User.objects.get(email='cristobal@school.com')
+        self.target_class = Class.objects.get(name='1B')
+
+    def _get(self, view, user, **headers):
+        factory = APIRequestFactory()
+        request = factory.get('/', **headers)
+        force_authenticate(request, user=user)
+
+        return view(request)
+
+    def test_notifications_not_modified(self):
+        view = NotificationsService.as_view({'get': 'list'})
+
+        response = self._get(view, self.teacher)
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.has_header('ETag'))
+        self.assertTrue(response.has_header('Last-Modified'))
+
+        etag = response['ETag']
+
+        # Only the generation and unread counters are read.
+        with self.assertNumQueries(2):
+            response = self._get(view, self.teacher, HTTP_IF_NONE_MATCH=etag)
+
+        self.assertEqual(response.status_code, 304)
+
+        Notification.objects.create(
+            title='New test task',
+            owner=self.teacher,
+            description='A difficult test task',
+            date=datetime.datetime(2017, 8, 1, 0, 0, 0, 0, pytz.UTC),
+            target_student=self.student,
+        )
+
+        response = self._get(view, self.teacher, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], etag)
+        self.assertEqual(len(response.data), 1)
+
+    def test_notifications_read_modified(self):
+        view = NotificationsService.as_view({'get': 'list'})
+        parent = User.objects.get(email='cristobal.padre@school.com')
+
+        Notification.objects.create(
+            title='New test task',
+            owner=self.teacher,
+            description='A difficult test task',
+            date=datetime.datetime(2017, 8, 1, 0, 0, 0, 0, pytz.UTC),
+            target_student=self.student,
+        )
+
+        response = self._get(view, parent)
+        self.assertEqual(response.data[0]['read_at'], None)
+        self.assertFalse(response.has_header('Last-Modified'))
+
+        read = NotificationsService.as_view({'post': 'read'})
+        request = APIRequestFactory().post('/', {})
+        force_authenticate(request, user=parent)
+        self.assertEqual(read(request).data['read'], 1)
+
+        response = self._get(view, parent,
+                             HTTP_IF_MODIFIED_SINCE=http_date())
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response.data[0]['read_at'], None)
+
+    def test_etag_depends_on_user(self):
+        view = NotificationsService.as_view({'get': 'list'})
+
+        etag = self._get(view, self.teacher)['ETag']
+
+        response = self._get(view, self.other_teacher,
+                             HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+
+    def test_classes_modified_by_membership(self):
+        view = ClassesService.as_view({'get': 'list'})
+
+        etag = self._get(view, self.teacher)['ETag']
+
+        self.student.attends = Class.objects.get(name='1A')
+        self.student.save()
+
+        response = self._get(view, self.teacher, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        etag = response['ETag']
+
+        self.student.parents.clear()
+
+        response = self._get(view, self.teacher, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+
+    def test_schedule_if_modified_since(self):
+        view = ScheduleService.as_view({'get': 'list'})
+
+        last_modified = self._get(view, self.teacher)['Last-Modified']
+
+        response = self._get(view, self.teacher,
+                             HTTP_IF_MODIFIED_SINCE=last_modified)
+        self.assertEqual(response.status_code, 304)
+
+    def test_subjects_not_modified(self):
+        view = SubjectsView.as_view()
+
+        etag = self._get(view, self.teacher)['ETag']
+
+        response = self._get(view, self.teacher, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+
+        Subject.objects.create(name='Música')
+
+        response = self._get(view, self.teacher, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+
+    def test_login_does_not_modify(self):
+        value = Generation.objects.get(key=Generation.USER).value
+
+        c = Client()
+        self.assertTrue(c.login(email='mates@school.com',
+                                password='password123'))
+
+        self.assertEqual(Generation.objects.get(key=Generation.USER).value,
+                         value)
+
+
+@override_settings(CACHES={
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'response-cache-test',
+    },
+})
+class ResponseCacheTest(TestCase):
+
+    def setUp(self):
+        from core.management.commands.initadmin import (insert_data_for_tests,
+                                                        init_database)
+        init_database()
+        insert_data_for_tests()
+        cache.clear()
+
+        self.teacher = User.objects.get(email='mates@school.com')
+        self.other_teacher = User.objects.get(email='lengua@school.com')
+        self.father = User.objects.get(email='cristobal.padre@school.com')
+        self.mother = User.objects.get(email='cristobal.madre@school.com')
+        self.new_parent = User.objects.get(email='javier.padre@school.com')
+        self.student = User.objects.get(email='cristobal@school.com')
+        self.class_1a = Class.objects.get(name='1A')
+        self.class_1b = Class.objects.get(name='1B')
+
+        self.to_student = self._create(self.teacher,
+                                       target_student=self.student)
+        self.to_class = self._create(self.teacher,
+                                     target_class=self.class_1b)
+
+    def _create(self, owner, target_student=None, target_class=None):
+        return Notification.objects.create(
+            title='New test task',
+            owner=owner,
+            description='A difficult test task',
+            date=datetime.datetime(2017, 8, 1, 0, 0, 0, 0, pytz.UTC),
+            target_student=target_student,
+            target_class=target_class,
+        )
+
+    def _get(self, user):
+        """ Returns the listed ids and whether the cache served them. """
+        factory = APIRequestFactory()
+        request = factory.get('/api/notifications/')
+        # Loaded for each request, as the authentication does.
+        force_authenticate(request, user=User.objects.get(id=user.id))
+        view = NotificationsService.as_view({'get': 'list'})
+
+        with CaptureQueriesContext(connection) as queries:
+            response = view(request)
+
+        self.assertEqual(response.status_code, 200)
+        self.response = response
+
+        cached = not any('"core_notification".' in q['sql']
+                         for q in queries.captured_queries)
+
+        return set(n['id'] for n in response.data), cached
+
+    def test_cache_shared_by_scope(self):
+        expected = {self.to_student.id, self.to_class.id}
+
+        self.assertEqual(self._get(self.father), (expected, False))
+        self.assertEqual(self._get(self.mother), (expected, True))
+
+        NotificationInbox.objects.filter(recipient=self.father).update(
+            read_at=datetime.datetime(2017, 8, 2, 0, 0, 0, 0, pytz.UTC))
+
+        self.assertEqual(self._get(self.mother), (expected, True))
+        self.assertEqual([n['read_at'] for n in self.response.data],
+                         [None, None])
+
+        self.assertEqual(self._get(self.father), (expected, True))
+        self.assertEqual([n['read_at'] for n in self.response.data],
+                         ['2017-08-02T00:00:00Z'] * 2)
+
+    def test_cache_invalidated_by_notifications(self):
+        self._get(self.teacher)
+        self._get(self.father)
+
+        # Other scopes keep their entries.
+        self._create(self.other_teacher, target_class=self.class_1a)
+
+        self.assertEqual(self._get(self.teacher)[1], True)
+        self.assertEqual(self._get(self.father)[1], True)
+
+        notification = self._create(self.teacher, target_class=self.class_1b)
+
+        self.assertEqual(self._get(self.father), (
+            {self.to_student.id, self.to_class.id, notification.id}, False))
+        self.assertEqual(self._get(self.teacher)[1], False)
+
+        notification = Notification.objects.get(id=notification.id)
+        notification.target_class = self.class_1a
+        notification.save()
+
+        self.assertEqual(self._get(self.father), (
+            {self.to_student.id, self.to_class.id}, False))
+
+    def test_cache_invalidated_by_attends_and_parents(self):
+        to_class_1a = self._create(self.teacher, target_class=self.class_1a)
+
+        self._get(self.father)
+        self._get(self.new_parent)
+
+        self.student.attends = self.class_1a
+        self.student.save()
+
+        self.assertEqual(self._get(self.father), (
+            {self.to_student.id, to_class_1a.id}, False))
+
+        self.student.parents.add(self.new_parent)
+
+        self.assertEqual(self._get(self.new_parent), (
+            {self.to_student.id, to_class_1a.id}, False))
+
+    def _rendered_class(self, user):
+        """ Returns the class of `to_class` as listed to `user`. """
+        self._get(user)
+
+        return [n['target_class'] for n in self.response.data
+                if n['id'] == self.to_class.id][0]
+
+    def _rendered_students(self, user):
+        return {s['id']: s['first_name']
+                for s in self._rendered_class(user)['students']}
+
+    def test_cache_invalidated_by_classmates_and_assignments(self):
+        # Parents read the class through its scope, its teachers through
+        # their own.
+        users = (self.father, self.teacher)
+
+        other = User.objects.get(email='javier@school.com')
+        for user in users:
+            self.assertNotIn(other.id, self._rendered_students(user))
+
+        other.attends = self.class_1b
+        other.save()
+
+        for user in users:
+            self.assertIn(other.id, self._rendered_students(user))
+
+        other = User.objects.get(id=other.id)
+        other.first_name = 'Javi'
+        other.save()
+
+        for user in users:
+            self.assertEqual(self._rendered_students(user)[other.id], 'Javi')
+
+        other.attends = self.class_1a
+        other.save()
+
+        for user in users:
+            self.assertNotIn(other.id, self._rendered_students(user))
+
+        count = len(self._rendered_class(self.father)['teachers_subjects'])
+
+        assignment = ClassTeacherSubject.objects.create(
+            teacher=self.other_teacher,
+            subject=Subject.objects.get(name='Mates'),
+            teaches_in=self.class_1b,
         )
 
+        for user in users:
+            self.assertEqual(
+                len(self._rendered_class(user)['teachers_subjects']),
+                count + 1)
+
+        assignment.delete()
+
+        for user in users:
+            self.assertEqual(
+                len(self._rendered_class(user)['teachers_subjects']),
+                count)
+
+    def test_cache_invalidated_by_targeted_students(self):
+        def rendered_student(user):
+            self._get(user)
+
+            return [n['target_student'] for n in self.response.data
+                    if n['id'] == self.to_student.id][0]
+
+        for user in (self.father, self.teacher):
+            self.assertEqual(rendered_student(user)['first_name'],
+                             self.student.first_name)
+
+        self.student.first_name = 'Renamed'
+        self.student.save()
+
+        for user in (self.father, self.teacher):
+            self.assertEqual(rendered_student(user)['first_name'],
+                             'Renamed')
+
+        self.student.attends = self.class_1a
+        self.student.save()
+
+        self.assertEqual(rendered_student(self.teacher)['attends']['id'],
+                         self.class_1a.id)
+
+
+class ScheduleTest(TestCase):
+
+    def setUp(self):
+        from core.management.commands.initadmin import (insert_data_for_tests,
+                                                        init_database)
+        init_database()
+        insert_data_for_tests()
+
+        self.teacher = User.objects.get(email='mates@school.com')
+        self.parent = User.objects.get(email='cristobal.padre@school.com')
+        self.student = User.objects.get(email='cristobal@school.com')
+
+    def _get_list(self, user):
         factory = APIRequestFactory()
-        request = factory.get('/api/notifications_received/')
-        force_authenticate(request, user=self.parent_target_student_class)
-        view = NotificationsService.as_view({'get': 'list'})
-        response = view(request)
+        request = factory.get('/api/schedule/')
+        force_authenticate(request, user=User.objects.get(id=user.id))
+        view = ScheduleService.as_view({'get': 'list'})
+
+        with CaptureQueriesContext(connection) as queries:
+            response = view(request)
 
         self.assertEqual(response.status_code, 200)
 
-        result = response.data
+        self.statements = [q['sql'] for q in queries.captured_queries
+                           if 'FROM "core_schedule"' in q['sql']]
 
-        self.assertEqual(len(result), 2)
+        return sorted((s['day'], s['order'],
+                       s['class_teacher_subject']['teaches_in']['name'])
+                      for s in response.data)
 
-        self.assertEqual(result[0]['id'], n2.id)
-        self.assertEqual(result[0]['title'], 'New test task 2')
-        self.assertEqual(result[0]['owner']['id'], self.user_owner.id)
-        self.assertEqual(result[0]['description'], 'A difficult test task 2')
-        self.assertEqual(result[0]['date'], '2017-08-02T00:00:00Z')
-        self.assertEqual(result[0]['target_class']['id'], self.target_class.id)
-        self.assertEqual(result[0]['target_student'], None)
-        self.assertEqual(result[0]['icon'], 'test2')
-        self.assertEqual(result[1]['id'], n1.id)
-        self.assertEqual(result[1]['title'], 'New test task')
-        self.assertEqual(result[1]['owner']['id'], self.user_owner.id)
-        self.assertEqual(result[1]['description'], 'A difficult test task')
-        self.assertEqual(result[1]['date'], '2017-08-01T00:00:00Z')
-        self.assertEqual(result[1]['target_class'], None)
-        self.assertEqual(result[1]['target_student']['id'],
-                         self.target_student_class.id)
-        self.assertEqual(result[1]['type'], Notification.TYPE_EXAM)
-        self.assertEqual(result[1]['custom_fields'], {'score': 9.5})
-        self.assertEqual(result[1]['icon'], 'test1')
+    def _assert_indexed(self, statement):
+        with connection.cursor() as cursor:
+            # Make a missing index visible even on a small table.
+            cursor.execute('SET enable_seqscan = off')
+            cursor.execute('EXPLAIN ' + statement)
+            plan = '\n'.join(row[0] for row in cursor.fetchall())
+            cursor.execute('RESET enable_seqscan')
 
-    def test_notification_post_bad_subject(self):
+        self.assertNotIn('Seq Scan', plan, msg=plan)
+
+    def test_schedule_get_list(self):
+        self.assertEqual(self._get_list(self.teacher), [
+            (Schedule.MONDAY, 1, '1A'),
+            (Schedule.MONDAY, 2, '1B'),
+            (Schedule.MONDAY, 3, '2A'),
+        ])
+
+        # Cristobal attends 1B.
+        for user in (self.parent, self.student):
+            self.assertEqual(self._get_list(user),
+                             [(Schedule.MONDAY, 2, '1B')])
+            self.assertEqual(len(self.statements), 1)
+            self._assert_indexed(self.statements[0])
+
+        self.student.attends = None
+        self.student.save()
+
+        self.assertEqual(self._get_list(self.parent), [])
+        self.assertEqual(self._get_list(self.student), [])
+
+        admin = User.objects.get(email='team@cathedralsw.com')
+        admin.groups.add(Group.objects.get_or_create(name=GROUP_ADMIN_ID)[0])
+        self.assertEqual(self._get_list(admin), [])
+
+        # Admins who also teach keep their lessons.
+        self.teacher.groups.add(Group.objects.get(name=GROUP_ADMIN_ID))
+        self.assertEqual(User.objects.get(id=self.teacher.id).role,
+                         GROUP_ADMIN_ID)
+        self.assertEqual(len(self._get_list(self.teacher)), 3)
+
+
+class TimetableTest(TestCase):
+
+    def setUp(self):
+        from core.management.commands.initadmin import (insert_data_for_tests,
+                                                        init_database)
+        init_database()
+        insert_data_for_tests()
+        cache.clear()
+
+        self.teacher = User.objects.get(email='mates@school.com')
+        self.parent = User.objects.get(email='cristobal.padre@school.com')
+        self.student = User.objects.get(email='cristobal@school.com')
+        self.class_1a = Class.objects.get(name='1A')
+        self.class_1b = Class.objects.get(name='1B')
+
+    def _get(self, user, params=None):
         factory = APIRequestFactory()
-        request = factory.post('/api/notifications/',
-                               {
-                                   'title': 'New task',
-                                   'owner': 1,
-                                   'description': 'A difficult task',
-                                   'date': datetime.datetime(2017, 7, 27),
-                                   'target_class': self.target_class.id,
-                                   # 'target_student': None,
-                                   'icon': 'test',
-                                   'subject_id': 'bad',
-                                })
-        force_authenticate(request, user=self.user_owner)
+        request = factory.get('/api/schedule/timetable/', params or {})
+        force_authenticate(request, user=User.objects.get(id=user.id))
+        view = ScheduleService.as_view({'get': 'timetable'})
 
-        view = NotificationsService.as_view({'post': 'create'})
+        with CaptureQueriesContext(connection) as queries:
+            response = view(request)
 
-        response = view(request)
+        self.schedule_queries = len([q for q in queries
+                                     if '"core_schedule"' in q['sql']])
+
+        return response
+
+    def test_timetable_teacher(self):
+        response = self._get(self.teacher)
+        self.assertEqual(response.status_code, 200)
+
+        result = response.data
+        self.assertEqual((result['type'], result['id']),
+                         ('teacher', self.teacher.id))
+        self.assertEqual(list(result['days']),
+                         [day for day, label in Schedule.DAY_CHOICES])
+        self.assertEqual(self.schedule_queries, 1)
+
+        for slots in result['days'].values():
+            self.assertEqual(len(slots), len(Schedule.ORDER))
+
+        monday = result['days'][Schedule.MONDAY]
+        self.assertEqual([len(entries) for entries in monday[:4]],
+                         [1, 1, 1, 0])
+        self.assertEqual(monday[0][0]['class_name'], '1A')
+        self.assertEqual(monday[0][0]['subject_name'], 'Mates')
+        self.assertEqual(monday[0][0]['teacher_id'], self.teacher.id)
+
+    def test_timetable_class_and_student(self):
+        response = self._get(self.parent, {'student': self.student.id})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual((response.data['type'], response.data['id']),
+                         ('class', self.class_1b.id))
+
+        monday = response.data['days'][Schedule.MONDAY]
+        self.assertEqual(monday[1][0]['teacher_id'], self.teacher.id)
+        self.assertEqual(sum(len(entries) for entries in monday), 1)
+
+        response = self._get(self.student)
+        self.assertEqual(response.data['id'], self.class_1b.id)
+
+        # Classes and students out of the lists of the parent.
+        response = self._get(self.parent, {'class': self.class_1a.id})
+        self.assertEqual(response.status_code, 404)
+
+        other = User.objects.get(email='alexis@school.com')
+        response = self._get(self.parent, {'student': other.id})
+        self.assertEqual(response.status_code, 404)
 
+        response = self._get(self.parent)
         self.assertEqual(response.status_code, 400)
 
-    def test_notification_post_with_subject(self):
+    def test_timetable_cached(self):
+        self._get(self.teacher)
+
+        response = self._get(self.teacher, {'teacher': self.teacher.id})
+        self.assertEqual(self.schedule_queries, 0)
+
+        assignment = ClassTeacherSubject.objects.get(
+            teacher=self.teacher, teaches_in=self.class_1b)
+        Schedule.objects.create(class_teacher_subject=assignment,
+                                day=Schedule.TUESDAY,
+                                time=datetime.time(10, 0),
+                                order=4)
+
+        response = self._get(self.teacher)
+        self.assertEqual(self.schedule_queries, 1)
+        self.assertEqual(
+            response.data['days'][Schedule.TUESDAY][3][0]['class_id'],
+            self.class_1b.id)
+
+        self._get(self.teacher, {'class': self.class_1b.id})
+
+        subject = Subject.objects.get(name='Mates')
+        subject.name = 'Matemáticas'
+        subject.save()
+
+        response = self._get(self.teacher, {'class': self.class_1b.id})
+        self.assertEqual(
+            response.data['days'][Schedule.TUESDAY][3][0]['subject_name'],
+            'Matemáticas')
+
+        assignment.delete()
+
+        response = self._get(self.teacher)
+        self.assertEqual(response.data['days'][Schedule.TUESDAY][3], [])
+
+    def _import(self, user, data, params='', format='json'):
         factory = APIRequestFactory()
-        request = factory.post('/api/notifications/',
-                               {
-                                   'title': 'New task',
-                                   'owner': self.user_owner.id,
-                                   'description': 'A difficult task',
-                                   'date': datetime.datetime(2017, 7, 27),
-                                   'target_class_id': self.target_class.id,
-                                   'target_student_id': None,
-                                   'icon': 'test',
-                                   'subject_id': self.lengua.id,
-                                })
-        force_authenticate(request, user=self.user_owner)
+        request = factory.post('/api/schedule/import/' + params, data,
+                               format=format)
+        force_authenticate(request, user=User.objects.get(id=user.id))
+        view = ScheduleService.as_view({'post': 'import_timetable'})
 
-        view = NotificationsService.as_view({'post': 'create'})
+        return view(request)
 
-        response = view(request)
+    def test_timetable_import(self):
+        admin = User.objects.get(email='team@cathedralsw.com')
+        admin.groups.add(Group.objects.get_or_create(name=GROUP_ADMIN_ID)[0])
 
-        response.render()
-        # print(response.content)
+        self._get(self.teacher)
 
+        response = self._import(admin, [
+            {'day': 'TUESDAY', 'order': 1, 'time': '09:00',
+             'teacher': 'mates@school.com', 'class': '1A',
+             'subject': 'Mates'},
+        ])
         self.assertEqual(response.status_code, 201)
+        self.assertEqual(response.data, {'created': 1})
 
-        notification = Notification.objects.filter(title='New task').first()
+        response = self._get(self.teacher)
+        self.assertEqual(self.schedule_queries, 1)
+        self.assertEqual(
+            len(response.data['days'][Schedule.TUESDAY][0]), 1)
 
-        self.assertIsNotNone(notification)
+        upload = io.BytesIO(b'day,order,time,teacher,class,subject\n'
+                            b'TUESDAY,2,10:00,mates@school.com,1B,Mates\n'
+                            b'TUESDAY,2,10:30,lengua@school.com,1B,Lengua\n')
+        upload.name = 'timetable.csv'
 
-        self.assertEqual(notification.owner.email, 'mates@school.com')
-        self.assertIsNone(notification.target_student)
-        self.assertEqual(notification.target_class.name, '1B')
-        self.assertEqual(notification.title, 'New task')
-        self.assertEqual(notification.description, 'A difficult task')
-        self.assertEqual(notification.date.year, 2017)
-        self.assertEqual(notification.date.month, 7)
-        self.assertEqual(notification.date.day, 27)
-        self.assertEqual(notification.icon, 'test')
-        self.assertEqual(notification.subject, self.lengua)
+        response = self._import(admin, {'file': upload}, format='multipart')
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(len(response.data), 1)
+        self.assertIn('row 1', response.data[0])
+        self.assertIn('row 2', response.data[0])
+        self.assertEqual(Schedule.objects.count(), 4)
+
+        response = self._import(self.teacher, [
+            {'day': 'TUESDAY', 'order': 3, 'time': '11:00',
+             'teacher': 'mates@school.com', 'class': '1A',
+             'subject': 'Mates'},
+        ])
+        self.assertEqual(response.status_code, 403)
+
+
+class CalendarTest(TestCase):
+
+    def setUp(self):
+        from core.management.commands.initadmin import (insert_data_for_tests,
+                                                        init_database)
+        init_database()
+        insert_data_for_tests()
+        cache.clear()
+
+        self.teacher = User.objects.get(email='mates@school.com')
+        self.parent = User.objects.get(email='cristobal.padre@school.com')
+        self.student = User.objects.get(email='cristobal@school.com')
+
+        self.exam = Notification.objects.create(
+            title='Exam, unit 1',
+            owner=self.teacher,
+            description='Fractions',
+            type=Notification.TYPE_EXAM,
+            date=datetime.datetime(2017, 8, 1, 9, 0, 0, 0, pytz.UTC),
+            target_student=self.student,
+        )
+        Notification.objects.create(
+            title='Good behaviour',
+            owner=self.teacher,
+            description='',
+            date=datetime.datetime(2017, 8, 2, 9, 0, 0, 0, pytz.UTC),
+            target_student=self.student,
+        )
+
+    def _url(self, user):
+        factory = APIRequestFactory()
+        request = factory.get('/api/calendar/')
+        force_authenticate(request, user=User.objects.get(id=user.id))
+        response = CalendarView.as_view()(request)
+        self.assertEqual(response.status_code, 200)
+
+        return urlparse(response.data['url']).path
+
+    def test_calendar_feed(self):
+        url = self._url(self.parent)
+
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response['Content-Type'].startswith('text/calendar'))
+
+        content = b''.join(response.streaming_content).decode('utf-8')
+        self.assertTrue(content.startswith('BEGIN:VCALENDAR\r\n'))
+        self.assertTrue(content.endswith('END:VCALENDAR\r\n'))
+
+        # The 10:00 lesson of 1B, the class of the child, and the exam.
+        self.assertEqual(content.count('BEGIN:VEVENT'), 2)
+        self.assertIn('RRULE:FREQ=WEEKLY\r\n', content)
+        self.assertIn('T100000\r\n', content)
+        self.assertIn('LOCATION:1B\r\n', content)
+        self.assertIn('UID:notification-{}@'.format(self.exam.id), content)
+        self.assertIn('DTSTART:20170801T090000Z\r\n', content)
+        self.assertIn('SUMMARY:Exam: Exam\\, unit 1\r\n', content)
+        self.assertNotIn('Good behaviour', content)
+
+        response = self.client.get(self._url(self.teacher))
+        content = b''.join(response.streaming_content).decode('utf-8')
+        self.assertEqual(content.count('RRULE:FREQ=WEEKLY'), 3)
+
+    def test_calendar_feed_cached(self):
+        url = self._url(self.parent)
+
+        response = self.client.get(url)
+        b''.join(response.streaming_content)
+        etag = response['ETag']
+
+        with self.assertNumQueries(0):
+            response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+            self.assertEqual(response.status_code, 304)
+
+            response = self.client.get(url)
+            self.assertEqual(response.status_code, 200)
+            b''.join(response.streaming_content)
+
+        Notification.objects.create(
+            title='Task',
+            owner=self.teacher,
+            description='',
+            type=Notification.TYPE_TASK,
+            date=datetime.datetime(2017, 8, 3, 9, 0, 0, 0, pytz.UTC),
+            target_class=self.student.attends,
+        )
+
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], etag)
+        self.assertIn(b'SUMMARY:Task: Task',
+                      b''.join(response.streaming_content))
+
+    def test_calendar_feed_revoked(self):
+        url = self._url(self.parent)
+
+        response = self.client.get(url[:-5] + 'x.ics')
+        self.assertEqual(response.status_code, 404)
+
+        self.parent.set_password('another password')
+        self.parent.save()
+
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, 404)
+
+        new_url = self._url(self.parent)
+        self.assertNotEqual(new_url, url)
+
+        response = self.client.get(new_url)
+        self.assertEqual(response.status_code, 200)
+
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, 404)
+
+    def test_calendar_feed_revoked_new_first(self):
+        url = self._url(self.parent)
+
+        self.parent.set_password('another password')
+        self.parent.save()
+
+        # The new address is polled before the revoked one.
+        response = self.client.get(self._url(self.parent))
+        self.assertEqual(response.status_code, 200)
+
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, 404)
 
 
 class ClassTest(TestCase):
@@ -1193,6 +3253,33 @@ class ClassTest(TestCase):
 
         self.assertEqual(response.status_code, 401)
 
+    def test_class_get_list_roster(self):
+        factory = APIRequestFactory()
+        request = factory.get('/api/classes/', {'roster': '1'})
+
+        view = ClassesService.as_view({'get': 'list'})
+
+        force_authenticate(request, user=self.user_admin)
+        response = view(request)
+
+        self.assertEqual(response.status_code, 200)
+
+        result = sorted(response.data,
+                        key=lambda c: c['name'])
+
+        self.assertEqual(len(result), 3)
+
+        self.assertEqual(result[0]['name'], '1A')
+        self.assertEqual(len(result[0]['teachers_subjects']), 4)
+        self.assertEqual(
+            set(result[0]['teachers_subjects'][0]['teacher']),
+            {'id', 'first_name', 'last_name', 'groups'})
+
+        # The class is not repeated under its students.
+        self.assertEqual(len(result[0]['students']), 2)
+        self.assertEqual(set(result[0]['students'][0]),
+                         {'id', 'first_name', 'last_name', 'subjects'})
+
     def test_class_get_list(self):
         factory = APIRequestFactory()
         request = factory.get('/api/classes/', {})
@@ -1333,6 +3420,70 @@ class UserTest(TestCase):
 
         # self.assertEqual(found.func, ClassesService.as_view({'get': 'list'}))
 
+    def _get_users(self, user, params, route='list'):
+        factory = APIRequestFactory()
+        request = factory.get('/api/users/', params)
+
+        view = UsersService.as_view({'get': route})
+
+        force_authenticate(request, user=User.objects.get(id=user.id))
+
+        with CaptureQueriesContext(connection) as queries:
+            response = view(request)
+
+        self.queries = len(queries)
+
+        return response
+
+    def test_user_get_list_ids(self):
+        ids = [self.student1.id, self.student3.id, self.teacher.id]
+
+        response = self._get_users(self.user,
+                                   {'ids': ','.join(map(str, ids))})
+        self.assertEqual(response.status_code, 200)
+
+        # Alexis is not in the list of Cristóbal's father.
+        result = response.data
+        self.assertEqual(list(result), [self.student1.id, self.teacher.id])
+        self.assertEqual(result[self.student1.id]['first_name'],
+                         self.student1.first_name)
+        self.assertTrue('groups' in result[self.teacher.id])
+
+        response = self._get_users(self.user, {'ids': '1,a'})
+        self.assertEqual(response.status_code, 400)
+
+    def test_user_get_parents(self):
+        ids = [self.student1.id, self.student3.id]
+
+        response = self._get_users(self.teacher,
+                                   {'ids': ','.join(map(str, ids))},
+                                   route='parents')
+        self.assertEqual(response.status_code, 200)
+
+        result = response.data
+        self.assertEqual(list(result), ids)
+        for id in ids:
+            self.assertEqual(
+                set(parent['id'] for parent in result[id]),
+                set(User.objects.get(id=id).parents.values_list('id',
+                                                                flat=True)))
+
+        # The queries do not depend on the number of ids.
+        queries = self.queries
+        ids += [self.student2.id, self.student4.id]
+        response = self._get_users(self.teacher,
+                                   {'ids': ','.join(map(str, ids))},
+                                   route='parents')
+        self.assertEqual(len(response.data), 4)
+        self.assertEqual(self.queries, queries)
+
+        response = self._get_users(self.user, {'ids': str(self.student3.id)},
+                                   route='parents')
+        self.assertEqual(response.data, {})
+
+        response = self._get_users(self.user, {}, route='parents')
+        self.assertEqual(response.status_code, 400)
+
     def test_user_get_list_unathorize(self):
         factory = APIRequestFactory()
         request = factory.get('/api/users/', {})
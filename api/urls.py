@@ -21,6 +21,9 @@ urlpatterns = [
     url(r'^auth/user/$', views.AuthUser.as_view()),
     url(r'^auth/user/([0-9]+)/$', views.GetUserParents.as_view()),
     url(r'^subjects/$', views.SubjectsView.as_view()),
+    url(r'^calendar/$', views.CalendarView.as_view()),
+    url(r'^calendar/(?P<token>[\w.:-]+)\.ics$', views.calendar_feed,
+        name='calendar-feed'),
     url(r'^chats/$', views.ChatsView.as_view()),
     url(r'^chats/([0-9]+)/$', views.ChatsHistoryView.as_view()),
 ]
@@ -1,35 +1,129 @@
-from django.db.models import Q
+import io
+import json
+import os
+from collections import OrderedDict
+
+from django.contrib.postgres.search import SearchQuery, SearchRank
+from django.core.exceptions import ValidationError as DjangoValidationError
+from django.db import transaction
+from django.db.models import Count, F, FloatField, Prefetch, Q
+from django.db.models.functions import Cast, TruncMonth
+from django.core.urlresolvers import reverse
+from django.http import Http404, StreamingHttpResponse
 from django.shortcuts import get_object_or_404
+from django.utils import timezone
+from django.utils.cache import get_conditional_response
 from django.utils.translation import ugettext_lazy as _
+from django.views.decorators.http import require_GET
 from django_filters.rest_framework import DjangoFilterBackend
 from rest_framework import permissions
+from rest_framework import serializers
 from rest_framework import status
 from rest_framework import viewsets, mixins
 # from rest_framework.decorators import detail_route
-from rest_framework.exceptions import ValidationError
+from rest_framework.decorators import list_route
+from rest_framework.exceptions import (NotFound,
+                                       PermissionDenied,
+                                       ValidationError,
+                                       )
 from rest_framework.response import Response
 from rest_framework.views import APIView
 
 from chat.database import get_chats, get_chat_history
-from core.models import (Notification,
+from core.export import EXPORT_FORMATS, export_lines
+from core.ical import ical_lines
+from core.timetable import (IMPORT_FORMATS,
+                            get_timetable,
+                            import_timetable,
+                            read_rows,
+                            )
+from core.models import (ArchivedNotification,
+                         Notification,
+                         NotificationInbox,
+                         Generation,
+                         UnreadCounter,
                          Class,
                          User,
+                         UserVisibility,
                          Subject,
                          Schedule,
                          GROUP_ADMIN_ID,
                          GROUP_TEACHER_ID,
                          GROUP_STUDENT_ID,
                          GROUP_PARENT_ID,
+                         SEARCH_CONFIG,
                          )
-from worker.tasks import push_notification
+from worker.tasks import push_notification, push_notifications
+from .cache import ScopedListCacheMixin, invalidate, notification_scopes
+from .conditional import ConditionalListMixin
+from .ical import Feed, feed_token, load_plan
+from .pagination import (NotificationCursorPagination,
+                         decode_token,
+                         encode_token,
+                         keyset_filter,
+                         merge_querysets,
+                         )
+from .prefetch import SerializerPrefetchMixin, prefetch_for_serializer
 from .serializers import (NotificationSerializer,
+                          parse_field_paths,
+                          ClassRosterSerializer,
                           ClassSerializer,
                           UserSerializer,
                           SubjectSerializer,
                           ScheduleSerializer)
 
 
-class NotificationsService(mixins.ListModelMixin,
+def _parse_id(item, key, message):
+    value = item.get(key, None)
+    if value is None:
+        return None
+
+    try:
+        return int(value)
+
+    except (TypeError, ValueError):
+        raise ValidationError(message)
+
+
+def _parse_ids(request, max_size):
+    """ Parses `?ids=1,2,3`, `None` if the parameter is missing. """
+    value = request.query_params.get('ids', None)
+    if value is None:
+        return None
+
+    try:
+        ids = [int(id) for id in value.split(',') if id]
+
+    except ValueError:
+        raise ValidationError({'ids': _('Bad user id')})
+
+    if len(ids) > max_size:
+        raise ValidationError(
+            {'ids': _('At most {} ids can be requested at once.').format(
+                max_size)})
+
+    return ids
+
+
+def _in_bulk(model, ids, message):
+    """ Fetches the instances of `model` with `ids` in a single query. """
+    ids = set(ids)
+    ids.discard(None)
+
+    instances = model.objects.in_bulk(ids) if ids else {}
+
+    missing = ids - set(instances)
+    if missing:
+        raise NotFound(message.format(
+            ', '.join(str(id) for id in sorted(missing))))
+
+    return instances
+
+
+class NotificationsService(ConditionalListMixin,
+                           ScopedListCacheMixin,
+                           SerializerPrefetchMixin,
+                           mixins.ListModelMixin,
                            mixins.RetrieveModelMixin,
                            mixins.CreateModelMixin,
                            viewsets.GenericViewSet):
@@ -38,6 +132,13 @@ class NotificationsService(mixins.ListModelMixin,
     filter_backends = (DjangoFilterBackend,)
     filter_fields = ('type',)
     permission_classes = (permissions.IsAuthenticated,)
+    pagination_class = NotificationCursorPagination
+    generation_keys = (Generation.NOTIFICATION,
+                       Generation.CLASS,
+                       Generation.USER,
+                       Generation.SUBJECT,
+                       Generation.CLASS_TEACHER_SUBJECT,
+                       )
 
     http_method_names = ('get', 'post')
 
@@ -79,9 +180,433 @@ class NotificationsService(mixins.ListModelMixin,
                                        target_class=target_class,
                                        target_student=target_student,
                                        subject=subject)
-        push_notification.delay(notification.id)
+
+        # Notifications with a `deliver_at`, even a past one, are pushed by
+        # the `deliver_notifications` scheduler task.
+        if notification.deliver_at is None:
+            push_notification.delay(notification.id)
+
+    bulk_max_size = 100
+
+    @list_route(methods=['post'])
+    def bulk(self, request):
+        """
+        Creates a list of notifications at once.
+
+        Every item takes the payload of a single `POST`. The referenced
+        subjects, students and classes are fetched with one query per model,
+        the notifications are inserted together and a single push task
+        covers all of them.
+        """
+        items = request.data
+        if not isinstance(items, list) or not items:
+            raise ValidationError(_('Expected a list of notifications.'))
+
+        if len(items) > self.bulk_max_size:
+            raise ValidationError(
+                _('At most {} notifications can be created at once.').format(
+                    self.bulk_max_size))
+
+        serializer = self.get_serializer(data=items, many=True)
+        serializer.is_valid(raise_exception=True)
+
+        targets = [
+            (_parse_id(item, 'subject_id', _('Bad subject id')),
+             _parse_id(item, 'target_student_id', _('Bad student id')),
+             _parse_id(item, 'target_class_id', _('Bad class id')))
+            for item in items
+        ]
+
+        subject_ids, student_ids, class_ids = zip(*targets)
+
+        if any(student_id is None and class_id is None
+               for student_id, class_id in zip(student_ids, class_ids)):
+            raise ValidationError(_('Notification may have directed to a '
+                                    'student or a class.'))
+
+        subjects = _in_bulk(Subject, subject_ids,
+                            _('Subjects not found: {}'))
+        students = _in_bulk(User, student_ids,
+                            _('Students not found: {}'))
+        classes = _in_bulk(Class, class_ids,
+                           _('Classes not found: {}'))
+
+        notifications = [
+            Notification(owner=request.user,
+                         subject=subjects.get(subject_id, None),
+                         target_student=students.get(student_id, None),
+                         target_class=classes.get(class_id, None),
+                         **data)
+            for data, (subject_id, student_id, class_id)
+            in zip(serializer.validated_data, targets)
+        ]
+
+        # `bulk_create` sends no `post_save`, so the inbox rows, the
+        # generation counter and the cached lists are handled here in the
+        # same transaction.
+        with transaction.atomic():
+            notifications = Notification.objects.bulk_create(notifications)
+            NotificationInbox.objects.fan_out(notifications)
+            Generation.objects.bump(Generation.NOTIFICATION)
+            invalidate(set().union(*[
+                notification_scopes(n.owner_id,
+                                    n.target_student_id,
+                                    n.target_class_id)
+                for n in notifications
+            ]))
+
+        ids = [notification.id for notification in notifications]
+
+        immediate = [notification.id for notification in notifications
+                     if notification.deliver_at is None]
+        if immediate:
+            push_notifications.delay(immediate)
+
+        queryset = prefetch_for_serializer(
+            Notification.objects.filter(id__in=ids).order_by('id'),
+            self.get_serializer())
+
+        return Response(self.get_serializer(queryset, many=True).data,
+                        status=status.HTTP_201_CREATED)
+
+    def get_etag_scope(self, request):
+        # Reading notifications changes the `read_at` of the parent feed
+        # without touching the notification table.
+        return super().get_etag_scope(request) + (
+            UnreadCounter.objects.unread_for(request.user),
+        )
+
+    def get_validators(self, request):
+        etag, last_modified = super().get_validators(request)
+
+        # The `read_at` of the parent feed bumps no generation, so only the
+        # ETag tells whether it changed.
+        if request.user.role == GROUP_PARENT_ID:
+            last_modified = None
+
+        return etag, last_modified
+
+    def get_cache_scopes(self, request):
+        """
+        Parents sharing children share their feeds: a parent reads the
+        notifications of each child and of each child's class.
+        """
+        user = request.user
+
+        if user.role == GROUP_ADMIN_ID:
+            return ['all']
+
+        elif user.role == GROUP_TEACHER_ID:
+            return ['owner:{}'.format(user.id)]
+
+        elif user.role == GROUP_PARENT_ID:
+            # The cached `read_at` are replaced by those of the parent,
+            # which takes the ids.
+            fields = parse_field_paths(request.query_params.get('fields',
+                                                                None))
+            if fields and 'read_at' in fields and 'id' not in fields:
+                return None
+
+            self.personalize_read_at = True
+
+            return sorted(
+                ['student:{}'.format(id) for id in user.children_ids] +
+                ['class:{}'.format(id) for id in user.class_ids])
+
+        return None
+
+    def personalize(self, request, data):
+        # The cached `read_at` are those of the parent that filled the
+        # entry.
+        if not data or 'read_at' not in data[0] or \
+                not getattr(self, 'personalize_read_at', False):
+            return data
+
+        read_at = dict(NotificationInbox.objects.filter(
+            recipient=request.user,
+            notification_id__in=[n['id'] for n in data],
+        ).values_list('notification_id', 'read_at'))
+
+        field = serializers.DateTimeField()
+        for notification in data:
+            value = read_at.get(notification['id'], None)
+            notification['read_at'] = field.to_representation(value) \
+                if value is not None else None
+
+        return data
+
+    @list_route(methods=['get'])
+    def unread(self, request):
+        """ Number of unread notifications of the user. """
+        return Response({
+            'unread': UnreadCounter.objects.unread_for(request.user),
+        })
+
+    @list_route(methods=['post'])
+    def read(self, request):
+        """
+        Marks the notifications with the given `ids` as read, or all of them
+        when no ids are given, and returns the new unread count.
+        """
+        if hasattr(request.data, 'getlist'):
+            ids = request.data.getlist('ids') or None
+
+        elif isinstance(request.data, dict):
+            ids = request.data.get('ids', None)
+
+        else:
+            raise ValidationError(_('Bad notification ids'))
+
+        queryset = NotificationInbox.objects.filter(recipient=request.user,
+                                                    read_at__isnull=True)
+
+        if ids is not None:
+            try:
+                ids = [int(id) for id in ids]
+
+            except (TypeError, ValueError):
+                raise ValidationError(_('Bad notification ids'))
+
+            queryset = queryset.filter(notification_id__in=ids)
+
+        with transaction.atomic():
+            # Rows already read by a concurrent request are not matched
+            # again, so the counter is decremented once per row.
+            marked = queryset.update(read_at=timezone.now())
+            UnreadCounter.objects.add({request.user.id: -marked})
+
+        return Response({
+            'read': marked,
+            'unread': UnreadCounter.objects.unread_for(request.user),
+        })
+
+    custom_fields_param_prefix = 'custom_fields.'
+
+    def get_custom_fields_filter(self):
+        """
+        Builds the object that `custom_fields` must contain from the
+        `custom_fields.<key>=<value>` query parameters. Dotted keys reach
+        into nested objects and values are read as JSON when possible, so
+        that `custom_fields.grade=7` matches a number and
+        `custom_fields.code=absent` a string.
+        """
+        contained = {}
+
+        for param, values in self.request.query_params.lists():
+            if not param.startswith(self.custom_fields_param_prefix):
+                continue
+
+            path = param[len(self.custom_fields_param_prefix):].split('.')
+            if not all(path):
+                raise ValidationError(_('Bad custom field filter'))
+
+            try:
+                value = json.loads(values[-1])
+
+            except ValueError:
+                value = values[-1]
+
+            node = contained
+            for key in path[:-1]:
+                node = node.setdefault(key, {})
+                if not isinstance(node, dict):
+                    raise ValidationError(_('Bad custom field filter'))
+
+            node[path[-1]] = value
+
+        return contained
+
+    changes_page_size = 100
+
+    def get_changes_queryset(self):
+        """
+        Notifications visible to the user annotated with the `change_id`
+        watermark, read from the index serving the user's scope.
+
+        The watermark is a row id, handed out by the database at insert:
+        the notification's for admins and teachers, the inbox row's for
+        parents, so that notifications reaching an inbox later than their
+        creation are still delivered.
+        """
+        user = self.request.user
+
+        id_field = 'id'
+
+        if user.role == GROUP_ADMIN_ID:
+            queryset = Notification.objects.all()
+
+        elif user.role == GROUP_TEACHER_ID:
+            queryset = Notification.objects.filter(Q(owner=user))
+
+        elif user.role == GROUP_PARENT_ID:
+            queryset = Notification.objects.filter(
+                Q(inbox_entries__recipient=user),
+            ).annotate(read_at=F('inbox_entries__read_at'))
+
+            id_field = 'inbox_entries__id'
+
+        else:
+            queryset = Notification.objects.none()
+
+        return queryset.annotate(change_id=F(id_field))
+
+    @list_route(methods=['get'])
+    def changes(self, request):
+        """
+        Notifications added to the user's scope after the `since` token,
+        oldest first, and the token to send on the next call.
+
+        At most `size` notifications are returned; `more` tells whether
+        the client should ask again right away.
+        """
+        queryset = self.get_changes_queryset()
+        fields = [queryset.query.annotations['change_id'].output_field]
+
+        since = request.query_params.get('since', None)
+        if since is not None:
+            try:
+                position = decode_token(since, fields)
+
+            except ValueError:
+                raise ValidationError(_('Invalid token'))
+
+            queryset = queryset.filter(keyset_filter(
+                [('change_id', False, False)],
+                position))
+
+        try:
+            size = int(request.query_params.get('size',
+                                                self.changes_page_size))
+
+        except ValueError:
+            raise ValidationError(_('Bad page size'))
+
+        size = max(1, min(size, self.changes_page_size))
+
+        queryset = prefetch_for_serializer(
+            queryset.order_by('change_id'),
+            self.get_serializer())
+        notifications = list(queryset[:size + 1])
+
+        more = len(notifications) > size
+        notifications = notifications[:size]
+
+        if notifications:
+            last = notifications[-1]
+            since = encode_token([last.change_id])
+
+        return Response({
+            'since': since,
+            'more': more,
+            'results': self.get_serializer(notifications, many=True).data,
+        })
+
+    @list_route(methods=['get'])
+    def stats(self, request):
+        """
+        Number of notifications the list would return, with the same
+        filters, by type, subject and month of their date.
+
+        The counts come from a single `GROUP BY` over the role scope and
+        only cover live notifications, so the work is bounded by the
+        archival window and not by the whole history.
+        """
+        response = self.not_modified(request)
+        if response is not None:
+            return response
+
+        queryset = self.filter_queryset(self.get_queryset())
+
+        groups = queryset.order_by().annotate(
+            month=TruncMonth('feed_date'),
+        ).values('type', 'subject', 'month').annotate(
+            count=Count('*'),
+        ).order_by('month', 'type', 'subject')
+
+        totals = OrderedDict((key, OrderedDict())
+                             for key in ('type', 'subject', 'month'))
+        results = []
+
+        for group in groups:
+            if group['month'] is not None:
+                group['month'] = group['month'].strftime('%Y-%m')
+
+            for key, counts in totals.items():
+                counts[group[key]] = counts.get(group[key], 0) + \
+                    group['count']
+
+            results.append(group)
+
+        data = OrderedDict([('total', sum(g['count'] for g in results))])
+        for key, counts in totals.items():
+            data[key + 's'] = [{key: value, 'count': count}
+                               for value, count in counts.items()]
+        data['groups'] = results
+
+        return Response(data)
+
+    @list_route(methods=['get'])
+    def export(self, request):
+        """
+        Streams the notifications the list would return, oldest first, as
+        newline delimited JSON (`output=ndjson`, the default) or CSV
+        (`output=csv`).
+
+        Rows are flat, read through a server-side cursor and written as
+        they come, so memory stays flat whatever their number.
+        """
+        output = request.query_params.get('output', 'ndjson')
+        if output not in EXPORT_FORMATS:
+            raise ValidationError(_('Bad output format'))
+
+        queryset = self.filter_queryset(self.get_queryset()).order_by(
+            'feed_date', 'feed_id')
+
+        content_type = EXPORT_FORMATS[output][0]
+        response = StreamingHttpResponse(export_lines([queryset], output),
+                                         content_type=content_type)
+        response['Content-Disposition'] = \
+            'attachment; filename="notifications.{}"'.format(output)
+
+        return response
+
+    def include_archive(self):
+        return self.request.query_params.get('archive', None) in ('1', 'true')
+
+    def list(self, request, *args, **kwargs):
+        if not self.include_archive():
+            return super().list(request, *args, **kwargs)
+
+        response = self.not_modified(request)
+        if response is not None:
+            return response
+
+        # Live and archived notifications are queried separately, with the
+        # same ordering, and merged.
+        querysets = [self.filter_queryset(self.get_queryset()),
+                     self.filter_queryset(self.get_archive_queryset())]
+
+        page = self.paginate_queryset(querysets)
+        if page is None:
+            page = merge_querysets(querysets, self.cursor_ordering)
+            return Response(self.get_serializer(page, many=True).data)
+
+        return self.get_paginated_response(
+            self.get_serializer(page, many=True).data)
 
     def get_queryset(self):
+        self.queryset = self.get_feed_queryset(Notification)
+
+        return self.queryset
+
+    def get_archive_queryset(self):
+        return self.get_feed_queryset(ArchivedNotification)
+
+    def get_feed_queryset(self, model):
+        """
+        Notifications of `model`, live or archived, readable by the user,
+        filtered by the query parameters and in feed order.
+        """
         user = self.request.user
 
         student_id = self.request.query_params.get('student', None)
@@ -90,36 +615,59 @@ class NotificationsService(mixins.ListModelMixin,
         from_date = self.request.query_params.get('from_date', None)
         to_date = self.request.query_params.get('to_date', None)
 
-        size = self.request.query_params.get('size', None)
+        search = self.request.query_params.get('q', None)
 
-        if user.groups.filter(name=GROUP_ADMIN_ID).exists():
-            queryset = Notification.objects.all()
+        class_id = self.request.query_params.get('class', None)
+        custom_fields = self.get_custom_fields_filter()
+        has_custom_fields = self.request.query_params.get(
+            'has_custom_fields', None)
+
+        # Every role query is served by an index on `(scope, date, id)`.
+        # The date and id are annotated as `feed_date` and `feed_id` so
+        # that range filters and ordering hit the same columns as the scope.
+        date_field = 'date'
+        id_field = 'id'
+        ordering = ('-feed_date', '-feed_id')
+
+        if user.role == GROUP_ADMIN_ID:
+            queryset = model.objects.all()
 
-        elif user.groups.filter(name=GROUP_TEACHER_ID).exists():
+        elif user.role == GROUP_TEACHER_ID:
             # - Owned notifications.
-            queryset = Notification.objects.filter(Q(owner=user))
+            queryset = model.objects.filter(Q(owner=user))
+
+        elif user.role == GROUP_PARENT_ID and \
+                model is ArchivedNotification:
+            # Archived notifications have no inbox rows.
+            queryset = model.objects.filter(
+                Q(target_student__in=user.children_ids) |
+                Q(target_class__in=user.class_ids),
+            )
 
-        elif user.groups.filter(name=GROUP_PARENT_ID).exists():
+        elif user.role == GROUP_PARENT_ID:
             # - Notification to children.
             # - Notification to children classes.
-            classes = list(Class.objects.filter(
-                Q(students__parents=user),
-            ))
+            # Both are fanned out to the parent's inbox on write, which
+            # holds its own copy of the date.
+            queryset = model.objects.filter(
+                Q(inbox_entries__recipient=user),
+            ).annotate(read_at=F('inbox_entries__read_at'))
 
-            queryset = Notification.objects.filter(
-                Q(target_student__parents=user) | \
-                Q(target_class__in=classes)
-            ).distinct()
+            date_field = 'inbox_entries__date'
+            id_field = 'inbox_entries__notification'
+
+        elif user.role == GROUP_STUDENT_ID:
+            queryset = model.objects.none()
 
-        elif user.groups.filter(name=GROUP_STUDENT_ID).exists():
-            queryset = User.objects.none()
+        queryset = queryset.annotate(feed_date=F(date_field),
+                                     feed_id=F(id_field))
 
         if student_id is not None:
             student = User.objects.get(pk=int(student_id))
 
             queryset = queryset.filter(
                 Q(target_student=student) | \
-                Q(target_student=None, target_class=student.attends),
+                Q(target_student=None, target_class_id=student.attends_id),
             )
 
         if subject_id is not None:
@@ -129,31 +677,79 @@ class NotificationsService(mixins.ListModelMixin,
                 Q(subject=subject)
             )
 
+        if class_id is not None:
+            try:
+                class_id = int(class_id)
+
+            except ValueError:
+                raise ValidationError(_('Bad class'))
+
+            queryset = queryset.filter(target_class_id=class_id)
+
+        if custom_fields:
+            # A single `@>` served by the `jsonb_path_ops` GIN index.
+            queryset = queryset.filter(custom_fields__contains=custom_fields)
+
+        if has_custom_fields:
+            # `jsonb_path_ops` cannot answer `?&`, so key existence is
+            # checked on the rows selected by the other filters.
+            queryset = queryset.filter(
+                custom_fields__has_keys=has_custom_fields.split(','))
+
         if from_date is not None:
-            queryset = queryset.filter(date__gte=from_date)
+            queryset = queryset.filter(feed_date__gte=from_date)
 
         if to_date is not None:
-            queryset = queryset.filter(date__lt=to_date)
+            queryset = queryset.filter(feed_date__lt=to_date)
+
+        if search:
+            # Matches come from the GIN index on `search_vector` and are
+            # intersected with the scope; the best ranked come first.
+            query = SearchQuery(search, config=SEARCH_CONFIG)
+
+            # `ts_rank` is a `real`; as a `double precision` it reads back
+            # exactly, which the cursor comparison on it relies on.
+            queryset = queryset.filter(search_vector=query).annotate(
+                search_rank=Cast(SearchRank(F('search_vector'), query),
+                                 FloatField()),
+            )
 
-        # XXX Order by timestamp instead?
-        queryset = queryset.order_by('-date')
+            ordering = ('-search_rank',) + ordering
 
-        if size is not None:
-            queryset = queryset[:int(size)]
+        # XXX Order by timestamp instead?
+        # The `id` tie-breaker keeps the order total, which the cursor
+        # pagination relies on.
+        queryset = queryset.order_by(*ordering)
 
-        self.queryset = queryset
+        self.cursor_ordering = ordering
 
-        return self.queryset
+        return queryset
 
 
-class ClassesService(mixins.ListModelMixin,
+class ClassesService(ConditionalListMixin,
+                     SerializerPrefetchMixin,
+                     mixins.ListModelMixin,
                      mixins.RetrieveModelMixin,
                      viewsets.GenericViewSet):
     queryset = Class.objects.all()
     serializer_class = ClassSerializer
+    generation_keys = (Generation.CLASS,
+                       Generation.USER,
+                       Generation.SUBJECT,
+                       Generation.CLASS_TEACHER_SUBJECT,
+                       )
 
     permission_classes = (permissions.IsAuthenticated,)
 
+    def get_serializer_class(self):
+        # `?roster=1` renders the compact roster; its students, subjects
+        # and teacher assignments are prefetched for all the listed classes
+        # in a fixed number of queries.
+        if self.request.query_params.get('roster', None) in ('1', 'true'):
+            return ClassRosterSerializer
+
+        return super().get_serializer_class()
+
     # @detail_route(methods=['get'])
     # def students(self, request, pk=None):
     #     c = Class.objects.get(pk=pk)
@@ -163,23 +759,66 @@ class ClassesService(mixins.ListModelMixin,
     #                     )
 
 
-class UsersService(mixins.ListModelMixin,
+class UsersService(SerializerPrefetchMixin,
+                   mixins.ListModelMixin,
                    viewsets.GenericViewSet):
     queryset = User.objects.all()
     serializer_class = UserSerializer
 
+    ids_max_size = 100
+
     def retrieve(self, request, pk=None):
-        queryset = User.objects.all()
+        queryset = prefetch_for_serializer(User.objects.all(),
+                                           self.get_serializer())
         user = get_object_or_404(queryset, pk=pk)
-        serializer = UserSerializer(user)
+        serializer = self.get_serializer(user)
 
         return Response(serializer.data)
 
+    def list(self, request, *args, **kwargs):
+        """
+        With `?ids=1,2,3`, returns a map of the listed users by id instead.
+        Users out of the list are left out of the map.
+        """
+        ids = _parse_ids(request, self.ids_max_size)
+        if ids is None:
+            return super().list(request, *args, **kwargs)
+
+        users = self.filter_queryset(self.get_queryset()).in_bulk(ids)
+        ids = [id for id in ids if id in users]
+        data = self.get_serializer([users[id] for id in ids], many=True).data
+
+        return Response(OrderedDict(zip(ids, data)))
+
+    @list_route(methods=['get'])
+    def parents(self, request):
+        """
+        Returns the parents of each of the `?ids=1,2,3` users by id, with
+        one query for the users and one prefetch for their parents.
+
+        Users out of the list are left out of the map.
+        """
+        ids = _parse_ids(request, self.ids_max_size)
+        if ids is None:
+            raise ValidationError({'ids': _('This parameter is required.')})
+
+        parents = prefetch_for_serializer(User.objects.order_by('id'),
+                                          self.get_serializer())
+
+        users = self.get_queryset().prefetch_related(
+            Prefetch('parents', queryset=parents),
+        ).in_bulk(ids)
+
+        return Response(OrderedDict(
+            (id, self.get_serializer(users[id].parents.all(), many=True).data)
+            for id in ids if id in users
+        ))
+
     def get_queryset(self):
         no_students = self.request.query_params.get('no_students', False)
 
         user = self.request.user
-        if user.groups.filter(name=GROUP_ADMIN_ID).exists():
+        if user.role == GROUP_ADMIN_ID:
             if not no_students:
                 queryset = User.objects.filter(
                     ~Q(id=user.id),
@@ -191,95 +830,171 @@ class UsersService(mixins.ListModelMixin,
                     ~Q(groups__name=GROUP_STUDENT_ID),
                 )
 
-        elif user.groups.filter(name=GROUP_TEACHER_ID).exists():
-            # - All teachers
-            # - Fathers of the students of the classes that their children
-            #   attend.
-            # - Students.
-            classes = list(Class.objects.filter(
-                Q(teachers_subjects__teacher=user)
-            ))
-
-            parents = User.objects.filter(
-                Q(groups__name=GROUP_PARENT_ID),
-                Q(children__attends__in=classes),
+        else:
+            # Teachers and parents read their contacts from the visibility
+            # table, students have none.
+            visible = UserVisibility.objects.filter(viewer=user)
+            if no_students:
+                visible = visible.exclude(relation=UserVisibility.STUDENT)
+
+            queryset = User.objects.filter(
+                id__in=visible.values('visible_user'),
             )
 
-            teachers = User.objects.filter(
-                ~Q(id=user.id),
-                Q(groups__name=GROUP_TEACHER_ID),
-            )
+        return queryset
 
-            if not no_students:
-                students = User.objects.filter(
-                    Q(groups__name=GROUP_STUDENT_ID),
-                    Q(attends__in=classes),
-                )
 
-            else:
-                students = User.objects.none()
-
-            queryset = (parents | teachers | students).distinct()
-
-        elif user.groups.filter(name=GROUP_PARENT_ID).exists():
-            # - Teachers of the classes that their children attend.
-            # - Fathers of the students of the classes that their children
-            #   attend.
-            # - Children
-            classes = list(Class.objects.filter(
-                Q(students__parents=user)
-            ))
-
-            parents = User.objects.filter(
-                ~Q(id=user.id),
-                Q(groups__name=GROUP_PARENT_ID),
-                Q(children__attends__in=classes),
-            )
+class ScheduleService(ConditionalListMixin,
+                      SerializerPrefetchMixin,
+                      mixins.ListModelMixin,
+                      mixins.RetrieveModelMixin,
+                      viewsets.GenericViewSet):
+    queryset = Schedule.objects.all()
+    serializer_class = ScheduleSerializer
+    generation_keys = (Generation.SCHEDULE,
+                       Generation.CLASS,
+                       Generation.USER,
+                       Generation.SUBJECT,
+                       Generation.CLASS_TEACHER_SUBJECT,
+                       )
 
-            teachers = User.objects.filter(
-                Q(groups__name=GROUP_TEACHER_ID),
-                Q(classes_subjects__teaches_in__in=classes),
-            )
+    permission_classes = (permissions.IsAuthenticated,)
 
-            if not no_students:
-                students = User.objects.filter(
-                    Q(groups__name=GROUP_STUDENT_ID),
-                    Q(parents=user),
-                )
+    def get_queryset(self):
+        """
+        Parents read the lessons of the classes their children attend,
+        students those of their class and anyone else their own lessons,
+        such as teachers and admins who also teach.
+        """
+        user = self.request.user
+
+        if user.role in (GROUP_PARENT_ID, GROUP_STUDENT_ID):
+            # `class_ids` follows `attends`, and comes with the token.
+            queryset = Schedule.objects.filter(
+                class_teacher_subject__teaches_in_id__in=user.class_ids)
+
+        else:
+            queryset = Schedule.objects.filter(
+                class_teacher_subject__teacher=user)
+
+        return queryset
+
+    def get_timetable_entity(self, request):
+        """
+        Returns the `(kind, id)` of the timetable requested with
+        `?teacher=`, `?class=` or `?student=`, by default the one of the
+        user. Students read the timetable of their class.
+        """
+        user = request.user
+
+        for kind in ('teacher', 'class', 'student'):
+            id = _parse_id(request.query_params, kind,
+                           _('Bad {} id').format(kind))
+            if id is not None:
+                break
+
+        else:
+            if user.role == GROUP_TEACHER_ID:
+                kind, id = 'teacher', user.id
+
+            elif user.role == GROUP_STUDENT_ID:
+                kind, id = 'student', user.id
 
             else:
-                students = User.objects.none()
+                raise ValidationError(
+                    _('Expected a teacher, a class or a student.'))
 
-            queryset = (parents | teachers | students).distinct()
+        # Same visibility as the users and classes lists.
+        if kind == 'class':
+            visible = user.role in (GROUP_ADMIN_ID, GROUP_TEACHER_ID) or \
+                id in user.class_ids
 
-        elif user.groups.filter(name=GROUP_STUDENT_ID).exists():
-            queryset = User.objects.none()
+        else:
+            visible = id == user.id or user.role == GROUP_ADMIN_ID or \
+                UserVisibility.objects.filter(viewer=user,
+                                              visible_user=id).exists()
+
+        if not visible:
+            raise NotFound(_('Timetable not found.'))
+
+        if kind == 'student':
+            kind = 'class'
+            id = User.objects.filter(id=id).values_list('attends_id',
+                                                        flat=True).first()
+            if id is None:
+                raise NotFound(_('The student attends no class.'))
+
+        return kind, id
+
+    @list_route(methods=['get'])
+    def timetable(self, request):
+        """
+        Returns the weekly timetable of a teacher, a class or a student as
+        a Monday to Friday grid of `Schedule.ORDER` slots, built with one
+        joined query and cached (see `core.timetable`).
+        """
+        kind, id = self.get_timetable_entity(request)
+
+        return Response(OrderedDict((
+            ('type', kind),
+            ('id', id),
+            ('days', get_timetable(kind, id)),
+        )))
+
+    @list_route(methods=['post'], url_path='import')
+    def import_timetable(self, request):
+        """
+        Creates the schedule rows of an uploaded CSV or JSON `file`, or of
+        a JSON list, at once, for admins.
+
+        The rows are validated together, with every conflict reported, and
+        inserted in a single transaction. `?replace=1` replaces the whole
+        schedule instead of adding to it.
+        """
+        if request.user.role != GROUP_ADMIN_ID:
+            raise PermissionDenied(_('Only admins can import timetables.'))
+
+        replace = request.query_params.get('replace', '') in ('1', 'true')
 
-        return queryset
+        try:
+            upload = request.FILES.get('file', None)
+            if upload is not None:
+                input_format = os.path.splitext(upload.name)[1][1:].lower()
+                if input_format not in IMPORT_FORMATS:
+                    raise ValidationError(_('Bad input format'))
 
+                rows = read_rows(io.TextIOWrapper(upload, encoding='utf-8'),
+                                 input_format)
 
-class ScheduleService(mixins.ListModelMixin,
-                     mixins.RetrieveModelMixin,
-                     viewsets.GenericViewSet):
-    queryset = Schedule.objects.all()
-    serializer_class = ScheduleSerializer
+            else:
+                rows = request.data
+                if not isinstance(rows, list) or not rows:
+                    raise ValidationError(
+                        _('Expected a list of schedule rows.'))
 
-    permission_classes = (permissions.IsAuthenticated,)
+            created = import_timetable(rows, replace=replace)
 
-    def get_queryset(self):
-        user = self.request.user
+        except DjangoValidationError as e:
+            raise ValidationError(e.messages)
 
-        queryset = Schedule.objects.filter(class_teacher_subject__teacher=user)
+        except ValueError:
+            # Undecodable upload.
+            raise ValidationError(_('Bad {} file').format(input_format))
 
-        return queryset
+        return Response({'created': len(created)},
+                        status=status.HTTP_201_CREATED)
 
 
 class AuthUser(APIView):
     permission_classes = (permissions.IsAuthenticated,)
 
     def get(self, request, *args, **kwargs):
-        user = request.user
-        serializer = UserSerializer(user)
+        context = {'request': request}
+        user = prefetch_for_serializer(
+            User.objects.filter(pk=request.user.pk),
+            UserSerializer(context=context),
+        ).get()
+        serializer = UserSerializer(user, context=context)
 
         return Response(
             serializer.data,
@@ -291,8 +1006,13 @@ class GetUserParents(APIView):
     permission_classes = (permissions.IsAuthenticated,)
 
     def get(self, request, user_id, *args, **kwargs):
+        context = {'request': request}
         user = User.objects.get(id=int(user_id))
-        serializer = UserSerializer(user.parents.all(), many=True)
+        serializer = UserSerializer(
+            prefetch_for_serializer(user.parents.all(),
+                                    UserSerializer(context=context)),
+            many=True,
+            context=context)
 
         return Response(
             serializer.data,
@@ -300,18 +1020,26 @@ class GetUserParents(APIView):
         )
 
 
-class SubjectsView(APIView):
+class SubjectsView(ConditionalListMixin, APIView):
     permission_classes = (permissions.IsAuthenticated,)
+    generation_keys = (Generation.SUBJECT,
+                       Generation.USER,
+                       Generation.CLASS_TEACHER_SUBJECT,
+                       )
 
     def get(self, request, *args, **kwargs):
+        response = self.not_modified(request)
+        if response is not None:
+            return response
+
         user = request.user
 
         class_id = self.request.query_params.get('class', None)
 
-        if user.groups.filter(name=GROUP_ADMIN_ID).exists():
+        if user.role == GROUP_ADMIN_ID:
             queryset = Subject.objects.all()
 
-        elif user.groups.filter(name=GROUP_TEACHER_ID).exists():
+        elif user.role == GROUP_TEACHER_ID:
             queryset = Subject.objects.filter(
                 classes_teachers__teacher=user).distinct()  # distinct needed?
 
@@ -333,6 +1061,51 @@ class SubjectsView(APIView):
         )
 
 
+class CalendarView(APIView):
+    permission_classes = (permissions.IsAuthenticated,)
+
+    def get(self, request, *args, **kwargs):
+        """
+        Returns the address of the calendar feed of the user, to subscribe
+        to from calendar apps. The address stops working when the password
+        changes.
+        """
+        url = reverse('calendar-feed', args=[feed_token(request.user)])
+
+        return Response({'url': request.build_absolute_uri(url)},
+                        status=status.HTTP_200_OK)
+
+
+@require_GET
+def calendar_feed(request, token):
+    """
+    Streams the iCalendar feed of the user of `token`: weekly events for
+    the lessons of their timetables and the dated exams and tasks.
+
+    Calendar apps cannot send the JWT and poll often, so this is a plain
+    view authenticated by the signed token of the address, and its
+    `ETag` comes from the cache (see `api.ical.Feed`).
+    """
+    plan = load_plan(token)
+    if plan is None:
+        raise Http404(_('Calendar not found.'))
+
+    feed = Feed(plan)
+
+    response = get_conditional_response(request, etag=feed.etag)
+    if response is not None:
+        return response
+
+    response = StreamingHttpResponse(ical_lines(feed.events(),
+                                                _('School calendar')),
+                                     content_type='text/calendar; '
+                                                  'charset=utf-8')
+    response['ETag'] = feed.etag
+    response['Content-Disposition'] = 'inline; filename="calendar.ics"'
+
+    return response
+
+
 class ChatsView(APIView):
     permission_classes = (permissions.IsAuthenticated,)
 
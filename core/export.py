@@ -0,0 +1,99 @@
+import csv
+import datetime
+import itertools
+import json
+from collections import OrderedDict
+
+from django.core.serializers.json import DjangoJSONEncoder
+
+
+# Flat columns of an exported notification: `(name, lookup)`. Related rows
+# are joined in the same query instead of being nested.
+EXPORT_COLUMNS = (
+    ('id', 'id'),
+    ('timestamp', 'timestamp'),
+    ('date', 'date'),
+    ('type', 'type'),
+    ('title', 'title'),
+    ('description', 'description'),
+    ('owner_id', 'owner_id'),
+    ('owner_first_name', 'owner__first_name'),
+    ('owner_last_name', 'owner__last_name'),
+    ('target_student_id', 'target_student_id'),
+    ('target_student_first_name', 'target_student__first_name'),
+    ('target_student_last_name', 'target_student__last_name'),
+    ('target_class_id', 'target_class_id'),
+    ('target_class_name', 'target_class__name'),
+    ('subject_id', 'subject_id'),
+    ('subject_name', 'subject__name'),
+    ('custom_fields', 'custom_fields'),
+)
+
+
+def export_rows(queryset):
+    """
+    Yields the `EXPORT_COLUMNS` values of each notification of `queryset`.
+
+    `iterator()` reads the rows through a server-side cursor, a chunk at a
+    time, and skips the result cache, so memory does not depend on the
+    number of rows.
+    """
+    return queryset.values_list(
+        *[lookup for name, lookup in EXPORT_COLUMNS]).iterator()
+
+
+class _Echo(object):
+    """ File-like object handing back what `csv.writer` writes. """
+
+    def write(self, value):
+        return value
+
+
+def _csv_value(value):
+    if value is None:
+        return ''
+
+    if isinstance(value, (dict, list)):
+        return json.dumps(value, cls=DjangoJSONEncoder)
+
+    if isinstance(value, datetime.datetime):
+        # Same format as the JSON outputs.
+        return DjangoJSONEncoder().default(value)
+
+    return value
+
+
+def csv_lines(rows):
+    writer = csv.writer(_Echo())
+
+    yield writer.writerow([name for name, lookup in EXPORT_COLUMNS])
+
+    for row in rows:
+        yield writer.writerow([_csv_value(value) for value in row])
+
+
+def ndjson_lines(rows):
+    names = [name for name, lookup in EXPORT_COLUMNS]
+
+    for row in rows:
+        yield json.dumps(OrderedDict(zip(names, row)),
+                         cls=DjangoJSONEncoder,
+                         separators=(',', ':')) + '\n'
+
+
+# Output format: (content type, lines generator).
+EXPORT_FORMATS = {
+    'ndjson': ('application/x-ndjson', ndjson_lines),
+    'csv': ('text/csv', csv_lines),
+}
+
+
+def export_lines(querysets, output):
+    """
+    Lines of the export of `querysets`, one after the other, in the
+    `output` format.
+    """
+    content_type, lines = EXPORT_FORMATS[output]
+
+    return lines(itertools.chain.from_iterable(
+        export_rows(queryset) for queryset in querysets))
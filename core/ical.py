@@ -0,0 +1,145 @@
+import datetime
+
+import pytz
+
+from django.conf import settings
+
+from .models import Notification, Schedule
+
+
+PRODID = '-//School//Calendar//EN'
+
+# Right hand side of the event UIDs.
+UID_DOMAIN = 'school'
+
+# Notification types with a date worth a calendar event.
+CALENDAR_TYPES = (Notification.TYPE_EXAM, Notification.TYPE_TASK)
+
+
+def escape(text):
+    """ Escapes `text` for a TEXT property value (RFC 5545, 3.3.11). """
+    return str(text).replace('\\', '\\\\').replace(';', '\\;').replace(
+        ',', '\\,').replace('\r\n', '\\n').replace('\n', '\\n')
+
+
+def fold(line):
+    """
+    Splits `line` into lines of at most 75 octets, the continuations
+    starting with a space (RFC 5545, 3.1), and ends it with CRLF.
+    """
+    parts = []
+    size = 0
+    start = 0
+
+    for index, char in enumerate(line):
+        octets = len(char.encode('utf-8'))
+        if size + octets > (75 if not parts else 74):
+            parts.append(line[start:index])
+            start, size = index, 0
+
+        size += octets
+
+    parts.append(line[start:])
+
+    return '\r\n '.join(parts) + '\r\n'
+
+
+def format_datetime(value):
+    """ UTC for aware datetimes, floating local time for naive ones. """
+    if value.tzinfo is not None:
+        return value.astimezone(pytz.utc).strftime('%Y%m%dT%H%M%SZ')
+
+    return value.strftime('%Y%m%dT%H%M%S')
+
+
+def timetable_events(grid, monday):
+    """
+    Yields one weekly event per lesson of the timetable `grid` (see
+    `core.timetable.build_timetable`), starting on the week of `monday`.
+
+    Lessons have no date, so their times are floating local times and
+    they last `SCHOOL_LESSON_MINUTES`.
+    """
+    stamp = datetime.datetime.combine(monday, datetime.time()).replace(
+        tzinfo=pytz.utc)
+    duration = datetime.timedelta(minutes=settings.SCHOOL_LESSON_MINUTES)
+    orders = [order for order, label in Schedule.ORDER]
+
+    for offset, (day, slots) in enumerate(grid.items()):
+        date = monday + datetime.timedelta(days=offset)
+
+        for order, entries in zip(orders, slots):
+            for entry in entries:
+                start = datetime.datetime.combine(date, entry['time'])
+
+                yield (
+                    'timetable-{}-{}-{}-{}-{}'.format(
+                        day.lower(), order, entry['class_id'],
+                        entry['subject_id'], entry['teacher_id']),
+                    stamp,
+                    start,
+                    start + duration,
+                    'WEEKLY',
+                    entry['subject_name'],
+                    '{} {}'.format(entry['teacher_first_name'],
+                                   entry['teacher_last_name']).strip(),
+                    entry['class_name'],
+                )
+
+
+def notification_events(rows):
+    """
+    Yields one event per `(id, type, title, description, date, timestamp)`
+    notification row.
+    """
+    types = dict(Notification.TYPES_CHOICES)
+
+    for id, type, title, description, date, timestamp in rows:
+        yield (
+            'notification-{}'.format(id),
+            timestamp,
+            date,
+            None,
+            None,
+            '{}: {}'.format(types.get(type, type), title),
+            description,
+            None,
+        )
+
+
+def ical_lines(events, name):
+    """
+    Lines of a calendar named `name` with `events`, `(uid, stamp, start,
+    end, frequency, summary, description, location)` tuples, written as
+    they come.
+    """
+    yield 'BEGIN:VCALENDAR\r\n'
+    yield 'VERSION:2.0\r\n'
+    yield 'PRODID:{}\r\n'.format(PRODID)
+    yield 'CALSCALE:GREGORIAN\r\n'
+    yield fold('X-WR-CALNAME:{}'.format(escape(name)))
+
+    for (uid, stamp, start, end, frequency,
+         summary, description, location) in events:
+        yield 'BEGIN:VEVENT\r\n'
+        yield fold('UID:{}@{}'.format(uid, UID_DOMAIN))
+        yield 'DTSTAMP:{}\r\n'.format(format_datetime(stamp))
+        yield 'DTSTART:{}\r\n'.format(format_datetime(start))
+
+        if end is not None:
+            yield 'DTEND:{}\r\n'.format(format_datetime(end))
+
+        if frequency is not None:
+            yield 'RRULE:FREQ={}\r\n'.format(frequency)
+
+        yield fold('SUMMARY:{}'.format(escape(summary)))
+
+        if description:
+            yield fold('DESCRIPTION:{}'.format(escape(description)))
+
+        if location:
+            yield fold('LOCATION:{}'.format(escape(location)))
+
+        yield 'END:VEVENT\r\n'
+
+    yield 'END:VCALENDAR\r\n'
@@ -0,0 +1,24 @@
+import datetime
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from core.models import ArchivedNotification
+
+
+class Command(BaseCommand):
+    help = 'Moves old notifications to the archive table.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--days', type=int,
+                            default=settings.SCHOOL_NOTIFICATION_ARCHIVE_DAYS)
+        parser.add_argument('--batch-size', type=int, default=1000)
+
+    def handle(self, *args, **options):
+        before = timezone.now() - datetime.timedelta(days=options['days'])
+
+        moved = ArchivedNotification.objects.archive(
+            before, batch_size=options['batch_size'])
+
+        self.stdout.write('Archived notifications: {}'.format(moved))
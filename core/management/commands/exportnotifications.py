@@ -0,0 +1,37 @@
+from django.core.management.base import BaseCommand
+
+from core.export import EXPORT_FORMATS, export_lines
+from core.models import ArchivedNotification, Notification
+
+
+class Command(BaseCommand):
+    help = 'Writes every notification, oldest first, as NDJSON or CSV.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--output', default='ndjson',
+                            choices=sorted(EXPORT_FORMATS))
+        parser.add_argument('--from-date', default=None)
+        parser.add_argument('--to-date', default=None)
+        parser.add_argument('--archive', action='store_true',
+                            help='Include the archived notifications.')
+
+    def handle(self, *args, **options):
+        # Archived notifications go first, as they are the oldest.
+        models = [Notification]
+        if options['archive']:
+            models.insert(0, ArchivedNotification)
+
+        querysets = []
+        for model in models:
+            queryset = model.objects.order_by('date', 'id')
+
+            if options['from_date'] is not None:
+                queryset = queryset.filter(date__gte=options['from_date'])
+
+            if options['to_date'] is not None:
+                queryset = queryset.filter(date__lt=options['to_date'])
+
+            querysets.append(queryset)
+
+        for line in export_lines(querysets, options['output']):
+            self.stdout.write(line, ending='')
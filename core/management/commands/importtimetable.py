@@ -0,0 +1,43 @@
+import os
+
+from django.core.exceptions import ValidationError
+from django.core.management.base import BaseCommand, CommandError
+
+from core.timetable import IMPORT_FORMATS, import_timetable, read_rows
+
+
+class Command(BaseCommand):
+    help = ('Creates the schedule rows of a CSV or JSON timetable at once, '
+            'after checking them together for conflicts.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('path')
+        parser.add_argument('--format', default=None,
+                            choices=IMPORT_FORMATS,
+                            help='Defaults to the extension of the file.')
+        parser.add_argument('--replace', action='store_true',
+                            help='Delete the current schedule first.')
+
+    def handle(self, *args, **options):
+        input_format = options['format'] or \
+            os.path.splitext(options['path'])[1][1:].lower()
+        if input_format not in IMPORT_FORMATS:
+            raise CommandError('Unknown format, use --format.')
+
+        try:
+            with open(options['path'], encoding='utf-8', newline='') as file:
+                rows = read_rows(file, input_format)
+
+            created = import_timetable(rows, replace=options['replace'])
+
+        except ValidationError as e:
+            for message in e.messages:
+                self.stderr.write(message)
+
+            raise CommandError('{} errors, nothing imported.'.format(
+                len(e.messages)))
+
+        except ValueError as e:
+            raise CommandError('Bad {} file: {}'.format(input_format, e))
+
+        self.stdout.write('Schedule rows: {}'.format(len(created)))
@@ -0,0 +1,19 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from core.models import NotificationInbox
+
+
+class Command(BaseCommand):
+    help = 'Builds the notification inbox of every parent from scratch.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000)
+
+    def handle(self, *args, **options):
+        with transaction.atomic():
+            NotificationInbox.objects.rebuild(
+                batch_size=options['batch_size'])
+
+        self.stdout.write('Inbox rows: {}'.format(
+            NotificationInbox.objects.count()))
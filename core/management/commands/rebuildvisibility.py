@@ -0,0 +1,18 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from core.models import UserVisibility
+
+
+class Command(BaseCommand):
+    help = 'Builds the contact list of every user from scratch.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000)
+
+    def handle(self, *args, **options):
+        with transaction.atomic():
+            UserVisibility.objects.rebuild(batch_size=options['batch_size'])
+
+        self.stdout.write('Visibility rows: {}'.format(
+            UserVisibility.objects.count()))
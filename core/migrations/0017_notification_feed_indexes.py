@@ -0,0 +1,55 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11.3 on 2026-10-18 18:53
+from __future__ import unicode_literals
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0016_notificationinbox'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='notification',
+            name='owner',
+            field=models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, to=settings.AUTH_USER_MODEL),
+        ),
+        migrations.AlterField(
+            model_name='notification',
+            name='subject',
+            field=models.ForeignKey(blank=True, db_index=False, default=None, null=True, on_delete=django.db.models.deletion.SET_NULL, to='core.Subject'),
+        ),
+        migrations.AlterField(
+            model_name='notification',
+            name='target_student',
+            field=models.ForeignKey(blank=True, db_index=False, default=None, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='notifications_received', to=settings.AUTH_USER_MODEL),
+        ),
+        migrations.AddIndex(
+            model_name='notification',
+            index=models.Index(fields=['-date', '-id'], name='core_notif_date_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='notification',
+            index=models.Index(fields=['owner', '-date', '-id'], name='core_notif_owner_date_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='notification',
+            index=models.Index(fields=['target_student', '-date', '-id'], name='core_notif_student_date_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='notification',
+            index=models.Index(fields=['subject', '-date', '-id'], name='core_notif_subject_date_idx'),
+        ),
+        # Class-wide notifications, as looked up by the `student` filter.
+        migrations.RunSQL(
+            'CREATE INDEX core_notif_class_date_idx '
+            'ON core_notification (target_class_id, date DESC, id DESC) '
+            'WHERE target_student_id IS NULL',
+            'DROP INDEX core_notif_class_date_idx',
+        ),
+    ]
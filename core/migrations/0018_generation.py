@@ -0,0 +1,35 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11.3 on 2026-10-18 19:07
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+import django.utils.timezone
+
+
+KEYS = ('notification', 'class', 'user', 'subject', 'class_teacher_subject',
+        'schedule')
+
+
+def create_generations(apps, schema_editor):
+    Generation = apps.get_model('core', 'Generation')
+
+    Generation.objects.bulk_create([Generation(key=key) for key in KEYS])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0017_notification_feed_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Generation',
+            fields=[
+                ('key', models.CharField(max_length=50, primary_key=True, serialize=False)),
+                ('value', models.BigIntegerField(default=0)),
+                ('modified', models.DateTimeField(default=django.utils.timezone.now)),
+            ],
+        ),
+        migrations.RunPython(create_generations, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,39 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11.3 on 2026-10-18 19:11
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0018_generation'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='notificationinbox',
+            name='timestamp',
+            field=models.DateTimeField(default=None, null=True),
+        ),
+        migrations.RunSQL(
+            'UPDATE core_notificationinbox AS inbox '
+            'SET timestamp = notification.timestamp '
+            'FROM core_notification AS notification '
+            'WHERE notification.id = inbox.notification_id',
+            migrations.RunSQL.noop,
+        ),
+        migrations.AddIndex(
+            model_name='notification',
+            index=models.Index(fields=['timestamp', 'id'], name='core_notif_ts_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='notification',
+            index=models.Index(fields=['owner', 'timestamp', 'id'], name='core_notif_owner_ts_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='notificationinbox',
+            index=models.Index(fields=['recipient', 'timestamp', 'notification'], name='core_inbox_changes_idx'),
+        ),
+    ]
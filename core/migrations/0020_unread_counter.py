@@ -0,0 +1,37 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11.3 on 2026-10-18 19:14
+from __future__ import unicode_literals
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0019_notification_changes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='UnreadCounter',
+            fields=[
+                ('user', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='unread_counter', serialize=False, to=settings.AUTH_USER_MODEL)),
+                ('unread', models.IntegerField(default=0)),
+            ],
+        ),
+        migrations.AddField(
+            model_name='notificationinbox',
+            name='read_at',
+            field=models.DateTimeField(default=None, null=True),
+        ),
+        migrations.RunSQL(
+            'INSERT INTO core_unreadcounter (user_id, unread) '
+            'SELECT core_user.id, COUNT(core_notificationinbox.id) '
+            'FROM core_user LEFT JOIN core_notificationinbox '
+            'ON core_notificationinbox.recipient_id = core_user.id '
+            'GROUP BY core_user.id',
+            migrations.RunSQL.noop,
+        ),
+    ]
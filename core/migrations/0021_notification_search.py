@@ -0,0 +1,52 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11.3 on 2026-10-18 19:20
+from __future__ import unicode_literals
+
+import django.contrib.postgres.search
+from django.db import migrations, models
+
+
+# Keep the configuration in line with `core.models.SEARCH_CONFIG`.
+CREATE_SEARCH = '''
+CREATE FUNCTION core_notification_search_vector() RETURNS trigger AS $$
+BEGIN
+    NEW.search_vector :=
+        setweight(to_tsvector('spanish', coalesce(NEW.title, '')), 'A') ||
+        setweight(to_tsvector('spanish', coalesce(NEW.description, '')), 'B');
+    RETURN NEW;
+END
+$$ LANGUAGE plpgsql;
+
+CREATE TRIGGER core_notification_search_vector
+BEFORE INSERT OR UPDATE OF title, description ON core_notification
+FOR EACH ROW EXECUTE PROCEDURE core_notification_search_vector();
+
+UPDATE core_notification SET title = title;
+
+-- Without the pending list, new notifications are searchable through the
+-- index right away instead of after the next vacuum.
+CREATE INDEX core_notif_search_idx ON core_notification
+USING gin (search_vector) WITH (fastupdate = off);
+'''
+
+DROP_SEARCH = '''
+DROP INDEX core_notif_search_idx;
+DROP TRIGGER core_notification_search_vector ON core_notification;
+DROP FUNCTION core_notification_search_vector();
+'''
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0020_unread_counter'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='notification',
+            name='search_vector',
+            field=django.contrib.postgres.search.SearchVectorField(editable=False, null=True),
+        ),
+        migrations.RunSQL(CREATE_SEARCH, DROP_SEARCH),
+    ]
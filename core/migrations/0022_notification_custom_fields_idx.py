@@ -0,0 +1,24 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11.3 on 2026-10-18 19:31
+from __future__ import unicode_literals
+
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0021_notification_search'),
+    ]
+
+    operations = [
+        # `jsonb_path_ops` only supports containment (`@>`), which is what
+        # the custom field filters of the notification list use, and is
+        # smaller and faster for it than the default `jsonb_ops`.
+        migrations.RunSQL(
+            'CREATE INDEX core_notif_custom_fields_idx ON core_notification '
+            'USING gin (custom_fields jsonb_path_ops) '
+            'WITH (fastupdate = off)',
+            'DROP INDEX core_notif_custom_fields_idx',
+        ),
+    ]
@@ -0,0 +1,50 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11.3 on 2026-10-18 19:30
+from __future__ import unicode_literals
+
+from django.conf import settings
+import django.contrib.postgres.fields.jsonb
+import django.contrib.postgres.search
+from django.db import migrations, models
+import django.db.models.deletion
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0022_notification_custom_fields_idx'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ArchivedNotification',
+            fields=[
+                ('title', models.CharField(max_length=100)),
+                ('description', models.TextField()),
+                ('timestamp', models.DateTimeField(default=django.utils.timezone.now)),
+                ('date', models.DateTimeField(default=None, null=True)),
+                ('icon', models.CharField(blank=True, max_length=300, null=True)),
+                ('search_vector', django.contrib.postgres.search.SearchVectorField(editable=False, null=True)),
+                ('type', models.CharField(choices=[('GENERIC', 'Generic'), ('EXAM', 'Exam'), ('TASK', 'Task'), ('ATTENDANCE', 'Attendance')], default='GENERIC', max_length=10)),
+                ('custom_fields', django.contrib.postgres.fields.jsonb.JSONField(default=dict)),
+                ('id', models.IntegerField(primary_key=True, serialize=False)),
+                ('owner', models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, to=settings.AUTH_USER_MODEL)),
+                ('subject', models.ForeignKey(blank=True, db_index=False, default=None, null=True, on_delete=django.db.models.deletion.SET_NULL, to='core.Subject')),
+                ('target_class', models.ForeignKey(blank=True, default=None, null=True, on_delete=django.db.models.deletion.SET_NULL, to='core.Class')),
+                ('target_student', models.ForeignKey(blank=True, db_index=False, default=None, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='archivednotifications_received', to=settings.AUTH_USER_MODEL)),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='archivednotification',
+            index=models.Index(fields=['-date', '-id'], name='core_archnotif_date_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='archivednotification',
+            index=models.Index(fields=['owner', '-date', '-id'], name='core_archnotif_owner_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='archivednotification',
+            index=models.Index(fields=['target_student', '-date', '-id'], name='core_archnotif_student_idx'),
+        ),
+    ]
@@ -0,0 +1,43 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11.3 on 2026-10-18 19:50
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0023_archived_notification'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='archivednotification',
+            name='deliver_at',
+            field=models.DateTimeField(blank=True, default=None, null=True),
+        ),
+        migrations.AddField(
+            model_name='archivednotification',
+            name='delivered_at',
+            field=models.DateTimeField(default=None, editable=False, null=True),
+        ),
+        migrations.AddField(
+            model_name='notification',
+            name='deliver_at',
+            field=models.DateTimeField(blank=True, default=None, null=True),
+        ),
+        migrations.AddField(
+            model_name='notification',
+            name='delivered_at',
+            field=models.DateTimeField(default=None, editable=False, null=True),
+        ),
+        # Pending deliveries, claimed by `worker.tasks.deliver_notifications`
+        # in `deliver_at` order.
+        migrations.RunSQL(
+            'CREATE INDEX core_notif_pending_idx '
+            'ON core_notification (deliver_at, id) '
+            'WHERE deliver_at IS NOT NULL AND delivered_at IS NULL',
+            'DROP INDEX core_notif_pending_idx',
+        ),
+    ]
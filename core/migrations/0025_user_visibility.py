@@ -0,0 +1,30 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11.3 on 2026-10-18 19:58
+from __future__ import unicode_literals
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0024_notification_deliver_at'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='UserVisibility',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('relation', models.CharField(choices=[('teacher', 'Teacher'), ('parent', 'Parent'), ('student', 'Student')], max_length=10)),
+                ('viewer', models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, related_name='visible_users', to=settings.AUTH_USER_MODEL)),
+                ('visible_user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='visible_to', to=settings.AUTH_USER_MODEL)),
+            ],
+        ),
+        migrations.AlterUniqueTogether(
+            name='uservisibility',
+            unique_together=set([('viewer', 'relation', 'visible_user')]),
+        ),
+    ]
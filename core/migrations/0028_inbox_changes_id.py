@@ -0,0 +1,39 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11.3 on 2026-10-18 21:27
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0027_notification_delivery_attempts'),
+    ]
+
+    operations = [
+        migrations.RemoveIndex(
+            model_name='notification',
+            name='core_notif_ts_idx',
+        ),
+        migrations.RemoveIndex(
+            model_name='notification',
+            name='core_notif_owner_ts_idx',
+        ),
+        migrations.RemoveIndex(
+            model_name='notificationinbox',
+            name='core_inbox_changes_idx',
+        ),
+        migrations.RemoveField(
+            model_name='notificationinbox',
+            name='timestamp',
+        ),
+        migrations.AddIndex(
+            model_name='notification',
+            index=models.Index(fields=['owner', 'id'], name='core_notif_owner_id_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='notificationinbox',
+            index=models.Index(fields=['recipient', 'id'], name='core_inbox_changes_idx'),
+        ),
+    ]
@@ -1,19 +1,39 @@
 import datetime
 
 from django.core.exceptions import ValidationError
-from django.db import models
+from django.db import connection, models, transaction
+from django.db.models import Count, OuterRef, Q, Subquery
+from django.db.models.functions import Coalesce
 from django.contrib.postgres.fields import JSONField
+from django.contrib.postgres.search import SearchVectorField
 from django.contrib.auth.models import AbstractUser, BaseUserManager, Group
 from django.db.models.signals import post_save  # , pre_save
 from django.dispatch import receiver
 from django.utils.translation import ugettext_lazy as _
 from django.utils import timezone
+from django.utils.functional import cached_property
 
 GROUP_ADMIN_ID = 'Admin'
 GROUP_TEACHER_ID = 'Teacher'
 GROUP_STUDENT_ID = 'Student'
 GROUP_PARENT_ID = 'Parent'
 
+# Groups deciding what a user can see, from the highest precedence.
+ROLES = (GROUP_ADMIN_ID, GROUP_TEACHER_ID, GROUP_PARENT_ID, GROUP_STUDENT_ID)
+
+# Text search configuration of `Notification.search_vector`. The column is
+# filled by a trigger (migration 0021) that must use the same configuration.
+SEARCH_CONFIG = 'spanish'
+
+
+def role_of(group_names):
+    """ Returns the role given by `group_names`, `None` if there is none. """
+    for role in ROLES:
+        if role in group_names:
+            return role
+
+    return None
+
 
 def create_default_groups():
     Group.objects.get_or_create(name=GROUP_TEACHER_ID)
@@ -100,6 +120,51 @@ class User(AbstractUser):
                                       related_name='students',
                                       )
 
+    # Bumped when the claims of the user's tokens go stale (see
+    # `api.authentication`).
+    token_version = models.PositiveIntegerField(default=0, editable=False)
+
+    @cached_property
+    def group_names(self):
+        """
+        Names of the groups of the user, loaded with a single query and kept
+        for the life of the instance, which is the request for
+        `request.user`.
+        """
+        return frozenset(self.groups.values_list('name', flat=True))
+
+    @property
+    def role(self):
+        return role_of(self.group_names)
+
+    @cached_property
+    def class_ids(self):
+        """
+        Ids of the classes the user teaches in, attends, or whose children
+        attend, depending on the role.
+        """
+        role = self.role
+
+        if role == GROUP_TEACHER_ID:
+            ids = ClassTeacherSubject.objects.filter(
+                teacher=self).values_list('teaches_in_id', flat=True)
+
+        elif role == GROUP_PARENT_ID:
+            ids = self.children.filter(
+                attends__isnull=False).values_list('attends_id', flat=True)
+
+        elif role == GROUP_STUDENT_ID and self.attends_id is not None:
+            ids = [self.attends_id]
+
+        else:
+            ids = []
+
+        return sorted(set(ids))
+
+    @cached_property
+    def children_ids(self):
+        return sorted(self.children.values_list('id', flat=True))
+
 
 class ClassTeacherSubject(models.Model):
     teacher = models.ForeignKey(User,
@@ -139,18 +204,29 @@ class ClassTeacherSubject(models.Model):
 #         Profile.objects.create(user=instance)
 
 
-class Notification(models.Model):
-    owner = models.ForeignKey(User, on_delete=models.CASCADE, null=False)
+class AbstractNotification(models.Model):
+    """
+    Fields shared by the live notifications and the archived ones.
+    """
+    # The single column indexes on `owner`, `target_student` and `subject`
+    # are covered by the composite indexes declared in `Meta`.
+    owner = models.ForeignKey(User,
+                              on_delete=models.CASCADE,
+                              null=False,
+                              db_index=False,
+                              )
     title = models.CharField(max_length=100, blank=False, null=False)
     description = models.TextField()
     timestamp = models.DateTimeField(default=timezone.now)
     date = models.DateTimeField(default=None, null=True)
+    # `notifications_received` on `Notification`.
     target_student = models.ForeignKey(User,
-                                       related_name='notifications_received',
+                                       related_name='%(class)ss_received',
                                        default=None,
                                        on_delete=models.SET_NULL,
                                        null=True,
-                                       blank=True)
+                                       blank=True,
+                                       db_index=False)
     target_class = models.ForeignKey(Class,
                                      on_delete=models.SET_NULL,
                                      default=None,
@@ -161,8 +237,13 @@ class Notification(models.Model):
                                 null=True,
                                 blank=True,
                                 default=None,
+                                db_index=False,
                                 )
     icon = models.CharField(max_length=300, blank=True, null=True)
+    # Weighted `title` (A) and `description` (B) lexemes, maintained by a
+    # database trigger so that `bulk_create` and raw updates are covered.
+    # Archived rows keep the vector computed while they were live.
+    search_vector = SearchVectorField(null=True, editable=False)
 
     TYPE_GENERIC = 'GENERIC'
     TYPE_EXAM = 'EXAM'
@@ -183,12 +264,338 @@ class Notification(models.Model):
 
     custom_fields = JSONField(default=dict)
 
+    # Pushes are held until `deliver_at`, when given, and `delivered_at`
+    # records when the scheduler pushed them. Failed pushes are retried
+    # later, up to `SCHOOL_DELIVERY_MAX_ATTEMPTS` attempts.
+    deliver_at = models.DateTimeField(default=None, null=True, blank=True)
+    delivered_at = models.DateTimeField(default=None, null=True,
+                                        editable=False)
+    delivery_attempts = models.PositiveSmallIntegerField(default=0,
+                                                         editable=False)
+
+    class Meta:
+        abstract = True
+
     def clean(self):
         if self.target_student is None and self.target_class is None:
             raise ValidationError(_('Notification may have directed to a '
                                     'student or a class.'))
 
 
+class Notification(AbstractNotification):
+    class Meta:
+        # One index per query shape of `NotificationsService`: a scope
+        # column followed by the `(date, id)` feed order. Class-wide
+        # notifications (`target_student IS NULL`) get a partial index
+        # created in migration 0017, which Django cannot declare here. The
+        # GIN indexes on `search_vector` (migration 0021) and on
+        # `custom_fields` (migration 0022) are created without `fastupdate`
+        # and the latter with `jsonb_path_ops`, which `GinIndex` cannot
+        # express either, and neither can the partial index on the pending
+        # deliveries (migration 0024).
+        indexes = [
+            models.Index(fields=['-date', '-id'],
+                         name='core_notif_date_idx'),
+            models.Index(fields=['owner', '-date', '-id'],
+                         name='core_notif_owner_date_idx'),
+            models.Index(fields=['target_student', '-date', '-id'],
+                         name='core_notif_student_date_idx'),
+            models.Index(fields=['subject', '-date', '-id'],
+                         name='core_notif_subject_date_idx'),
+            # Delta sync (`/notifications/changes/`) walks the ids, which the
+            # database hands out at insert.
+            models.Index(fields=['owner', 'id'],
+                         name='core_notif_owner_id_idx'),
+        ]
+
+
+class NotificationInboxManager(models.Manager):
+    def _recipients(self, notifications):
+        """
+        Maps each notification id to the ids of the parents that can read
+        it: parents of the target student and parents of the students
+        attending the target class.
+        """
+        parents = User.parents.through.objects
+
+        student_ids = set(n.target_student_id for n in notifications
+                          if n.target_student_id is not None)
+        class_ids = set(n.target_class_id for n in notifications
+                        if n.target_class_id is not None)
+
+        by_student = {}
+        if student_ids:
+            for child_id, parent_id in parents.filter(
+                    from_user_id__in=student_ids,
+            ).values_list('from_user_id', 'to_user_id'):
+                by_student.setdefault(child_id, set()).add(parent_id)
+
+        by_class = {}
+        if class_ids:
+            for class_id, parent_id in parents.filter(
+                    from_user__attends_id__in=class_ids,
+            ).values_list('from_user__attends_id', 'to_user_id'):
+                by_class.setdefault(class_id, set()).add(parent_id)
+
+        return {
+            n.id: by_student.get(n.target_student_id, set()) |
+            by_class.get(n.target_class_id, set())
+            for n in notifications
+        }
+
+    def fan_out(self, notifications, created=True):
+        """
+        Brings the inbox rows of `notifications` in line with their targets.
+
+        Freshly created notifications only need their rows inserted; for
+        updated ones stale rows are removed and dates are refreshed.
+        """
+        notifications = list(notifications)
+        if not notifications:
+            return
+
+        recipients = self._recipients(notifications)
+
+        existing = set()
+        if not created:
+            existing = set(self.filter(
+                notification_id__in=recipients.keys(),
+            ).values_list('recipient_id', 'notification_id'))
+
+        wanted = set((recipient_id, n.id)
+                     for n in notifications
+                     for recipient_id in recipients[n.id])
+        dates = {n.id: n.date for n in notifications}
+
+        stale = existing - wanted
+        for recipient_id, notification_id in stale:
+            self.filter(recipient_id=recipient_id,
+                        notification_id=notification_id).delete()
+
+        added = sorted(wanted - existing)
+        self.bulk_create([
+            self.model(recipient_id=recipient_id,
+                       notification_id=notification_id,
+                       date=dates[notification_id])
+            for recipient_id, notification_id in added
+        ])
+
+        # New rows are unread; removed ones may or may not have been read.
+        unread = {}
+        for recipient_id, notification_id in added:
+            unread[recipient_id] = unread.get(recipient_id, 0) + 1
+
+        UnreadCounter.objects.add(unread)
+        UnreadCounter.objects.recount(
+            set(recipient_id for recipient_id, notification_id in stale))
+
+        if not created:
+            for n in notifications:
+                self.filter(notification_id=n.id).exclude(
+                    date=n.date,
+                ).update(date=n.date)
+
+    def rebuild_for(self, recipient_ids):
+        """
+        Recomputes the inbox of the given parents after their children or
+        their children's classes changed.
+        """
+        recipient_ids = set(recipient_ids)
+
+        for recipient_id in recipient_ids:
+            classes = Class.objects.filter(students__parents=recipient_id)
+
+            wanted = dict(Notification.objects.filter(
+                Q(target_student__parents=recipient_id) |
+                Q(target_class__in=classes)
+            ).distinct().values_list('id', 'date'))
+
+            existing = set(self.filter(
+                recipient_id=recipient_id,
+            ).values_list('notification_id', flat=True))
+
+            self.filter(
+                recipient_id=recipient_id,
+                notification_id__in=existing - set(wanted),
+            ).delete()
+
+            self.bulk_create([
+                self.model(recipient_id=recipient_id,
+                           notification_id=notification_id,
+                           date=wanted[notification_id])
+                for notification_id in sorted(set(wanted) - existing)
+            ])
+
+        UnreadCounter.objects.recount(recipient_ids)
+
+    def rebuild(self, batch_size=1000):
+        """
+        Rebuilds the whole inbox from the notification table, a batch of
+        notifications at a time. Rows kept across the rebuild keep their
+        `read_at`, and the unread counters are recomputed from the result.
+        """
+        user_ids = set(UnreadCounter.objects.values_list('user_id',
+                                                         flat=True))
+
+        queryset = Notification.objects.only(
+            'id', 'date', 'target_student', 'target_class',
+        ).order_by('id')
+
+        last_id = 0
+        while True:
+            batch = list(queryset.filter(id__gt=last_id)[:batch_size])
+            if not batch:
+                break
+
+            recipients = self._recipients(batch)
+
+            rows = self.filter(notification_id__in=recipients.keys())
+            read_at = {
+                (recipient_id, notification_id): value
+                for recipient_id, notification_id, value in rows.filter(
+                    read_at__isnull=False,
+                ).values_list('recipient_id', 'notification_id', 'read_at')
+            }
+            rows.delete()
+
+            self.bulk_create([
+                self.model(recipient_id=recipient_id,
+                           notification_id=n.id,
+                           date=n.date,
+                           read_at=read_at.get((recipient_id, n.id), None))
+                for n in batch
+                for recipient_id in sorted(recipients[n.id])
+            ])
+
+            user_ids.update(*recipients.values())
+            last_id = batch[-1].id
+
+        UnreadCounter.objects.recount(user_ids)
+
+
+class NotificationInbox(models.Model):
+    """
+    One row per notification and parent allowed to read it.
+
+    Rows are written when a notification is created (fan-out on write) so
+    that reading a parent's feed is a range scan over
+    `(recipient, date, notification)` instead of a join through the
+    `parents` relation.
+    """
+    recipient = models.ForeignKey(User,
+                                  related_name='inbox',
+                                  on_delete=models.CASCADE,
+                                  db_index=False,
+                                  )
+    notification = models.ForeignKey(Notification,
+                                     related_name='inbox_entries',
+                                     on_delete=models.CASCADE,
+                                     )
+    # Copy of `Notification.date`, so that the feed can be ordered without
+    # leaving the index. The delta sync walks the ids instead: a row added
+    # to an inbox later than its notification, as `rebuild_for` does, comes
+    # after what the parent has already synced.
+    date = models.DateTimeField(default=None, null=True)
+    read_at = models.DateTimeField(default=None, null=True)
+
+    objects = NotificationInboxManager()
+
+    class Meta:
+        unique_together = ('recipient', 'notification')
+        indexes = [
+            models.Index(fields=['recipient', '-date', '-notification'],
+                         name='core_inbox_feed_idx'),
+            models.Index(fields=['recipient', 'id'],
+                         name='core_inbox_changes_idx'),
+        ]
+
+
+class ArchivedNotificationManager(models.Manager):
+    def archive(self, before, batch_size=1000):
+        """
+        Moves the notifications dated before `before`, or created before it
+        when they have no date, to the archive. Every batch of `batch_size`
+        rows is moved in its own transaction. Returns the number of
+        notifications moved.
+
+        The inbox rows of moved notifications are dropped: archived
+        notifications reach parents through their targets.
+        """
+        qn = connection.ops.quote_name
+        columns = ', '.join(qn(field.column)
+                            for field in Notification._meta.concrete_fields)
+        move = (
+            'INSERT INTO {archive} ({columns}) '
+            'SELECT {columns} FROM {table} WHERE id = ANY(%s)'
+        ).format(archive=qn(self.model._meta.db_table),
+                 table=qn(Notification._meta.db_table),
+                 columns=columns)
+        delete = 'DELETE FROM {table} WHERE id = ANY(%s)'.format(
+            table=qn(Notification._meta.db_table))
+
+        # Notifications still waiting for their push stay live.
+        queryset = Notification.objects.select_for_update().filter(
+            Q(date__lt=before) | Q(date__isnull=True, timestamp__lt=before),
+        ).exclude(
+            deliver_at__isnull=False, delivered_at__isnull=True,
+        ).order_by('id').values_list('id', flat=True)
+
+        moved = 0
+        while True:
+            with transaction.atomic():
+                ids = list(queryset[:batch_size])
+                if not ids:
+                    break
+
+                inbox = NotificationInbox.objects.filter(
+                    notification_id__in=ids)
+                recipient_ids = set(inbox.filter(
+                    read_at__isnull=True,
+                ).values_list('recipient_id', flat=True))
+                inbox.delete()
+
+                # Plain SQL, as the rows only change table: going through
+                # the ORM would fan out and push them again.
+                with connection.cursor() as cursor:
+                    cursor.execute(move, [ids])
+                    cursor.execute(delete, [ids])
+
+                UnreadCounter.objects.recount(recipient_ids)
+
+            moved += len(ids)
+
+        if moved:
+            Generation.objects.bump(Generation.NOTIFICATION)
+
+        return moved
+
+
+class ArchivedNotification(AbstractNotification):
+    """
+    Notifications moved out of `Notification` once they are older than
+    `SCHOOL_NOTIFICATION_ARCHIVE_DAYS`, so that the live table and its
+    indexes only hold the current school year.
+
+    Rows keep their original id and are only read by the feeds requested
+    with `?archive=1`.
+    """
+    id = models.IntegerField(primary_key=True)
+
+    objects = ArchivedNotificationManager()
+
+    class Meta:
+        # The feed indexes of `Notification`, without the ones serving
+        # filters and search: archived feeds are rarely read.
+        indexes = [
+            models.Index(fields=['-date', '-id'],
+                         name='core_archnotif_date_idx'),
+            models.Index(fields=['owner', '-date', '-id'],
+                         name='core_archnotif_owner_idx'),
+            models.Index(fields=['target_student', '-date', '-id'],
+                         name='core_archnotif_student_idx'),
+        ]
+
+
 class Schedule(models.Model):
     MONDAY = 'MONDAY'
     TUESDAY = 'TUESDAY'
@@ -241,3 +648,337 @@ class Schedule(models.Model):
     class Meta:
         unique_together = ('day', 'time', 'order', 'class_teacher_subject')
 
+
+class UnreadCounterManager(models.Manager):
+    def add(self, deltas):
+        """
+        Adds `deltas`, a mapping of user ids to increments, to the counters
+        with one `UPDATE` per distinct increment.
+        """
+        users = {}
+        for user_id, delta in deltas.items():
+            if delta:
+                users.setdefault(delta, []).append(user_id)
+
+        for delta, user_ids in users.items():
+            self.filter(user_id__in=user_ids).update(
+                unread=models.F('unread') + delta)
+
+    def recount(self, user_ids):
+        """
+        Recomputes the counters of `user_ids` from their inbox.
+        """
+        user_ids = set(user_ids)
+        if not user_ids:
+            return
+
+        existing = set(self.filter(user_id__in=user_ids).values_list(
+            'user_id', flat=True))
+        self.bulk_create([self.model(user_id=user_id)
+                          for user_id in user_ids - existing])
+
+        unread = NotificationInbox.objects.filter(
+            recipient=OuterRef('user'),
+            read_at__isnull=True,
+        ).order_by().values('recipient').annotate(
+            count=Count('*'),
+        ).values('count')
+
+        self.filter(user_id__in=user_ids).update(
+            unread=Coalesce(Subquery(unread,
+                                     output_field=models.IntegerField()),
+                            0))
+
+    def unread_for(self, user):
+        """
+        Returns the number of unread notifications of `user`.
+        """
+        try:
+            return self.get(user=user).unread
+
+        except self.model.DoesNotExist:
+            self.recount([user.id])
+
+            return self.get(user=user).unread
+
+
+class UnreadCounter(models.Model):
+    """
+    Number of unread inbox rows of a user, kept up to date as rows are
+    fanned out and marked as read so that the badge count is a primary
+    key lookup.
+    """
+    user = models.OneToOneField(User,
+                                related_name='unread_counter',
+                                on_delete=models.CASCADE,
+                                primary_key=True,
+                                )
+    unread = models.IntegerField(default=0)
+
+    objects = UnreadCounterManager()
+
+
+class GenerationManager(models.Manager):
+    def bump(self, *keys):
+        """
+        Increments the counters of `keys`, creating the missing ones.
+        """
+        now = timezone.now()
+
+        updated = self.filter(key__in=keys).update(value=models.F('value') + 1,
+                                                   modified=now)
+
+        # Counters are created by migration 0018; this only covers new keys.
+        if updated < len(set(keys)):
+            existing = set(self.filter(key__in=keys).values_list('key',
+                                                                 flat=True))
+            for key in set(keys) - existing:
+                self.get_or_create(key=key,
+                                   defaults={'value': 1, 'modified': now})
+
+    def current(self, keys):
+        """
+        Returns the values of `keys`, in order, and their latest
+        modification date with a single query.
+        """
+        generations = {g.key: g for g in self.filter(key__in=keys)}
+
+        values = [generations[key].value if key in generations else 0
+                  for key in keys]
+        modified = max((g.modified for g in generations.values()),
+                       default=None)
+
+        return values, modified
+
+
+class Generation(models.Model):
+    """
+    Counter bumped on every change of the rows behind `key`.
+
+    List endpoints derive their `ETag` from the counters of the tables they
+    render, so that a conditional request is answered without running the
+    list queries.
+    """
+    NOTIFICATION = 'notification'
+    CLASS = 'class'
+    USER = 'user'
+    SUBJECT = 'subject'
+    CLASS_TEACHER_SUBJECT = 'class_teacher_subject'
+    SCHEDULE = 'schedule'
+
+    key = models.CharField(max_length=50, primary_key=True)
+    value = models.BigIntegerField(default=0)
+    modified = models.DateTimeField(default=timezone.now)
+
+    objects = GenerationManager()
+
+
+class UserVisibilityManager(models.Manager):
+    def viewers_of(self, user_ids=(), class_ids=()):
+        """
+        Returns the ids of the users whose contact list may change when
+        `user_ids` or the members of `class_ids` change: the users
+        themselves, their parents, and the parents and teachers of the
+        classes they attend, teach in or their children attend.
+        """
+        user_ids = set(user_ids) - {None}
+        class_ids = set(class_ids) - {None}
+
+        if user_ids:
+            class_ids.update(Class.objects.filter(
+                Q(students__in=user_ids) |
+                Q(students__parents__in=user_ids) |
+                Q(teachers_subjects__teacher__in=user_ids)
+            ).values_list('id', flat=True))
+
+        viewer_ids = set(user_ids)
+        viewer_ids.update(User.parents.through.objects.filter(
+            Q(from_user_id__in=user_ids) |
+            Q(from_user__attends_id__in=class_ids)
+        ).values_list('to_user_id', flat=True))
+        viewer_ids.update(ClassTeacherSubject.objects.filter(
+            teaches_in_id__in=class_ids,
+        ).values_list('teacher_id', flat=True))
+
+        return viewer_ids
+
+    def _visible(self, viewer_ids):
+        """
+        Returns the `(viewer_id, visible_user_id, relation)` rows of the
+        contact lists of `viewer_ids`, computed from the relations with a
+        fixed number of queries:
+
+        - Teachers list all other teachers, and the students of their
+          classes and their parents.
+        - Parents list their children, and the teachers of the classes
+          that their children attend and the parents of their students.
+        - Admins list every user, without going through the table, and
+          students list nobody.
+        """
+        parents = User.parents.through.objects
+
+        groups = {}
+        for user_id, name in User.groups.through.objects.filter(
+                user_id__in=viewer_ids,
+        ).values_list('user_id', 'group__name'):
+            groups.setdefault(user_id, set()).add(name)
+
+        teacher_ids = set(id for id, names in groups.items()
+                          if role_of(names) == GROUP_TEACHER_ID)
+        parent_ids = set(id for id, names in groups.items()
+                         if role_of(names) == GROUP_PARENT_ID)
+
+        classes = {}
+        for teacher_id, class_id in ClassTeacherSubject.objects.filter(
+                teacher_id__in=teacher_ids,
+        ).values_list('teacher_id', 'teaches_in_id'):
+            classes.setdefault(teacher_id, set()).add(class_id)
+
+        children = {}
+        for parent_id, child_id, class_id in parents.filter(
+                to_user_id__in=parent_ids,
+        ).values_list('to_user_id', 'from_user_id', 'from_user__attends_id'):
+            children.setdefault(parent_id, set()).add(child_id)
+            if class_id is not None:
+                classes.setdefault(parent_id, set()).add(class_id)
+
+        class_ids = set().union(*classes.values())
+
+        class_parents = {}
+        for class_id, parent_id in parents.filter(
+                from_user__attends_id__in=class_ids,
+                to_user__groups__name=GROUP_PARENT_ID,
+        ).values_list('from_user__attends_id', 'to_user_id'):
+            class_parents.setdefault(class_id, set()).add(parent_id)
+
+        class_students = {}
+        for student_id, class_id in User.objects.filter(
+                attends_id__in=class_ids,
+                groups__name=GROUP_STUDENT_ID,
+        ).values_list('id', 'attends_id'):
+            class_students.setdefault(class_id, set()).add(student_id)
+
+        class_teachers = {}
+        for class_id, teacher_id in ClassTeacherSubject.objects.filter(
+                teaches_in_id__in=class_ids,
+                teacher__groups__name=GROUP_TEACHER_ID,
+        ).values_list('teaches_in_id', 'teacher_id'):
+            class_teachers.setdefault(class_id, set()).add(teacher_id)
+
+        all_teacher_ids = set()
+        if teacher_ids:
+            all_teacher_ids.update(User.objects.filter(
+                groups__name=GROUP_TEACHER_ID,
+            ).values_list('id', flat=True))
+
+        student_ids = set(User.objects.filter(
+            id__in=set().union(*children.values()),
+            groups__name=GROUP_STUDENT_ID,
+        ).values_list('id', flat=True))
+
+        visible = set()
+        for viewer_id in teacher_ids | parent_ids:
+            if viewer_id in teacher_ids:
+                related = ((class_parents, self.model.PARENT),
+                           (class_students, self.model.STUDENT))
+                others = ((all_teacher_ids, self.model.TEACHER),)
+
+            else:
+                related = ((class_parents, self.model.PARENT),
+                           (class_teachers, self.model.TEACHER))
+                others = ((children.get(viewer_id, set()) & student_ids,
+                           self.model.STUDENT),)
+
+            for class_id in classes.get(viewer_id, ()):
+                for users, relation in related:
+                    visible.update((viewer_id, id, relation)
+                                   for id in users.get(class_id, ()))
+
+            for ids, relation in others:
+                visible.update((viewer_id, id, relation) for id in ids)
+
+        return set(row for row in visible if row[0] != row[1])
+
+    def rebuild_for(self, viewer_ids):
+        """
+        Recomputes the contact list of the given users after their groups,
+        children or classes, or those of their contacts, changed.
+        """
+        viewer_ids = set(viewer_ids)
+        if not viewer_ids:
+            return
+
+        wanted = self._visible(viewer_ids)
+
+        existing = {
+            (viewer_id, visible_user_id, relation): id
+            for id, viewer_id, visible_user_id, relation in self.filter(
+                viewer_id__in=viewer_ids,
+            ).values_list('id', 'viewer_id', 'visible_user_id', 'relation')
+        }
+
+        stale = [id for row, id in existing.items() if row not in wanted]
+        if stale:
+            self.filter(id__in=stale).delete()
+
+        self.bulk_create([
+            self.model(viewer_id=viewer_id,
+                       visible_user_id=visible_user_id,
+                       relation=relation)
+            for viewer_id, visible_user_id, relation in sorted(
+                wanted - set(existing))
+        ])
+
+    def rebuild(self, batch_size=1000):
+        """
+        Rebuilds the whole table from the users and their relations.
+        """
+        self.all().delete()
+
+        queryset = User.objects.order_by('id').values_list('id', flat=True)
+
+        last_id = 0
+        while True:
+            batch = list(queryset.filter(id__gt=last_id)[:batch_size])
+            if not batch:
+                break
+
+            self.rebuild_for(batch)
+            last_id = batch[-1]
+
+
+class UserVisibility(models.Model):
+    """
+    One row per user listed in the contacts of `viewer`, with the relation
+    that makes it visible.
+
+    Maintained from the signals that change groups, children, classes and
+    teaching assignments (see `core.signals`) so that the contact list is a
+    single indexed lookup. Admins list every user and have no rows.
+    """
+    TEACHER = 'teacher'
+    PARENT = 'parent'
+    STUDENT = 'student'
+
+    RELATION_CHOICES = (
+        (TEACHER, _('Teacher')),
+        (PARENT, _('Parent')),
+        (STUDENT, _('Student')),
+    )
+
+    # Covered by the unique index, which starts with it.
+    viewer = models.ForeignKey(User,
+                               related_name='visible_users',
+                               on_delete=models.CASCADE,
+                               db_index=False,
+                               )
+    visible_user = models.ForeignKey(User,
+                                     related_name='visible_to',
+                                     on_delete=models.CASCADE,
+                                     )
+    relation = models.CharField(max_length=10, choices=RELATION_CHOICES)
+
+    objects = UserVisibilityManager()
+
+    class Meta:
+        unique_together = ('viewer', 'relation', 'visible_user')
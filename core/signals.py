@@ -0,0 +1,294 @@
+from django.db.models.signals import (m2m_changed,
+                                      post_delete,
+                                      post_init,
+                                      post_save,
+                                      pre_delete,
+                                      )
+from django.contrib.auth.models import Group
+from django.dispatch import receiver
+
+from .models import (GROUP_TEACHER_ID,
+                     ArchivedNotification,
+                     Class,
+                     ClassTeacherSubject,
+                     Generation,
+                     Notification,
+                     NotificationInbox,
+                     Schedule,
+                     Subject,
+                     UnreadCounter,
+                     User,
+                     UserVisibility,
+                     )
+from .timetable import invalidate_assignments, invalidate_timetables
+
+
+def _parents_of(student_ids):
+    return User.parents.through.objects.filter(
+        from_user_id__in=student_ids,
+    ).values_list('to_user_id', flat=True)
+
+
+@receiver(post_save, sender=Notification)
+def notification_saved(sender, instance, created, raw=False, **kwargs):
+    if raw:
+        return
+
+    NotificationInbox.objects.fan_out([instance], created=created)
+
+
+@receiver(post_init, sender=User)
+def user_loaded(sender, instance, **kwargs):
+    # Remember the loaded class so a change can be detected on save.
+    instance._loaded_attends_id = instance.__dict__.get('attends_id', None)
+
+
+@receiver(post_save, sender=User)
+def user_saved(sender, instance, created, raw=False, **kwargs):
+    if created and not raw:
+        UnreadCounter.objects.create(user=instance)
+
+    if raw or created:
+        return
+
+    if instance.attends_id != instance._loaded_attends_id:
+        NotificationInbox.objects.rebuild_for(_parents_of([instance.id]))
+        UserVisibility.objects.rebuild_for(UserVisibility.objects.viewers_of(
+            [instance.id], [instance._loaded_attends_id]))
+        instance._loaded_attends_id = instance.attends_id
+
+
+@receiver(m2m_changed, sender=User.parents.through)
+def user_parents_changed(sender, instance, action, reverse, pk_set,
+                         **kwargs):
+    # Forward: `child.parents`, reverse: `parent.children`.
+    if action == 'pre_clear':
+        if reverse:
+            instance._cleared_parent_ids = [instance.id]
+
+        else:
+            instance._cleared_parent_ids = list(_parents_of([instance.id]))
+
+    elif action == 'post_clear':
+        NotificationInbox.objects.rebuild_for(
+            getattr(instance, '_cleared_parent_ids', []))
+
+    elif action in ('post_add', 'post_remove'):
+        NotificationInbox.objects.rebuild_for(
+            [instance.id] if reverse else pk_set)
+
+
+@receiver(pre_delete, sender=Notification)
+def notification_deleting(sender, instance, **kwargs):
+    # The inbox rows go away with the notification without any signal.
+    instance._unread_recipient_ids = list(
+        NotificationInbox.objects.filter(
+            notification=instance,
+            read_at__isnull=True,
+        ).values_list('recipient_id', flat=True))
+
+
+@receiver(post_delete, sender=Notification)
+def notification_deleted(sender, instance, **kwargs):
+    UnreadCounter.objects.add({
+        recipient_id: -1
+        for recipient_id in getattr(instance, '_unread_recipient_ids', [])
+    })
+
+
+@receiver(pre_delete, sender=User)
+@receiver(pre_delete, sender=Class)
+def target_deleting(sender, instance, **kwargs):
+    # Deleting a student or a class nulls the target of its notifications
+    # and drops the `parents` rows without sending any signal, so the
+    # affected inboxes are refreshed afterwards.
+    lookup = 'target_class' if sender is Class else 'target_student'
+    instance._targeted_notification_ids = list(
+        Notification.objects.filter(
+            **{lookup: instance}).values_list('id', flat=True))
+
+    if sender is User:
+        instance._deleted_parent_ids = list(_parents_of([instance.id]))
+        instance._visibility_viewer_ids = UserVisibility.objects.viewers_of(
+            user_ids=[instance.id])
+
+    else:
+        instance._visibility_viewer_ids = UserVisibility.objects.viewers_of(
+            class_ids=[instance.id])
+
+
+@receiver(post_delete, sender=User)
+@receiver(post_delete, sender=Class)
+def target_deleted(sender, instance, **kwargs):
+    ids = getattr(instance, '_targeted_notification_ids', [])
+    if ids:
+        NotificationInbox.objects.fan_out(
+            Notification.objects.filter(id__in=ids), created=False)
+
+    NotificationInbox.objects.rebuild_for(
+        getattr(instance, '_deleted_parent_ids', []))
+    UserVisibility.objects.rebuild_for(
+        getattr(instance, '_visibility_viewer_ids', []))
+
+
+@receiver(m2m_changed, sender=User.parents.through)
+def user_parents_visibility_changed(sender, instance, action, pk_set,
+                                    **kwargs):
+    # Viewers are collected before removals too, for the links they
+    # break. Clears only have the instance, which reaches both sides.
+    user_ids = [instance.id] + list(pk_set or [])
+
+    if action in ('pre_remove', 'pre_clear'):
+        instance._visibility_viewer_ids = UserVisibility.objects.viewers_of(
+            user_ids)
+
+    elif action.startswith('post_'):
+        UserVisibility.objects.rebuild_for(
+            UserVisibility.objects.viewers_of(user_ids) |
+            getattr(instance, '_visibility_viewer_ids', set()))
+
+
+def _group_viewer_ids(instance, reverse, pk_set):
+    # Forward: `user.groups`, reverse: `group.user_set`. Clears have no
+    # `pk_set` and use the rows about to be removed.
+    if reverse:
+        user_ids = pk_set
+        if user_ids is None:
+            user_ids = instance.user_set.values_list('id', flat=True)
+
+        teacher = instance.name == GROUP_TEACHER_ID
+
+    else:
+        user_ids = [instance.id]
+        groups = instance.groups.all()
+        if pk_set is not None:
+            groups = Group.objects.filter(id__in=pk_set)
+
+        teacher = groups.filter(name=GROUP_TEACHER_ID).exists()
+
+    viewer_ids = UserVisibility.objects.viewers_of(user_ids)
+
+    # Teachers list every other teacher.
+    if teacher:
+        viewer_ids.update(User.objects.filter(
+            groups__name=GROUP_TEACHER_ID).values_list('id', flat=True))
+
+    return viewer_ids
+
+
+@receiver(m2m_changed, sender=User.groups.through)
+def user_groups_changed(sender, instance, action, reverse, pk_set, **kwargs):
+    if action in ('pre_remove', 'pre_clear'):
+        instance._visibility_viewer_ids = _group_viewer_ids(instance,
+                                                            reverse,
+                                                            pk_set)
+
+    elif action.startswith('post_'):
+        UserVisibility.objects.rebuild_for(
+            _group_viewer_ids(instance, reverse, pk_set) |
+            getattr(instance, '_visibility_viewer_ids', set()))
+
+
+@receiver(m2m_changed, sender=User.groups.through)
+def user_role_changed(sender, instance, action, reverse, **kwargs):
+    # Drops the group names cached by `User.group_names`. Reverse changes
+    # do not have the user instances, which are reloaded every request.
+    if not reverse and action.startswith('post_'):
+        instance.__dict__.pop('group_names', None)
+
+
+@receiver(post_init, sender=ClassTeacherSubject)
+def assignment_loaded(sender, instance, **kwargs):
+    instance._loaded_assignment = (instance.__dict__.get('teacher_id', None),
+                                   instance.__dict__.get('teaches_in_id',
+                                                         None))
+
+
+@receiver(post_save, sender=ClassTeacherSubject)
+@receiver(post_delete, sender=ClassTeacherSubject)
+def assignment_changed(sender, instance, raw=False, **kwargs):
+    if raw:
+        return
+
+    teacher_ids = [instance.teacher_id, instance._loaded_assignment[0]]
+    class_ids = [instance.teaches_in_id, instance._loaded_assignment[1]]
+
+    UserVisibility.objects.rebuild_for(UserVisibility.objects.viewers_of(
+        teacher_ids, class_ids))
+    invalidate_timetables(teacher_ids, class_ids)
+    instance._loaded_assignment = (instance.teacher_id,
+                                   instance.teaches_in_id)
+
+
+@receiver(post_init, sender=Schedule)
+def schedule_loaded(sender, instance, **kwargs):
+    instance._loaded_assignment_id = instance.__dict__.get(
+        'class_teacher_subject_id', None)
+
+
+@receiver(post_save, sender=Schedule)
+@receiver(post_delete, sender=Schedule)
+def schedule_changed(sender, instance, raw=False, **kwargs):
+    if raw:
+        return
+
+    invalidate_assignments(id__in=[instance.class_teacher_subject_id,
+                                   instance._loaded_assignment_id])
+    instance._loaded_assignment_id = instance.class_teacher_subject_id
+
+
+@receiver(post_save, sender=User)
+@receiver(post_save, sender=Class)
+@receiver(post_save, sender=Subject)
+def timetable_name_changed(sender, instance, created, raw=False,
+                           update_fields=None, **kwargs):
+    # Timetables render the names of teachers, classes and subjects.
+    if raw or created:
+        return
+
+    if update_fields is not None and set(update_fields) <= {'last_login'}:
+        return
+
+    if sender is User:
+        invalidate_assignments(teacher=instance)
+
+    elif sender is Class:
+        invalidate_assignments(teaches_in=instance)
+
+    else:
+        invalidate_assignments(subject=instance)
+
+
+GENERATION_KEYS = {
+    Notification: Generation.NOTIFICATION,
+    ArchivedNotification: Generation.NOTIFICATION,
+    Class: Generation.CLASS,
+    User: Generation.USER,
+    Subject: Generation.SUBJECT,
+    ClassTeacherSubject: Generation.CLASS_TEACHER_SUBJECT,
+    Schedule: Generation.SCHEDULE,
+}
+
+
+def model_changed(sender, raw=False, update_fields=None, **kwargs):
+    if raw:
+        return
+
+    # Logins only write `last_login`, which no endpoint renders.
+    if update_fields is not None and set(update_fields) <= {'last_login'}:
+        return
+
+    Generation.objects.bump(GENERATION_KEYS[sender])
+
+
+for model in GENERATION_KEYS:
+    post_save.connect(model_changed, sender=model)
+    post_delete.connect(model_changed, sender=model)
+
+
+@receiver(m2m_changed, sender=User.parents.through)
+@receiver(m2m_changed, sender=User.subjects.through)
+@receiver(m2m_changed, sender=User.groups.through)
+def user_relations_changed(sender, action, **kwargs):
+    if action in ('post_add', 'post_remove', 'post_clear'):
+        Generation.objects.bump(Generation.USER)
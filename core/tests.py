@@ -1,8 +1,31 @@
+import csv
+import datetime
+import json
+import tempfile
+from io import StringIO
+
+import pytz
+
 from django.test import TestCase
+from django.core.management import call_command
+from django.core.management.base import CommandError
 from django.db.utils import IntegrityError
 from django.contrib.auth.models import Group
 
-from .models import User, GROUP_PARENT_ID, create_default_groups
+from .models import (User,
+                     ArchivedNotification,
+                     Class,
+                     ClassTeacherSubject,
+                     Notification,
+                     NotificationInbox,
+                     Schedule,
+                     Subject,
+                     UnreadCounter,
+                     UserVisibility,
+                     GROUP_PARENT_ID,
+                     GROUP_TEACHER_ID,
+                     create_default_groups,
+                     )
 
 
 class UserTest(TestCase):
@@ -23,6 +46,22 @@ class UserTest(TestCase):
         # self.assertIsNotNone(user.profile)
         self.assertTrue(user.groups.filter(name=GROUP_PARENT_ID).exists())
 
+    def test_user_role(self):
+        user = User.objects.create_user(
+            email='juan@mail.com',
+            password='password123',
+        )
+        self.assertIsNone(user.role)
+
+        user.groups.add(Group.objects.get(name=GROUP_PARENT_ID))
+        self.assertEqual(user.role, GROUP_PARENT_ID)
+
+        user.groups.add(Group.objects.get(name=GROUP_TEACHER_ID))
+        self.assertEqual(user.role, GROUP_TEACHER_ID)
+
+        with self.assertNumQueries(0):
+            self.assertEqual(user.role, GROUP_TEACHER_ID)
+
     def test_user_unique_email(self):
         User.objects.create_user(
             email='juan@mail.com',
@@ -34,3 +73,366 @@ class UserTest(TestCase):
                 email='juan@mail.com',
                 password='password123',
             )
+
+
+class NotificationInboxTest(TestCase):
+    """ Test module for the notification inbox fan-out """
+
+    def setUp(self):
+        from core.management.commands.initadmin import (insert_data_for_tests,
+                                                        init_database)
+        init_database()
+        insert_data_for_tests()
+
+        self.teacher = User.objects.get(email='mates@school.com')
+        self.student = User.objects.get(email='cristobal@school.com')
+        self.parent = User.objects.get(email='cristobal.padre@school.com')
+        self.other_parent = User.objects.get(email='belen.madre@school.com')
+        self.new_parent = User.objects.get(email='javier.padre@school.com')
+        self.class_1a = Class.objects.get(name='1A')
+        self.class_1b = Class.objects.get(name='1B')
+
+        self.to_student = Notification.objects.create(
+            title='To student',
+            owner=self.teacher,
+            description='Description',
+            date=datetime.datetime(2017, 8, 1, 0, 0, 0, 0, pytz.UTC),
+            target_student=self.student,
+        )
+        self.to_class = Notification.objects.create(
+            title='To class',
+            owner=self.teacher,
+            description='Description',
+            date=datetime.datetime(2017, 8, 2, 0, 0, 0, 0, pytz.UTC),
+            target_class=self.class_1b,
+        )
+
+    def _inbox(self, user):
+        return set(NotificationInbox.objects.filter(
+            recipient=user).values_list('notification_id', flat=True))
+
+    def test_inbox_fan_out(self):
+        self.assertEqual(self._inbox(self.parent),
+                         {self.to_student.id, self.to_class.id})
+        self.assertEqual(self._inbox(self.other_parent), {self.to_class.id})
+        self.assertEqual(self._inbox(self.new_parent), set())
+
+        entry = NotificationInbox.objects.get(recipient=self.parent,
+                                              notification=self.to_class)
+        self.assertEqual(entry.date, self.to_class.date)
+
+    def test_inbox_notification_update(self):
+        self.to_class.target_class = self.class_1a
+        self.to_class.date = datetime.datetime(2017, 9, 1, 0, 0, 0, 0,
+                                               pytz.UTC)
+        self.to_class.save()
+
+        self.assertEqual(self._inbox(self.parent), {self.to_student.id})
+        self.assertEqual(self._inbox(self.new_parent), {self.to_class.id})
+        self.assertEqual(
+            NotificationInbox.objects.get(recipient=self.new_parent).date,
+            self.to_class.date)
+
+    def test_inbox_parents_change(self):
+        self.student.parents.add(self.new_parent)
+
+        self.assertEqual(self._inbox(self.new_parent),
+                         {self.to_student.id, self.to_class.id})
+
+        self.new_parent.children.remove(self.student)
+
+        self.assertEqual(self._inbox(self.new_parent), set())
+
+        self.student.parents.clear()
+
+        self.assertEqual(self._inbox(self.parent), set())
+
+    def test_inbox_attends_change(self):
+        student = User.objects.get(email='cristobal@school.com')
+        student.attends = self.class_1a
+        student.save()
+
+        self.assertEqual(self._inbox(self.parent), {self.to_student.id})
+
+    def test_inbox_class_deleted(self):
+        self.class_1b.delete()
+
+        self.assertEqual(self._inbox(self.parent), {self.to_student.id})
+        self.assertEqual(self._inbox(self.other_parent), set())
+
+    def test_archivenotifications_command(self):
+        recent = Notification.objects.create(
+            title='Recent',
+            owner=self.teacher,
+            description='Description',
+            date=datetime.datetime.now(pytz.UTC),
+            target_class=self.class_1b,
+        )
+        search_vector = Notification.objects.filter(
+            id=self.to_class.id).values_list('search_vector', flat=True)[0]
+
+        out = StringIO()
+        call_command('archivenotifications', batch_size=1, stdout=out)
+
+        self.assertEqual(out.getvalue().strip(), 'Archived notifications: 2')
+        self.assertEqual(set(Notification.objects.values_list('id', flat=True)),
+                         {recent.id})
+        self.assertEqual(self._inbox(self.parent), {recent.id})
+
+        archived = ArchivedNotification.objects.get(id=self.to_class.id)
+        self.assertEqual(archived.title, 'To class')
+        self.assertEqual(archived.target_class, self.class_1b)
+        self.assertEqual(archived.search_vector, search_vector)
+
+        self.assertEqual(UnreadCounter.objects.get(user=self.parent).unread, 1)
+
+    def test_exportnotifications_command(self):
+        ArchivedNotification.objects.archive(
+            datetime.datetime(2017, 8, 2, 0, 0, 0, 0, pytz.UTC))
+
+        out = StringIO()
+        call_command('exportnotifications', stdout=out)
+
+        self.assertEqual([json.loads(line)['id']
+                          for line in out.getvalue().splitlines()],
+                         [self.to_class.id])
+
+        out = StringIO()
+        call_command('exportnotifications', output='csv', archive=True,
+                     stdout=out)
+
+        rows = list(csv.DictReader(StringIO(out.getvalue())))
+        self.assertEqual([(int(row['id']), row['title']) for row in rows],
+                         [(self.to_student.id, 'To student'),
+                          (self.to_class.id, 'To class')])
+
+    def test_rebuildinbox_command(self):
+        read_at = datetime.datetime(2017, 8, 2, 0, 0, 0, 0, pytz.UTC)
+        NotificationInbox.objects.filter(
+            recipient=self.parent, notification=self.to_student,
+        ).update(read_at=read_at)
+
+        expected = set(NotificationInbox.objects.values_list(
+            'recipient_id', 'notification_id', 'date', 'read_at'))
+        NotificationInbox.objects.filter(
+            notification=self.to_class).delete()
+
+        call_command('rebuildinbox', batch_size=1, stdout=StringIO())
+
+        self.assertEqual(set(NotificationInbox.objects.values_list(
+            'recipient_id', 'notification_id', 'date', 'read_at')), expected)
+        self.assertEqual(UnreadCounter.objects.get(user=self.parent).unread,
+                         1)
+
+
+class UnreadCounterTest(NotificationInboxTest):
+    """ Test module for the unread counters kept along the inbox """
+
+    def _unread(self, user):
+        return UnreadCounter.objects.get(user=user).unread
+
+    def _assert_counts(self):
+        for user in User.objects.all():
+            self.assertEqual(
+                self._unread(user),
+                NotificationInbox.objects.filter(recipient=user,
+                                                 read_at__isnull=True).count(),
+                msg=user.email)
+
+    def test_unread_fan_out(self):
+        self.assertEqual(self._unread(self.parent), 2)
+        self.assertEqual(self._unread(self.other_parent), 1)
+        self.assertEqual(self._unread(self.new_parent), 0)
+        self.assertEqual(self._unread(self.teacher), 0)
+
+    def test_unread_maintained(self):
+        NotificationInbox.objects.filter(
+            recipient=self.parent,
+            notification=self.to_class,
+        ).update(read_at=datetime.datetime(2017, 8, 3, 0, 0, 0, 0, pytz.UTC))
+        UnreadCounter.objects.add({self.parent.id: -1})
+
+        self.to_class.target_class = self.class_1a
+        self.to_class.save()
+        self._assert_counts()
+
+        self.student.parents.add(self.new_parent)
+        self._assert_counts()
+
+        self.to_student.delete()
+        self._assert_counts()
+
+        self.class_1a.delete()
+        self._assert_counts()
+
+    def test_unread_recount(self):
+        UnreadCounter.objects.filter(user=self.parent).delete()
+
+        self.assertEqual(UnreadCounter.objects.unread_for(self.parent), 2)
+
+
+class UserVisibilityTest(TestCase):
+    """ Test module for the contact lists kept in the visibility table """
+
+    def setUp(self):
+        from core.management.commands.initadmin import (insert_data_for_tests,
+                                                        init_database)
+        init_database()
+        insert_data_for_tests()
+
+        self.teacher = User.objects.get(email='mates@school.com')
+        self.student = User.objects.get(email='cristobal@school.com')
+        self.parent = User.objects.get(email='cristobal.padre@school.com')
+        self.new_parent = User.objects.get(email='javier.padre@school.com')
+        self.class_1a = Class.objects.get(name='1A')
+        self.class_1b = Class.objects.get(name='1B')
+
+    def _visible(self, user):
+        return set(UserVisibility.objects.filter(
+            viewer=user).values_list('visible_user_id', 'relation'))
+
+    def _assert_visibility(self):
+        for user in User.objects.all():
+            self.assertEqual(
+                set((user.id, id, relation)
+                    for id, relation in self._visible(user)),
+                UserVisibility.objects._visible([user.id]),
+                msg=user.email)
+
+    def test_visibility_fan_out(self):
+        self.assertIn((self.student.id, UserVisibility.STUDENT),
+                      self._visible(self.parent))
+        self.assertIn((self.parent.id, UserVisibility.PARENT),
+                      self._visible(self.teacher))
+        self.assertEqual(self._visible(self.student), set())
+        self._assert_visibility()
+
+    def test_visibility_maintained(self):
+        self.student.parents.add(self.new_parent)
+        self._assert_visibility()
+
+        self.new_parent.children.remove(self.student)
+        self._assert_visibility()
+
+        self.student.parents.clear()
+        self._assert_visibility()
+
+        student = User.objects.get(id=self.student.id)
+        student.attends = self.class_1a
+        student.save()
+        self._assert_visibility()
+
+        teachers = Group.objects.get(name=GROUP_TEACHER_ID)
+        teacher = User.objects.create_user(email='new.teacher@school.com')
+        teacher.groups.add(teachers)
+        self._assert_visibility()
+
+        assignment = ClassTeacherSubject.objects.create(
+            teacher=teacher,
+            subject=Subject.objects.get(name='Lengua'),
+            teaches_in=self.class_1b,
+        )
+        self._assert_visibility()
+
+        assignment.teaches_in = self.class_1a
+        assignment.save()
+        self._assert_visibility()
+
+        assignment.delete()
+        self._assert_visibility()
+
+        self.parent.groups.add(teachers)
+        self._assert_visibility()
+
+        teachers.user_set.remove(self.teacher)
+        self._assert_visibility()
+
+        self.new_parent.groups.clear()
+        self._assert_visibility()
+
+        User.objects.get(email='belen@school.com').delete()
+        self._assert_visibility()
+
+        self.class_1b.delete()
+        self._assert_visibility()
+
+    def test_rebuildvisibility_command(self):
+        expected = set(UserVisibility.objects.values_list(
+            'viewer_id', 'visible_user_id', 'relation'))
+        UserVisibility.objects.all().delete()
+
+        call_command('rebuildvisibility', batch_size=1, stdout=StringIO())
+
+        self.assertEqual(set(UserVisibility.objects.values_list(
+            'viewer_id', 'visible_user_id', 'relation')), expected)
+
+
+class ImportTimetableTest(TestCase):
+    """ Test module for the timetable import """
+
+    def setUp(self):
+        from core.management.commands.initadmin import (insert_data_for_tests,
+                                                        init_database)
+        init_database()
+        insert_data_for_tests()
+
+    def _import(self, rows, **options):
+        with tempfile.NamedTemporaryFile('w', suffix='.csv') as file:
+            writer = csv.writer(file)
+            writer.writerow(['day', 'order', 'time', 'teacher', 'class',
+                             'subject'])
+            writer.writerows(rows)
+            file.flush()
+
+            out, err = StringIO(), StringIO()
+            try:
+                call_command('importtimetable', file.name,
+                             stdout=out, stderr=err, **options)
+
+            finally:
+                self.errors = err.getvalue().splitlines()
+
+        return out.getvalue()
+
+    def test_import_timetable(self):
+        out = self._import([
+            ['tuesday', '1', '9:00', 'mates@school.com', '1A', 'Mates'],
+            ['TUESDAY', '2', '10:00', 'mates@school.com', '1B', 'Mates'],
+            ['TUESDAY', '2', '10:00', 'lengua@school.com', '1A', 'Lengua'],
+        ])
+
+        self.assertEqual(out, 'Schedule rows: 3\n')
+        self.assertEqual(Schedule.objects.filter(
+            day=Schedule.TUESDAY).count(), 3)
+        self.assertEqual(Schedule.objects.count(), 6)
+
+        out = self._import([
+            ['MONDAY', '1', '9:00', 'lengua@school.com', '2A', 'Lengua'],
+        ], replace=True)
+
+        self.assertEqual(out, 'Schedule rows: 1\n')
+        self.assertEqual(Schedule.objects.count(), 1)
+
+    def test_import_timetable_conflicts(self):
+        with self.assertRaises(CommandError):
+            self._import([
+                # Overlaps the 10:00 and 11:00 lessons of the teacher.
+                ['MONDAY', '4', '10:30', 'mates@school.com', '1A', 'Mates'],
+                ['SUNDAY', '1', '9:00', 'mates@school.com', '1A', 'Mates'],
+                ['MONDAY', '5', '13:00', 'mates@school.com', '1A', 'Latin'],
+                ['MONDAY', '5', '13:00', 'mates@school.com', '1A', 'Lengua'],
+                # Same slot as the 9:00 lesson of the class.
+                ['MONDAY', '1', '12:00', 'lengua@school.com', '1A', 'Lengua'],
+            ])
+
+        self.assertEqual(Schedule.objects.count(), 3)
+        self.assertEqual(len(self.errors), 6)
+        self.assertIn('Row 2: bad day SUNDAY.', self.errors)
+        self.assertIn('Row 3: unknown subject Latin.', self.errors)
+        self.assertIn('Row 4: mates@school.com does not teach Lengua in '
+                      '1A.', self.errors)
+
+        conflicts = [error for error in self.errors if 'booked' in error]
+        self.assertEqual(len(conflicts), 3)
+        self.assertTrue(all('row 1' in error or 'row 5' in error
+                            for error in conflicts))
@@ -0,0 +1,334 @@
+import csv
+import datetime
+import json
+from collections import OrderedDict
+
+from django.conf import settings
+from django.core.cache import cache
+from django.core.exceptions import ValidationError
+from django.db import transaction
+from django.db.models import Q
+from django.utils.dateparse import parse_time
+from django.utils.translation import ugettext as _
+
+from .models import (Class,
+                     ClassTeacherSubject,
+                     Generation,
+                     Schedule,
+                     Subject,
+                     User,
+                     )
+
+
+TEACHER = 'teacher'
+CLASS = 'class'
+
+# Flat columns of a timetable entry: `(name, lookup)`, all read by the same
+# joined query.
+TIMETABLE_COLUMNS = (
+    ('time', 'time'),
+    ('subject_id', 'class_teacher_subject__subject_id'),
+    ('subject_name', 'class_teacher_subject__subject__name'),
+    ('teacher_id', 'class_teacher_subject__teacher_id'),
+    ('teacher_first_name', 'class_teacher_subject__teacher__first_name'),
+    ('teacher_last_name', 'class_teacher_subject__teacher__last_name'),
+    ('class_id', 'class_teacher_subject__teaches_in_id'),
+    ('class_name', 'class_teacher_subject__teaches_in__name'),
+)
+
+LOOKUPS = {
+    TEACHER: 'class_teacher_subject__teacher_id',
+    CLASS: 'class_teacher_subject__teaches_in_id',
+}
+
+
+def _key(kind, id):
+    return 'timetable:{}:{}'.format(kind, id)
+
+
+def build_timetable(kind, id):
+    """
+    Returns the week of the teacher or class `id`: for every day, in
+    `Schedule.DAY_CHOICES` order, one list of entries per `Schedule.ORDER`
+    slot.
+    """
+    orders = [order for order, label in Schedule.ORDER]
+    grid = OrderedDict((day, [[] for order in orders])
+                       for day, label in Schedule.DAY_CHOICES)
+
+    names = [name for name, lookup in TIMETABLE_COLUMNS]
+    lookups = [lookup for name, lookup in TIMETABLE_COLUMNS]
+
+    for row in Schedule.objects.filter(**{LOOKUPS[kind]: id}).order_by(
+            'order', 'time', 'id').values_list('day', 'order', *lookups):
+        day, order = row[:2]
+        if day in grid and order in orders:
+            grid[day][orders.index(order)].append(
+                OrderedDict(zip(names, row[2:])))
+
+    return grid
+
+
+def get_timetable(kind, id):
+    """
+    Returns the timetable of `build_timetable`, cached until a row it is
+    built from changes (see `invalidate_timetables`).
+    """
+    key = _key(kind, id)
+
+    grid = cache.get(key)
+    if grid is None:
+        grid = build_timetable(kind, id)
+        cache.set(key, grid, settings.SCHOOL_TIMETABLE_CACHE_TIMEOUT)
+
+    return grid
+
+
+def _invalidate(keys):
+    cache.delete_many(keys)
+
+
+def invalidate_timetables(teacher_ids=(), class_ids=()):
+    """
+    Discards the cached timetables of `teacher_ids` and `class_ids`, right
+    away and again after the commit.
+    """
+    keys = [_key(TEACHER, id) for id in set(teacher_ids) - {None}] + \
+        [_key(CLASS, id) for id in set(class_ids) - {None}]
+    if not keys:
+        return
+
+    _invalidate(keys)
+    transaction.on_commit(lambda: _invalidate(keys))
+
+
+def invalidate_assignments(**filters):
+    """
+    Discards the cached timetables of the teachers and classes of the
+    `ClassTeacherSubject` rows matching `filters`.
+    """
+    assignments = list(ClassTeacherSubject.objects.filter(
+        **filters).values_list('teacher_id', 'teaches_in_id'))
+
+    invalidate_timetables([teacher_id for teacher_id, class_id
+                           in assignments],
+                          [class_id for teacher_id, class_id in assignments])
+
+
+# Fields of an imported schedule row. Teachers are given by email, classes
+# and subjects by name.
+IMPORT_COLUMNS = ('day', 'order', 'time', 'teacher', 'class', 'subject')
+
+IMPORT_FORMATS = ('csv', 'json')
+
+
+def read_rows(file, input_format):
+    """
+    Returns the rows of a timetable `file`, a CSV with a header of
+    `IMPORT_COLUMNS` or a JSON list of objects with those keys.
+    """
+    if input_format == 'json':
+        rows = json.load(file)
+        if not isinstance(rows, list):
+            raise ValidationError(_('Expected a list of schedule rows.'))
+
+        return rows
+
+    return list(csv.DictReader(file))
+
+
+def _parse_row(row):
+    """ Returns the typed values of `row`, in `IMPORT_COLUMNS` order. """
+    if not isinstance(row, dict):
+        raise ValueError(_('expected an object'))
+
+    missing = [name for name in IMPORT_COLUMNS
+               if row.get(name, None) in (None, '')]
+    if missing:
+        raise ValueError(_('missing {}').format(', '.join(missing)))
+
+    day = str(row['day']).strip().upper()
+    if day not in dict(Schedule.DAY_CHOICES):
+        raise ValueError(_('bad day {}').format(row['day']))
+
+    try:
+        order = int(row['order'])
+
+    except (TypeError, ValueError):
+        order = None
+
+    if order not in dict(Schedule.ORDER):
+        raise ValueError(_('bad order {}').format(row['order']))
+
+    try:
+        time = parse_time(str(row['time']).strip())
+
+    except ValueError:
+        time = None
+
+    if time is None:
+        raise ValueError(_('bad time {}').format(row['time']))
+
+    return (day, order, time) + tuple(str(row[name]).strip()
+                                      for name in IMPORT_COLUMNS[3:])
+
+
+def _minutes(time):
+    return time.hour * 60 + time.minute
+
+
+def find_conflicts(lessons):
+    """
+    Returns the pairs of conflicting `lessons`, `(start, end, order, label)`
+    tuples of one teacher or one class on one day.
+
+    A sweep over the lessons sorted by start compares each one with the
+    lesson ending last so far, which it overlaps if it starts before that
+    end. Lessons sharing an `order` slot conflict too.
+    """
+    conflicts = []
+
+    latest = None
+    for lesson in sorted(lessons):
+        if latest is not None and lesson[0] < latest[1]:
+            conflicts.append((latest, lesson))
+
+        if latest is None or lesson[1] > latest[1]:
+            latest = lesson
+
+    reported = set((a[3], b[3]) for a, b in conflicts)
+    by_order = {}
+    for lesson in sorted(lessons, key=lambda lesson: (lesson[2], lesson)):
+        first = by_order.setdefault(lesson[2], lesson)
+        if first is not lesson and (first[3], lesson[3]) not in reported:
+            conflicts.append((first, lesson))
+
+    return conflicts
+
+
+def import_timetable(rows, replace=False):
+    """
+    Validates the schedule `rows` as a whole and inserts them in a single
+    transaction, or raises a `ValidationError` listing every bad row and
+    every teacher or class booked twice at the same time.
+
+    Lessons last `SCHOOL_LESSON_MINUTES` and are checked against each
+    other and against the existing schedule, which `replace` deletes
+    instead.
+    """
+    errors = []
+
+    parsed = []
+    for number, row in enumerate(rows, 1):
+        try:
+            parsed.append((number, _parse_row(row)))
+
+        except ValueError as e:
+            errors.append(_('Row {}: {}.').format(number, e))
+
+    values = list(zip(*[row for number, row in parsed])) or [()] * 6
+    teachers = dict(User.objects.filter(
+        email__in=set(values[3])).values_list('email', 'id'))
+    classes = dict(Class.objects.filter(
+        name__in=set(values[4])).values_list('name', 'id'))
+    subjects = dict(Subject.objects.filter(
+        name__in=set(values[5])).values_list('name', 'id'))
+
+    assignments = {
+        (teacher_id, class_id, subject_id): id
+        for id, teacher_id, class_id, subject_id
+        in ClassTeacherSubject.objects.filter(
+            teacher_id__in=teachers.values(),
+            teaches_in_id__in=classes.values(),
+        ).values_list('id', 'teacher_id', 'teaches_in_id', 'subject_id')
+    }
+
+    # `(assignment id, teacher id, class id, day, order, time, label)`
+    lessons = []
+    for number, (day, order, time, teacher, name, subject) in parsed:
+        key = (teachers.get(teacher, None),
+               classes.get(name, None),
+               subjects.get(subject, None))
+
+        if key in assignments:
+            lessons.append((assignments[key],) + key[:2] +
+                           (day, order, time, _('row {}').format(number)))
+            continue
+
+        if key[0] is None:
+            message = _('unknown teacher {}').format(teacher)
+        elif key[1] is None:
+            message = _('unknown class {}').format(name)
+        elif key[2] is None:
+            message = _('unknown subject {}').format(subject)
+        else:
+            message = _('{} does not teach {} in {}').format(
+                teacher, subject, name)
+
+        errors.append(_('Row {}: {}.').format(number, message))
+
+    teacher_ids = set(lesson[1] for lesson in lessons)
+    class_ids = set(lesson[2] for lesson in lessons)
+
+    existing = []
+    if not replace:
+        existing = [
+            (assignment_id, teacher_id, class_id, day, order, time,
+             _('existing schedule {}').format(id))
+            for id, assignment_id, teacher_id, class_id, day, order, time
+            in Schedule.objects.filter(
+                Q(class_teacher_subject__teacher_id__in=teacher_ids) |
+                Q(class_teacher_subject__teaches_in_id__in=class_ids),
+            ).values_list('id',
+                          'class_teacher_subject_id',
+                          'class_teacher_subject__teacher_id',
+                          'class_teacher_subject__teaches_in_id',
+                          'day', 'order', 'time')
+        ]
+
+    duration = settings.SCHOOL_LESSON_MINUTES
+
+    days = {}
+    for lesson in lessons + existing:
+        assignment_id, teacher_id, class_id, day, order, time, label = lesson
+        start = _minutes(time)
+
+        for owner in ((_('Teacher'), teacher_id), (_('Class'), class_id)):
+            days.setdefault(owner + (day,), []).append(
+                (start, start + duration, order, label))
+
+    for (kind, id, day), day_lessons in sorted(days.items()):
+        for a, b in find_conflicts(day_lessons):
+            errors.append(
+                _('{} {} is booked twice on {}: {} at {} (order {}) and '
+                  '{} at {} (order {}).').format(
+                      kind, id, day.capitalize(),
+                      a[3], _format_minutes(a[0]), a[2],
+                      b[3], _format_minutes(b[0]), b[2]))
+
+    if errors:
+        raise ValidationError(errors)
+
+    # `bulk_create` sends no `post_save`, so the counters and the cached
+    # timetables are handled here.
+    with transaction.atomic():
+        if replace:
+            Schedule.objects.all().delete()
+
+        created = Schedule.objects.bulk_create([
+            Schedule(class_teacher_subject_id=assignment_id,
+                     day=day,
+                     order=order,
+                     time=time)
+            for assignment_id, teacher_id, class_id, day, order, time, label
+            in lessons
+        ])
+
+        Generation.objects.bump(Generation.SCHEDULE)
+        invalidate_timetables(teacher_ids, class_ids)
+
+    return created
+
+
+def _format_minutes(minutes):
+    return datetime.time(minutes // 60, minutes % 60).strftime('%H:%M')
@@ -127,7 +127,7 @@ REST_FRAMEWORK = {
         'rest_framework.permissions.IsAuthenticated',
     ),
     'DEFAULT_AUTHENTICATION_CLASSES': (
-        'rest_framework_jwt.authentication.JSONWebTokenAuthentication',
+        'api.authentication.ClaimsJSONWebTokenAuthentication',
         'rest_framework.authentication.SessionAuthentication',
         'rest_framework.authentication.BasicAuthentication',
     ),
@@ -139,6 +139,7 @@ JWT_AUTH = {
     # 'JWT_EXPIRATION_DELTA': datetime.timedelta(hours=1),
     'JWT_EXPIRATION_DELTA': datetime.timedelta(days=365),
     'JWT_ALLOW_REFRESH': True,
+    'JWT_PAYLOAD_HANDLER': 'api.authentication.jwt_payload_handler',
 }
 
 
@@ -149,3 +150,62 @@ CORS_ORIGIN_ALLOW_ALL = True # XXX
 #     'localhost:4200',
 #     '127.0.0.1:4200'
 # )
+
+
+# Cache
+# The local memory cache is per process: deployments running several
+# processes need a shared backend for the invalidations to reach them all.
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    },
+}
+
+
+# Celery beat
+CELERY_BEAT_SCHEDULE = {
+    'archive-notifications': {
+        'task': 'worker.tasks.archive_notifications',
+        'schedule': datetime.timedelta(days=1),
+    },
+    'deliver-notifications': {
+        'task': 'worker.tasks.deliver_notifications',
+        'schedule': datetime.timedelta(minutes=1),
+    },
+}
+
+
+# Notifications dated further back than this are moved to the archive table
+# by `manage.py archivenotifications` and the `archive_notifications` task.
+SCHOOL_NOTIFICATION_ARCHIVE_DAYS = 365
+
+# Seconds to wait for the websocket backend on each push.
+SCHOOL_PUSH_TIMEOUT = 10
+
+# Scheduled pushes that fail are retried this many seconds later, and given
+# up after this many attempts.
+SCHOOL_DELIVERY_RETRY_SECONDS = 300
+SCHOOL_DELIVERY_MAX_ATTEMPTS = 5
+
+# Seconds a notification list stays cached. Lists are invalidated as their
+# rows change; this only bounds the changes made without signals, such as
+# archiving.
+SCHOOL_NOTIFICATION_CACHE_TIMEOUT = 300
+
+# Seconds the version of the claims of a user stays cached. Revoking the
+# claims drops the version from the cache of the process doing it, so this
+# bounds how long other processes still accept the revoked tokens, and the
+# tokens of deactivated users.
+SCHOOL_TOKEN_VERSION_CACHE_TIMEOUT = 30
+
+# Seconds a timetable stays cached. Timetables are invalidated as their
+# schedule rows, assignments and names change.
+SCHOOL_TIMETABLE_CACHE_TIMEOUT = 3600
+
+# Length of a lesson in minutes, used to detect overlapping lessons when
+# importing a timetable.
+SCHOOL_LESSON_MINUTES = 60
+
+# Seconds a calendar feed stays cached. Feeds are regenerated as the
+# timetables, the notifications or the claims of their user change.
+SCHOOL_CALENDAR_CACHE_TIMEOUT = 3600
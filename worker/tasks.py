@@ -1,62 +1,178 @@
 from __future__ import absolute_import, unicode_literals
+import datetime
 import requests
+from collections import defaultdict
 
 from django.conf import settings
+from django.db import transaction
+from django.db.models import F, Q
+from django.utils import timezone
 
 from celery import shared_task
+from celery.utils.log import get_task_logger
 
-from core.models import Notification, User, GROUP_PARENT_ID
+from core.models import (ArchivedNotification,
+                         Notification,
+                         User,
+                         GROUP_PARENT_ID,
+                         )
+
+
+logger = get_task_logger(__name__)
+
+
+def _recipients(notifications):
+    """
+    Maps the id of each of `notifications` to the sorted ids of the parents
+    it is pushed to, with one query per kind of target.
+
+    Notifications to a student go to that student's parents and
+    notifications to a class go to the parents of its students.
+    """
+    student_ids = set(n.target_student_id for n in notifications
+                      if n.target_student_id is not None)
+    class_ids = set(n.target_class_id for n in notifications
+                    if n.target_student_id is None and
+                    n.target_class_id is not None)
+
+    student_parents = defaultdict(set)
+    if student_ids:
+        for student_id, parent_id in User.parents.through.objects.filter(
+                from_user_id__in=student_ids,
+        ).values_list('from_user_id', 'to_user_id'):
+            student_parents[student_id].add(parent_id)
+
+    class_parents = defaultdict(set)
+    if class_ids:
+        for class_id, parent_id in User.objects.filter(
+                groups__name=GROUP_PARENT_ID,
+                children__attends__in=class_ids,
+        ).values_list('children__attends', 'id'):
+            class_parents[class_id].add(parent_id)
+
+    # Sorted for testing purposes
+    return {
+        n.id: sorted(student_parents[n.target_student_id]
+                     if n.target_student_id is not None
+                     else class_parents[n.target_class_id])
+        for n in notifications
+    }
+
+
+def _push(notification, parent_ids):
+    requests.get(
+        settings.SCHOOL_WEBSOCKET_BACKEND_URL + 'notification',
+        params={
+            'id': notification.id,
+            'user': ','.join(str(parent_id) for parent_id in parent_ids),
+            'owner': notification.owner_id,
+            'title': notification.title,
+            'description': notification.description,
+            'timestamp': notification.timestamp.strftime(
+                '%Y-%m-%d %H:%M:%S'),
+            'date': notification.date.strftime('%Y-%m-%d %H:%M:%S') \
+                if notification.date is not None else None,
+            'target_class': notification.target_class_id,
+            # Not needed:
+            'target_student': str(notification.target_student_id) \
+                if notification.target_student_id is not None else None,
+        },
+        timeout=settings.SCHOOL_PUSH_TIMEOUT)
 
 
 @shared_task
 def push_notification(notification_id):
     notification = Notification.objects.get(id=notification_id)
 
-    if notification.target_student:
-        # Sorted for testing purposes
-        ids = sorted([str(parent.id)
-                      for parent in notification.target_student.parents.all()])
-
-        requests.get(
-            settings.SCHOOL_WEBSOCKET_BACKEND_URL + 'notification',
-            params={
-                'id': notification.id,
-                'user': ','.join(ids),
-                'owner': notification.owner.id,
-                'title': notification.title,
-                'description': notification.description,
-                'timestamp': notification.timestamp.strftime(
-                    '%Y-%m-%d %H:%M:%S'),
-                'date': notification.date.strftime('%Y-%m-%d %H:%M:%S'),
-                'target_class': notification.target_class.id \
-                    if notification.target_class else None,
-                # Not needed:
-                'target_student': str(notification.target_student.id),
-            })
-
-    elif notification.target_class:
-        # Sorted for testing purposes
-        ids = [str(parent.id)
-               for parent in User.objects.filter(
-                   groups__name=GROUP_PARENT_ID,
-                   children__attends=notification.target_class,
-               ).order_by('id')]
-
-        requests.get(
-            settings.SCHOOL_WEBSOCKET_BACKEND_URL + 'notification',
-            params={
-                'id': notification.id,
-                'user': ','.join(ids),
-                'owner': notification.owner.id,
-                'title': notification.title,
-                'description': notification.description,
-                'timestamp': notification.timestamp.strftime(
-                    '%Y-%m-%d %H:%M:%S'),
-                'date': notification.date.strftime('%Y-%m-%d %H:%M:%S'),
-                'target_class': notification.target_class.id,
-                'target_student': None,
-
-            })
-
-    else:
+    if notification.target_student_id is None and \
+            notification.target_class_id is None:
         raise Exception('notification without target student or target class')
+
+    _push(notification, _recipients([notification])[notification.id])
+
+
+@shared_task
+def push_notifications(notification_ids):
+    """
+    Pushes a batch of notifications, resolving the parents of all of them
+    at once.
+    """
+    notifications = list(Notification.objects.filter(
+        Q(target_student__isnull=False) | Q(target_class__isnull=False),
+        id__in=notification_ids,
+    ).order_by('id'))
+
+    recipients = _recipients(notifications)
+
+    for notification in notifications:
+        _push(notification, recipients[notification.id])
+
+
+@shared_task
+def archive_notifications(days=None):
+    """
+    Moves the notifications older than `days`, by default
+    `SCHOOL_NOTIFICATION_ARCHIVE_DAYS`, to the archive. Scheduled daily.
+    """
+    if days is None:
+        days = settings.SCHOOL_NOTIFICATION_ARCHIVE_DAYS
+
+    return ArchivedNotification.objects.archive(
+        timezone.now() - datetime.timedelta(days=days))
+
+
+@shared_task
+def deliver_notifications(batch_size=100):
+    """
+    Pushes the notifications whose `deliver_at` is due. Scheduled every
+    minute.
+
+    Due notifications are claimed in batches with `SELECT ... FOR UPDATE
+    SKIP LOCKED` and marked as delivered in the same short transaction, so
+    that workers running the task at the same time share them out and no
+    lock is held during the pushes. Each push is then done on its own: a
+    failed one is put back for `SCHOOL_DELIVERY_RETRY_SECONDS` later,
+    behind the other due notifications, and given up after
+    `SCHOOL_DELIVERY_MAX_ATTEMPTS` attempts, its `deliver_at` cleared.
+    """
+    retry = datetime.timedelta(seconds=settings.SCHOOL_DELIVERY_RETRY_SECONDS)
+    delivered = 0
+
+    while True:
+        with transaction.atomic():
+            notifications = list(Notification.objects.select_for_update(
+                skip_locked=True,
+            ).filter(
+                deliver_at__lte=timezone.now(),
+                delivered_at__isnull=True,
+            ).order_by('deliver_at', 'id')[:batch_size])
+
+            if not notifications:
+                break
+
+            Notification.objects.filter(
+                id__in=[notification.id for notification in notifications],
+            ).update(delivered_at=timezone.now(),
+                     delivery_attempts=F('delivery_attempts') + 1)
+
+        recipients = _recipients(notifications)
+
+        for notification in notifications:
+            try:
+                _push(notification, recipients[notification.id])
+
+            except Exception:
+                attempts = notification.delivery_attempts + 1
+                logger.exception('Push of notification %s failed (attempt '
+                                 '%s)', notification.id, attempts)
+
+                Notification.objects.filter(id=notification.id).update(
+                    delivered_at=None,
+                    deliver_at=timezone.now() + retry
+                    if attempts < settings.SCHOOL_DELIVERY_MAX_ATTEMPTS
+                    else None)
+
+            else:
+                delivered += 1
+
+    return delivered
@@ -2,12 +2,19 @@ import pytz
 import datetime
 import unittest.mock as mock
 
+import requests
+
+from django.conf import settings
 from django.test import TestCase
 from django.test.utils import override_settings
 
-from core.models import User, Notification, Class
+from core.models import User, ArchivedNotification, Notification, Class
 
-from .tasks import push_notification
+from .tasks import (archive_notifications,
+                    deliver_notifications,
+                    push_notification,
+                    push_notifications,
+                    )
 
 
 class PushNotificationTest(TestCase):
@@ -64,7 +71,8 @@ class PushNotificationTest(TestCase):
                     'title': 'New test task',
                     'description': 'A difficult test task',
                     'user': ids,
-                }
+                },
+                timeout=settings.SCHOOL_PUSH_TIMEOUT,
             )
 
     @override_settings(
@@ -109,5 +117,210 @@ class PushNotificationTest(TestCase):
                     'title': 'New test task',
                     'description': 'A difficult test task',
                     'user': ids,
-                }
+                },
+                timeout=settings.SCHOOL_PUSH_TIMEOUT,
             )
+
+    @override_settings(
+        CELERY_TASK_ALWAYS_EAGER=True,
+        SCHOOL_WEBSOCKET_BACKEND_URL='http://111.111.111.111:8888/'
+    )
+    def test_push_notifications(self):
+        to_student = Notification.objects.create(
+            title='New test task',
+            owner=self.user,
+            description='A difficult test task',
+            date=datetime.datetime(2017, 8, 1, 0, 0, 0, 0, pytz.UTC),
+            timestamp=datetime.datetime(2017, 8, 1, 1, 0, 0, 0, pytz.UTC),
+            target_class=None,
+            target_student=self.student1,
+        )
+        to_class = Notification.objects.create(
+            title='New test exam',
+            owner=self.user,
+            description='A difficult test exam',
+            date=datetime.datetime(2017, 8, 2, 0, 0, 0, 0, pytz.UTC),
+            timestamp=datetime.datetime(2017, 8, 1, 1, 0, 0, 0, pytz.UTC),
+            target_class=self.target_class,
+            target_student=None,
+        )
+
+        with mock.patch('requests.get') as requests_get:
+            push_notifications([to_class.id, to_student.id])
+
+            self.assertEqual(requests_get.call_count, 2)
+            requests_get.assert_any_call(
+                'http://111.111.111.111:8888/notification',
+                params={
+                    'id': to_student.id,
+                    'date': '2017-08-01 00:00:00',
+                    'owner': self.user.id,
+                    'target_student': str(self.student1.id),
+                    'target_class': None,
+                    'timestamp': '2017-08-01 01:00:00',
+                    'title': 'New test task',
+                    'description': 'A difficult test task',
+                    'user': ','.join(str(id) for id in sorted([
+                        self.parent1.id,
+                        self.parent2.id,
+                    ])),
+                },
+                timeout=settings.SCHOOL_PUSH_TIMEOUT,
+            )
+            requests_get.assert_any_call(
+                'http://111.111.111.111:8888/notification',
+                params={
+                    'id': to_class.id,
+                    'date': '2017-08-02 00:00:00',
+                    'owner': self.user.id,
+                    'target_student': None,
+                    'target_class': self.target_class.id,
+                    'timestamp': '2017-08-01 01:00:00',
+                    'title': 'New test exam',
+                    'description': 'A difficult test exam',
+                    'user': ','.join(str(id) for id in sorted([
+                        self.parent1.id,
+                        self.parent2.id,
+                        self.parent3.id,
+                        self.parent4.id,
+                    ])),
+                },
+                timeout=settings.SCHOOL_PUSH_TIMEOUT,
+            )
+
+    @override_settings(
+        SCHOOL_WEBSOCKET_BACKEND_URL='http://111.111.111.111:8888/'
+    )
+    def test_deliver_notifications(self):
+        now = datetime.datetime.now(pytz.UTC)
+
+        def create(deliver_at):
+            return Notification.objects.create(
+                title='New test task',
+                owner=self.user,
+                description='A difficult test task',
+                date=now + datetime.timedelta(days=1),
+                deliver_at=deliver_at,
+                target_class=self.target_class,
+            )
+
+        immediate = create(None)
+        due = [create(now - datetime.timedelta(minutes=i)) for i in range(3)]
+        later = create(now + datetime.timedelta(hours=1))
+
+        with mock.patch('requests.get') as requests_get:
+            self.assertEqual(deliver_notifications(batch_size=2), 3)
+
+            # Oldest first.
+            self.assertEqual(
+                [call[1]['params']['id']
+                 for call in requests_get.call_args_list],
+                [n.id for n in reversed(due)])
+            self.assertEqual(
+                requests_get.call_args[1]['params']['user'],
+                ','.join(str(id) for id in sorted([self.parent1.id,
+                                                   self.parent2.id,
+                                                   self.parent3.id,
+                                                   self.parent4.id])))
+
+            self.assertEqual(deliver_notifications(), 0)
+
+        self.assertEqual(
+            set(Notification.objects.filter(
+                delivered_at__isnull=False).values_list('id', flat=True)),
+            set(n.id for n in due))
+        self.assertIsNone(Notification.objects.get(id=later.id).delivered_at)
+        self.assertIsNone(
+            Notification.objects.get(id=immediate.id).delivered_at)
+
+    @override_settings(
+        SCHOOL_WEBSOCKET_BACKEND_URL='http://111.111.111.111:8888/',
+        SCHOOL_DELIVERY_MAX_ATTEMPTS=2,
+    )
+    def test_deliver_notifications_failures(self):
+        now = datetime.datetime.now(pytz.UTC)
+
+        def create(minutes, date=now):
+            return Notification.objects.create(
+                title='New test task',
+                owner=self.user,
+                description='A difficult test task',
+                date=date,
+                deliver_at=now - datetime.timedelta(minutes=minutes),
+                target_class=self.target_class,
+            )
+
+        failing = create(3)
+        undated = create(2, date=None)
+        last = create(1)
+
+        def push(url, params, timeout):
+            if params['id'] == failing.id:
+                raise requests.ConnectionError()
+
+        with mock.patch('requests.get', side_effect=push) as requests_get:
+            # The failed push neither blocks nor repeats the others.
+            self.assertEqual(deliver_notifications(batch_size=1), 2)
+            self.assertEqual(requests_get.call_count, 3)
+            self.assertIsNone(
+                requests_get.call_args_list[1][1]['params']['date'])
+
+            self.assertEqual(deliver_notifications(), 0)
+            self.assertEqual(requests_get.call_count, 3)
+
+        failing = Notification.objects.get(id=failing.id)
+        self.assertIsNone(failing.delivered_at)
+        self.assertEqual(failing.delivery_attempts, 1)
+        self.assertGreater(failing.deliver_at, now)
+
+        for notification in (undated, last):
+            self.assertIsNotNone(
+                Notification.objects.get(id=notification.id).delivered_at)
+
+        # Due again, and given up after the last attempt.
+        Notification.objects.filter(id=failing.id).update(deliver_at=now)
+
+        with mock.patch('requests.get', side_effect=push) as requests_get:
+            self.assertEqual(deliver_notifications(), 0)
+            self.assertEqual(requests_get.call_count, 1)
+
+        failing = Notification.objects.get(id=failing.id)
+        self.assertIsNone(failing.delivered_at)
+        self.assertIsNone(failing.deliver_at)
+        self.assertEqual(failing.delivery_attempts, 2)
+
+
+class ArchiveNotificationsTest(TestCase):
+
+    def setUp(self):
+        from core.management.commands.initadmin import (insert_data_for_tests,
+                                                        init_database)
+        init_database()
+        insert_data_for_tests()
+
+        self.user = User.objects.get(email='ingles.sociales@school.com')
+        self.target_class = Class.objects.get(name='1B')
+
+    @override_settings(SCHOOL_NOTIFICATION_ARCHIVE_DAYS=30)
+    def test_archive_notifications(self):
+        now = datetime.datetime.now(pytz.UTC)
+
+        old, recent = [
+            Notification.objects.create(
+                title='New test task',
+                owner=self.user,
+                description='A difficult test task',
+                date=now - datetime.timedelta(days=days),
+                target_class=self.target_class,
+            )
+            for days in (31, 29)
+        ]
+
+        self.assertEqual(archive_notifications(), 1)
+        self.assertEqual(
+            list(ArchivedNotification.objects.values_list('id', flat=True)),
+            [old.id])
+        self.assertEqual(list(Notification.objects.values_list('id', flat=True)),
+                         [recent.id])
+
+        self.assertEqual(archive_notifications(days=1), 1)